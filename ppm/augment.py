@@ -1,10 +1,11 @@
 from datetime import datetime
 import os
-import networkx as nx
 import logging
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
 
 import globals as glob
 from globals import CONFIG, SUB_CLEAN, SUB_TAG, SUB_OUT
@@ -14,35 +15,173 @@ logger = logging.getLogger(__name__)
 # import _globals as glob
 # from cleaning_functions import clean_powerplantname # Not sure should be requirement for further cleaning at this point
 from duke import duke_cliques
+from utils import bounded_map
+import linkage
+import link_store
+import link_cache
 
-def tag_cliques_for_single_ds(in_df):
+GROUPING_DEFAULTS = {'mode': 'cliques',
+                     'overlap': 'largest',
+                     'max_component_size': 500}
+
+def grouping_config():
+    """
+    Clique grouping settings from config.yaml:clique_grouping, completed by
+    the defaults.
+    """
+    config = dict(GROUPING_DEFAULTS)
+    config.update(CONFIG.get('clique_grouping') or {})
+    return config
+
+def reciprocal_links(n_nodes, one, two, scores=None):
+    """
+    Symmetric sparse matrix of the links between node positions one -> two
+    that exist in both directions, holding the larger score of the two
+    directions (1 for links without score). Self-links and duplicates are
+    dropped.
+    """
+    scores = np.ones(len(one)) if scores is None else np.nan_to_num(np.asarray(scores, dtype=float), nan=1.)
+
+    # Duplicated links keep their highest score
+    links = (pd.DataFrame({'one': one, 'two': two, 'score': scores})
+             .query('one != two')
+             .sort_values('score', ascending=False, kind='mergesort')
+             .drop_duplicates(subset=['one', 'two']))
+    links = sparse.coo_matrix((links.score.to_numpy(), (links.one.to_numpy(), links.two.to_numpy())),
+                              shape=(n_nodes, n_nodes)).tocsr()
+
+    reciprocal = links.minimum(links.T) > 0
+    return links.maximum(links.T).multiply(reciprocal).tocsr()
+
+def _greedy_cliques(adjacency, weights, overlap='largest'):
+    """
+    Partition one connected component (dense boolean adjacency and link
+    score matrices) into cliques. Every node ends up in exactly one clique:
+    with overlap 'largest' a clique grows by the candidate keeping most
+    candidates (nodes shared by several cliques join the largest), with
+    'strongest' by the candidate of highest total score to the clique.
+    Seeds are taken in order of decreasing degree (resp. total score).
+    """
+    n = len(adjacency)
+    labels = np.full(n, -1)
+    seed_key = adjacency.sum(axis=1) if overlap == 'largest' else weights.sum(axis=1)
+
+    n_cliques = 0
+    for seed in np.argsort(-seed_key, kind='mergesort'):
+        if labels[seed] >= 0:
+            continue
+        members = [seed]
+        candidates = adjacency[seed] & (labels < 0)
+        while candidates.any():
+            if overlap == 'largest':
+                gain = (adjacency & candidates).sum(axis=1)
+            else:
+                gain = weights[members].sum(axis=0)
+            gain = np.where(candidates, gain, -np.inf)
+            best = int(np.argmax(gain))
+            members.append(best)
+            candidates &= adjacency[best]
+            candidates[best] = False
+        labels[members] = n_cliques
+        n_cliques += 1
+
+    return labels
+
+def group_labels(n_nodes, one, two, scores=None, mode=None, overlap=None,
+                 max_component_size=None):
+    """
+    Group label (0 .. n_groups - 1) of every node, from the links between
+    node positions one -> two. Only reciprocal links are followed.
+
+    Parameters
+    ----------
+    mode : str, default None
+        'cliques' splits every connected component which is not a clique
+        into cliques (see _greedy_cliques), 'components' groups by connected
+        component. Defaults to config.yaml:clique_grouping
+    overlap : str, default None
+        'largest' or 'strongest', policy for nodes which could join several
+        cliques (see _greedy_cliques)
+    max_component_size : int, default None
+        Components larger than this are not split into cliques but kept as
+        one group (logged), bounding the clique search on dense components
+    """
+    config = grouping_config()
+    mode = config['mode'] if mode is None else mode
+    overlap = config['overlap'] if overlap is None else overlap
+    max_component_size = config['max_component_size'] if max_component_size is None else max_component_size
+    if mode not in ('cliques', 'components'):
+        raise ValueError(f"Unknown grouping mode '{mode}', choose 'cliques' or 'components'")
+    if overlap not in ('largest', 'strongest'):
+        raise ValueError(f"Unknown overlap policy '{overlap}', choose 'largest' or 'strongest'")
+
+    graph = reciprocal_links(n_nodes, np.asarray(one, dtype=int), np.asarray(two, dtype=int), scores)
+    n_components, component = csgraph.connected_components(graph, directed=False)
+    if mode == 'components':
+        return component
+
+    # Components with all their pairs linked are cliques already
+    sizes = np.bincount(component, minlength=n_components)
+    n_links = np.bincount(component[graph.tocoo().row], minlength=n_components)
+    to_split = np.flatnonzero(n_links < sizes * (sizes - 1))
+
+    sub_label = np.zeros(n_nodes, dtype=int)
+    if len(to_split):
+        # Nodes and links sorted by component, so each component is a slice of both
+        node_order = np.argsort(component, kind='mergesort')
+        node_starts = np.concatenate([[0], np.cumsum(sizes)])
+        local_pos = np.empty(n_nodes, dtype=int)
+        local_pos[node_order] = np.arange(n_nodes) - node_starts[component[node_order]]
+
+        edges = graph.tocoo()
+        edge_order = np.argsort(component[edges.row], kind='mergesort')
+        edge_row, edge_col, edge_score = edges.row[edge_order], edges.col[edge_order], edges.data[edge_order]
+        edge_starts = np.concatenate([[0], np.cumsum(n_links)])
+
+        for comp in to_split:
+            nodes = node_order[node_starts[comp]:node_starts[comp + 1]]
+            if len(nodes) > max_component_size:
+                logger.warning(f"Component of {len(nodes)} linked records kept as one group "
+                               f"(larger than max_component_size {max_component_size})")
+                continue
+            comp_edges = slice(edge_starts[comp], edge_starts[comp + 1])
+            weights = np.zeros((len(nodes), len(nodes)))
+            weights[local_pos[edge_row[comp_edges]], local_pos[edge_col[comp_edges]]] = edge_score[comp_edges]
+            sub_label[nodes] = _greedy_cliques(weights > 0, weights, overlap)
+
+    return pd.factorize(pd.MultiIndex.from_arrays([component, sub_label]), sort=True)[0]
+
+def tag_cliques_for_single_ds(in_df, use_saved_dukemap=True):
 
     """
     Locate cliques of units which are determined to belong to the same
     powerplant.  Return the same dataframe with an additional column
     "grouped" which indicates the group that the powerplant is
-    belonging to.
+    belonging to. The clique links of every run are saved to the link
+    store (kind 'intraset', see link_store), replacing those of the
+    previous run. Units are grouped by their reciprocal links, see
+    group_labels.
 
     Parameters
     ----------
     df : pandas.Dataframe or string
         dataframe or csv-file which should be analysed
-    dataduplicates : pandas.Dataframe or string
-        dataframe or name of the csv-linkfile which determines the
-        link within one dataset
+    use_saved_dukemap : bool, default True
+        Reuse the cached clique links of countries whose input rows, duke
+        config and engine are unchanged (see link_cache); only the other
+        countries are run again
     """
 
     def mark_duplicates_in_df(df, dataduplicates):
-        G = nx.DiGraph()
-        G.add_nodes_from(df.index)
-        G.add_edges_from((r.one, r.two) for r in dataduplicates.itertuples())
-        H = G.to_undirected(reciprocal=True)
-
-        grouped = pd.Series(np.nan, index=df.index)
-        for i, inds in enumerate(nx.algorithms.clique.find_cliques(H)):
-            grouped.loc[inds] = i
+        # Units are the index labels, rows sharing a label (non-unique index) share its group
+        labels = df.index.unique()
+        one = labels.get_indexer(dataduplicates.one)
+        two = labels.get_indexer(dataduplicates.two)
+        known = (one >= 0) & (two >= 0)
+        scores = dataduplicates.scores.to_numpy(dtype=float)[known] if 'scores' in dataduplicates else None
 
-        return df.assign(grouped=grouped)
+        grouped = group_labels(len(labels), one[known], two[known], scores)
+        return df.assign(grouped=grouped[labels.get_indexer(df.index)].astype(float))
 
     df = in_df.copy()
     ds_name = df.columns.name
@@ -72,16 +211,78 @@ def tag_cliques_for_single_ds(in_df):
     logger.info(f"Tagging rows in dataset that are sufficiently similar: {ds_name}")
     
     # Country-wise effort to find matching cliques via duke
-    cliques_df = None
-    for country in df.Country.unique():
-        country_extract = df[df.Country == country]
-        dukemap_cliques = duke_cliques(country_extract, country)
-        cliques_df = pd.concat([cliques_df, dukemap_cliques])
-    
+    cliques_func = linkage.find_cliques if linkage.use_numpy_engine() else duke_cliques
+
+    def country_cliques(country_group):
+        country, country_extract = country_group
+        # Countries whose inputs and config are unchanged come from the cache
+        return link_cache.cached_cliques(cliques_func, country_extract, country,
+                                         use_saved=use_saved_dukemap)
+
+    # Country runs are independent (own work directories) and run in parallel
+    country_groups = list(df.groupby('Country', sort=False))
+    weights = [len(country_extract) for _, country_extract in country_groups]
+    dukemap_cliques = bounded_map(country_cliques, country_groups, weights=weights)
+    cliques_df = pd.concat(dukemap_cliques, ignore_index=True) if dukemap_cliques else pd.DataFrame(columns=['one', 'two', 'scores'])
+
+    # Clique links are kept in the link store for later lookups (diagnostics)
+    link_store.save_links('intraset', cliques_df, in_df,
+                          engine='numpy' if linkage.use_numpy_engine() else 'duke',
+                          duke_config="duke_find_cliques.xml")
+
     df = mark_duplicates_in_df(df, cliques_df)
         
     return df
 
+def group_mode(group_codes, n_groups, values):
+    """
+    Most frequent value of each group, as x.mode(dropna=False).at[0] per
+    group: NaN counts as a value, ties go to the smallest value, or to the
+    first occurring one if NaN is among the tied values (as these cannot be
+    sorted).
+
+    Parameters
+    ----------
+    group_codes : numpy.ndarray
+        group (0 .. n_groups - 1) of every value
+    values : array-like
+    """
+    codes, uniques = pd.factorize(values, sort=True)
+    n_uniques = len(uniques)
+    codes = np.where(codes < 0, n_uniques, codes)
+
+    # Count every (group, value) combination, then take the first per group
+    # in order of decreasing count and increasing value (resp. first position)
+    keys, first_pos, counts = np.unique(group_codes.astype(np.int64) * (n_uniques + 1) + codes,
+                                        return_index=True, return_counts=True)
+    key_group, key_code = np.divmod(keys, n_uniques + 1)
+
+    group_starts = np.flatnonzero(np.r_[True, key_group[1:] != key_group[:-1]])
+    tied = counts == np.maximum.reduceat(counts, group_starts)[np.searchsorted(key_group[group_starts], key_group)]
+    n_tied = np.bincount(key_group[tied], minlength=n_groups)
+    nan_tied = np.zeros(n_groups, dtype=bool)
+    nan_tied[key_group[tied & (key_code == n_uniques)]] = True
+    unsorted = (n_tied > 1) & nan_tied
+
+    rank = np.where(unsorted[key_group], first_pos, key_code)
+    best = np.lexsort((rank, -counts, key_group))
+    first = np.ones(len(best), dtype=bool)
+    first[1:] = key_group[best[1:]] != key_group[best[:-1]]
+
+    mode_codes = np.full(n_groups, n_uniques)
+    mode_codes[key_group[best[first]]] = key_code[best[first]]
+    return pd.Index(uniques).append(pd.Index([np.nan])).take(mode_codes)
+
+def group_lists(group_codes, n_groups, values):
+    """
+    Compact (CSR) form of the values of each group: the values ordered by
+    group (in their original order within a group) and the offsets of the
+    groups, values[offsets[i]:offsets[i + 1]] being those of group i.
+    """
+    order = np.argsort(group_codes, kind='mergesort')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(group_codes, minlength=n_groups))])
+    return np.asarray(values, dtype=object)[order], offsets
+
 def aggregate_units_for_single_ds(in_df, pre_clean_name=False,
                     save_dukemap=True,
                     country_wise=True,
@@ -89,23 +290,33 @@ def aggregate_units_for_single_ds(in_df, pre_clean_name=False,
                     ):
 
     """
-    Vertical cleaning of the database. Cleans the "Name"-column, sums
-    up the capacity of powerplant units which are determined to belong
-    to the same plant.
+    Vertical cleaning of the database. Sums up the capacity of powerplant
+    units which are determined to belong to the same plant (column
+    'grouped', see tag_cliques_for_single_ds).
+
+    Text columns take the most frequent value of a plant's units (see
+    group_mode), projectID the list and EIC the distinct values of its
+    units (see group_lists). The clique maps behind 'grouped' are cached per
+    country by tag_cliques_for_single_ds(use_saved_dukemap=...), the
+    use_saved_dukemap argument here has no effect.
     """
 
     # Work-up / final clean of aggreated, plant-level dataframe
     
     # Set the method to which units are grouped up into plants / data selected
 
-    def mode(x):
-        return x.mode(dropna=False).at[0]
+    df = in_df
+    ds_name = df.columns.name
+    weighted_cols = [col for col in ['Efficiency', 'Duration']
+                     if col in CONFIG['target_columns']]
 
-    agg_methods_dict = {'Name': mode,
-         'Fueltype': mode,
-         'Technology': mode,
-         'Set': mode,
-         'Country': mode,
+    agg_methods_dict = {'OrigName': 'mode',
+         'PlantName': 'mode',
+         'KeywordName': 'mode',
+         'Fueltype': 'mode',
+         'Technology': 'mode',
+         'Set': 'mode',
+         'Country': 'mode',
          'Capacity': 'sum',
          'lat': 'mean',
          'lon': 'mean',
@@ -113,9 +324,9 @@ def aggregate_units_for_single_ds(in_df, pre_clean_name=False,
          'DateRetrofit': 'max',  # choose latest Retrofit-Year
          'DateMothball': 'min',
          'DateOut': 'min',
-         'File': mode,
-         'projectID': list,
-         'EIC': set,
+         'File': 'mode',
+         'projectID': 'list',
+         'EIC': 'set',
          'Duration': 'sum',  # note this is weighted sum
          'Volume_Mm3': 'sum',
          'DamHeight_m': 'sum',
@@ -123,21 +334,36 @@ def aggregate_units_for_single_ds(in_df, pre_clean_name=False,
          'Efficiency': 'mean'  # note this is weighted mean
          }
 
-    props_for_groups = pd.Series(agg_methods_dict).reindex(CONFIG['target_columns'], axis=1).to_dict()
-    df = df.groupby('grouped').agg(props_for_groups)
-    df = df.replace('nan', np.nan)
+    props_for_groups = {col: method for col, method in agg_methods_dict.items()
+                        if col in CONFIG['target_columns'] and col in df}
+
+    df = df[df.grouped.notna()]
+    group_codes, group_keys = pd.factorize(df.grouped, sort=True)
+    n_groups = len(group_keys)
 
-    if 'EIC' in df:
-        df = df.assign(EIC=df['EIC'].apply(list))
+    # Numeric columns by the groupby kernels, the others column-wise on the group codes
+    numeric_methods = {col: method for col, method in props_for_groups.items()
+                       if method not in ('mode', 'list', 'set')}
+    agg_df = df.groupby(group_codes)[list(numeric_methods)].agg(numeric_methods) if numeric_methods \
+             else pd.DataFrame(index=np.arange(n_groups))
+
+    for col, method in props_for_groups.items():
+        if method == 'mode':
+            agg_df[col] = group_mode(group_codes, n_groups, df[col]).to_numpy()
+        elif method in ('list', 'set'):
+            values, offsets = group_lists(group_codes, n_groups, df[col])
+            make = list if method == 'list' else lambda chunk: list(set(chunk))
+            agg_df[col] = [make(values[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+    df = agg_df.replace('nan', np.nan)
 
     df = (df
           .assign(**{col: df[col].div(df['Capacity'])
-                     for col in weighted_cols})
+                     for col in weighted_cols if col in df})
           .reset_index(drop=True)
-          .pipe(clean_powerplantname)
           .reindex(columns=CONFIG['target_columns'])
           )
 
     df.columns.name = ds_name
 
-    return df
\ No newline at end of file
+    return df
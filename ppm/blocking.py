@@ -0,0 +1,237 @@
+"""
+Candidate-pair blocking for linking and clique tagging. Instead of comparing
+every record of a country block with every other one, only pairs that share
+a name token (inverted index on KeywordName) or lie in neighbouring cells of
+a lat/lon grid sized to the geo comparator's max-distance are emitted.
+Optionally, pairs in clearly different capacity bands are dropped afterwards,
+only for schemas where capacity carries real evidence (see
+capacity_bands_apply).
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from globals import CONFIG
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+BLOCKING_DEFAULTS = {'enabled': False,
+                     'name_col': 'KeywordName',
+                     'max_token_pairs': 250000,
+                     'capacity_bands_per_decade': 0,
+                     'capacity_band_tolerance': 1,
+                     'capacity_max_low': 0.3}
+
+def blocking_config():
+    """
+    Blocking settings from config.yaml:blocking, completed by the defaults.
+    """
+    config = dict(BLOCKING_DEFAULTS)
+    config.update(CONFIG.get('blocking') or {})
+    return config
+
+def _name_tokens(df, name_col):
+    """
+    Long table of (position, token) for all distinct lower-cased name tokens.
+    """
+    if name_col not in df:
+        return pd.DataFrame({'pos': np.array([], dtype=int), 'token': np.array([], dtype=object)})
+
+    names = pd.Series(df[name_col].values).dropna().astype(str).str.lower().str.split()
+    tokens = names.explode().dropna()
+    tokens = pd.DataFrame({'pos': tokens.index.values, 'token': tokens.values})
+    return tokens.drop_duplicates()
+
+def _name_pairs(df_A, df_B, name_col, max_token_pairs):
+    """
+    Pairs sharing at least one name token. Tokens that would generate more
+    than max_token_pairs pairs on their own (very common words) are skipped.
+    """
+    tokens_a = _name_tokens(df_A, name_col)
+    tokens_b = _name_tokens(df_B, name_col)
+
+    counts = (tokens_a.token.value_counts()
+              .mul(tokens_b.token.value_counts(), fill_value=0))
+    common = counts[(counts > 0) & (counts <= max_token_pairs)].index
+    if len(counts[counts > max_token_pairs]):
+        logger.debug(f"Skipping frequent name tokens in blocking: {list(counts[counts > max_token_pairs].index)}")
+
+    pairs = (tokens_a[tokens_a.token.isin(common)]
+             .merge(tokens_b[tokens_b.token.isin(common)], on='token', suffixes=('_a', '_b')))
+
+    return pairs.pos_a.to_numpy(dtype=np.int64), pairs.pos_b.to_numpy(dtype=np.int64)
+
+def _latlon(df):
+
+    lat = pd.to_numeric(df['lat'], errors='coerce').to_numpy(dtype=float) if 'lat' in df else np.full(len(df), np.nan)
+    lon = pd.to_numeric(df['lon'], errors='coerce').to_numpy(dtype=float) if 'lon' in df else np.full(len(df), np.nan)
+    return lat, lon
+
+def _geo_pairs(df_A, df_B, max_distance):
+    """
+    Pairs in the same or a neighbouring cell of a lat/lon grid whose cells
+    are at least max_distance wide, so that no pair closer than max_distance
+    is missed.
+    """
+    lat_a, lon_a = _latlon(df_A)
+    lat_b, lon_b = _latlon(df_B)
+
+    lats = np.concatenate([lat_a, lat_b])
+    if np.isnan(lats).all():
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    lat_step = max_distance / METERS_PER_DEGREE_LAT
+    # Longitude cells are sized for the most poleward record, wide enough everywhere else
+    max_abs_lat = min(np.nanmax(np.abs(lats)), 89.0)
+    lon_step = lat_step / np.cos(np.radians(max_abs_lat))
+
+    def cells(lat, lon):
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        pos = np.flatnonzero(valid)
+        return pos, np.floor(lat[valid] / lat_step).astype(np.int64), np.floor(lon[valid] / lon_step).astype(np.int64)
+
+    pos_a, row_a, col_a = cells(lat_a, lon_a)
+    pos_b, row_b, col_b = cells(lat_b, lon_b)
+
+    cells_a = pd.DataFrame({'pos_a': pos_a, 'row': row_a, 'col': col_a})
+    neighbours = [pd.DataFrame({'pos_b': pos_b, 'row': row_b + d_row, 'col': col_b + d_col})
+                  for d_row in (-1, 0, 1) for d_col in (-1, 0, 1)]
+    pairs = cells_a.merge(pd.concat(neighbours, ignore_index=True), on=['row', 'col'])
+
+    return pairs.pos_a.to_numpy(dtype=np.int64), pairs.pos_b.to_numpy(dtype=np.int64)
+
+def _capacity_bands(df, bands_per_decade):
+
+    if 'Capacity' not in df:
+        return np.full(len(df), np.nan)
+    capacity = pd.to_numeric(df['Capacity'], errors='coerce').to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bands = np.floor(np.log10(np.where(capacity > 0, capacity, np.nan)) * bands_per_decade)
+    return bands
+
+def candidate_pairs(df_A, df_B=None, max_distance=5000, report=True, capacity_bands=False):
+    """
+    Candidate pairs for linking df_A with df_B, or for deduplicating df_A
+    against itself if df_B is None (then only pairs pos_a < pos_b are
+    returned).
+
+    Records without any name token and without coordinates cannot be blocked
+    and are paired with every record of the other side.
+
+    Parameters
+    ----------
+    df_A, df_B : pandas.DataFrame
+        Records of one country block
+    max_distance : float, default 5000
+        Max-distance (in meters) of the geo comparator in the duke schema
+    report : bool, default True
+        Log the pair-reduction statistics
+    capacity_bands : bool, default False
+        Drop pairs in clearly different capacity bands (if
+        capacity_bands_per_decade is set), see capacity_bands_apply
+
+    Returns
+    -------
+    pos_a, pos_b : numpy arrays of positions into df_A / df_B
+    stats : dict with the pair-reduction statistics
+    """
+    config = blocking_config()
+    self_link = df_B is None
+    if self_link:
+        df_B = df_A
+
+    n_a, n_b = len(df_A), len(df_B)
+    full_pairs = n_a * (n_a - 1) // 2 if self_link else n_a * n_b
+
+    name_a, name_b = _name_pairs(df_A, df_B, config['name_col'], config['max_token_pairs'])
+    geo_a, geo_b = _geo_pairs(df_A, df_B, max_distance)
+
+    def unblockable(df):
+        lat, lon = _latlon(df)
+        no_geo = np.isnan(lat) | np.isnan(lon)
+        no_name = (df[config['name_col']].isnull().to_numpy() if config['name_col'] in df
+                   else np.ones(len(df), dtype=bool))
+        return np.flatnonzero(no_geo & no_name)
+
+    loose_a, loose_b = unblockable(df_A), unblockable(df_B)
+    all_a = [name_a, geo_a, np.repeat(loose_a, n_b), np.tile(np.arange(n_a), len(loose_b))]
+    all_b = [name_b, geo_b, np.tile(np.arange(n_b), len(loose_a)), np.repeat(loose_b, n_a)]
+
+    pos_a = np.concatenate(all_a).astype(np.int64)
+    pos_b = np.concatenate(all_b).astype(np.int64)
+
+    if self_link:
+        pos_a, pos_b = np.minimum(pos_a, pos_b), np.maximum(pos_a, pos_b)
+        keep = pos_a < pos_b
+        pos_a, pos_b = pos_a[keep], pos_b[keep]
+
+    keys = np.unique(pos_a * max(n_b, 1) + pos_b)
+    pos_a, pos_b = keys // max(n_b, 1), keys % max(n_b, 1)
+    blocked_pairs = len(pos_a)
+
+    bands_per_decade = config['capacity_bands_per_decade']
+    if capacity_bands and bands_per_decade:
+        band_a = _capacity_bands(df_A, bands_per_decade)[pos_a]
+        band_b = _capacity_bands(df_B, bands_per_decade)[pos_b]
+        same_band = ~(np.abs(band_a - band_b) > config['capacity_band_tolerance'])
+        pos_a, pos_b = pos_a[same_band], pos_b[same_band]
+
+    stats = {'records_A': n_a,
+             'records_B': n_b,
+             'full_pairs': full_pairs,
+             'name_pairs': len(name_a),
+             'geo_pairs': len(geo_a),
+             'unblocked_records': len(loose_a) + (0 if self_link else len(loose_b)),
+             'blocked_pairs': blocked_pairs,
+             'candidate_pairs': len(pos_a),
+             'reduction': 1 - len(pos_a) / full_pairs if full_pairs else 0.0}
+
+    if report:
+        ds_label = df_A.columns.name if self_link else f"{df_A.columns.name} - {df_B.columns.name}"
+        logger.info(f"Blocking {ds_label}: {stats['candidate_pairs']} of {full_pairs} pairs "
+                    f"remain ({100 * stats['reduction']:.1f}% reduction)")
+
+    return pos_a, pos_b, stats
+
+def prune_to_candidates(df_A, df_B=None, max_distance=5000, capacity_bands=False):
+    """
+    For engines that cannot take candidate pairs (Duke's InMemoryDatabase),
+    drop all records without any candidate pair. Returns the pruned frames
+    (only df_A if df_B is None) and the blocking statistics.
+    """
+    pos_a, pos_b, stats = candidate_pairs(df_A, df_B, max_distance=max_distance,
+                                          capacity_bands=capacity_bands)
+
+    if df_B is None:
+        keep = np.union1d(pos_a, pos_b)
+        return df_A.iloc[keep], stats
+
+    return df_A.iloc[np.unique(pos_a)], df_B.iloc[np.unique(pos_b)], stats
+
+def geo_max_distance(schema):
+    """
+    Max-distance (meters) of the geoposition comparator in a duke schema.
+    """
+    for prop in schema['properties'].values():
+        if prop['comparator'] == 'GeopositionComparator':
+            return float(prop['params'].get('max-distance', 5000))
+    return 5000.0
+
+def capacity_bands_apply(schema):
+    """
+    True if the capacity band filter is switched on (capacity_bands_per_decade)
+    and the duke schema has a numeric property with a low probability of at
+    most capacity_max_low, i.e. one where a capacity mismatch does rule out
+    a link. For schemas with a neutral capacity (e.g. low 0.49 / high 0.51)
+    the filter would drop pairs Duke links on name and location alone.
+    """
+    config = blocking_config()
+    if not config['capacity_bands_per_decade']:
+        return False
+
+    return any(prop['comparator'] == 'NumericComparator' and prop['low'] <= config['capacity_max_low']
+               for prop in schema['properties'].values())
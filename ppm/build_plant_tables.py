@@ -2,6 +2,7 @@ import os
 import logging
 import pandas as pd
 
+import globals as glob
 from globals import CONFIG, DATASET_LABELS, SUB_OUT
 # from core import _set_path
 
@@ -37,21 +38,24 @@ def build_plant_df_alldata(dfs, custom_config={}, **dukeargs):
     **dukeargs : keyword-args for duke
     """
 
-    plants_alldata_df = match.combine_multiple_datasets(dfs, use_saved_matches=True, **dukeargs)
+    # Long form (one row per plant and contributing dataset), see match.wide_view for the wide form
+    plants_alldata_df = match.combine_multiple_datasets(dfs, use_saved_matches=True, long=True, **dukeargs)
     
     # This type set should already be part of tidying / normalization, note at this stage
     plants_alldata_df.assign( projectID=lambda df: df.projectID.astype(str) )
     
     datasets_filetag = '_'.join(DATASET_LABELS)
-    outfn_alldata = _set_path(f'plants_list-ALLDATA_{datasets_filetag}.csv', SUB_OUT)
-    plants_alldata_df.to_csv(outfn_alldata, index_label='id')
+    outfn_alldata = glob.set_path(f'plants_list-ALLDATA_{datasets_filetag}.csv', SUB_OUT)
+    match.wide_view(plants_alldata_df).to_csv(outfn_alldata, index_label='id')
+    outfn_long = glob.set_path(f'plants_long-ALLDATA_{datasets_filetag}.csv', SUB_OUT)
+    plants_alldata_df.to_csv(outfn_long, index=False)
 
     return plants_alldata_df
 
 def build_plant_df_reduced(plants_alldata_df):
 
     data_set_str = '_'.join(DATASET_LABELS)
-    outfn_reduced = _set_path(f'plants_list_{data_set_str}.csv', SUB_OUT)
+    outfn_reduced = glob.set_path(f'plants_list_{data_set_str}.csv', SUB_OUT)
 
     # logger.info('Collect combined dataset for {}'.format(', '.join(datasets)))
     
@@ -2,16 +2,20 @@
 Functions for vertically cleaning a dataset.
 """
 
-# import os
+import os
+from os import path
 import csv
 import re
+import ast
+import hashlib
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 import networkx as nx
 import logging
 
 import globals as glob
-from globals import CONFIG
+from globals import CONFIG, SUB_CLEAN
 from utils import get_name
 # from diagnostics import save_debug, build_ids_list
 from diagnostics import build_ids_list
@@ -19,6 +23,11 @@ import file_handling as fh
 
 logger = logging.getLogger(__name__)
 
+# Bump when the name normalization changes, to invalidate the name caches
+NAME_NORMALIZATION_VERSION = 1
+NAME_COLS = ['UnitTag', 'PlantName', 'KeywordName']
+NAME_CACHE_NA = '<NA>'
+
 def add_geoposition_for_duke(in_df):
     """
     Returns the same pandas.Dataframe with an additional column "Geoposition"
@@ -36,9 +45,48 @@ def add_geoposition_for_duke(in_df):
 
     return out_df
 
-def clean_name(in_df, common_word_threshold_count=10):
+def _word_alternation(words):
+    """
+    One compiled pattern dropping any of the words (with the whitespace in
+    front of it), equivalent to replacing them one after another with
+    '(?i)(^|\s)word(?=\s|$)'. Longer words are tried first, so that phrases
+    win over their single words.
+    """
+    alternatives = sorted((re.escape(word) for word in words), key=lambda word: (-len(word), word))
+    return re.compile(r'(^|\s)(?:' + '|'.join(alternatives) + r')(?=\s|$)', re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def stop_word_tables():
+    """
+    Stop word patterns for clean_name, read and compiled once per session:
+
+    {'name_drop': pattern of the words dropped from PlantName,
+     'keyword_drop': pattern of the words dropped from KeywordName,
+     'keyword_white_words': frozenset of the words kept in KeywordName}
+
+    Amongst the stop words, GEO, SUB, PREP and SITE type words (see
+    stop_word_types.csv) are retained in PlantName but not in KeywordName.
+    """
+    # stop_words = company designators, common sub-words, general names for plants, etc.
+    # words list that is either or both a) adds clutter, and/or b) NOT be overly relevant for matching
+    stop_words_df = pd.read_csv(glob.ref_data('stop_words.csv'), encoding='UTF-8')
+    stop_word_types_df = pd.read_csv(glob.package_data('stop_word_types.csv'), index_col='word_type')
+
+    name_drop_types = frozenset( stop_word_types_df[stop_word_types_df.name_retain != 1].index )
+    gross_name_drop_words = set( stop_words_df[ stop_words_df.word_type.isin(name_drop_types) ].word_string )
+    name_white_words = set( stop_words_df[stop_words_df.retain_in_name == 1].word_string )
+
+    gross_keyword_drop_words = set( stop_words_df['word_string'] )
+    keyword_white_words = frozenset( stop_words_df[stop_words_df.retain_in_keyword == 1].word_string )
+
+    return {'name_drop': _word_alternation(gross_name_drop_words - name_white_words),
+            'keyword_drop': _word_alternation(gross_keyword_drop_words - keyword_white_words),
+            'keyword_white_words': keyword_white_words}
+
+def _normalize_names(orig_names):
     """
-   
+    The name normalization pipeline: UnitTag, PlantName and KeywordName of
+    each name of the series orig_names, as a dataframe with its index.
     """
 
     def substitute_regex_patterns(in_names):
@@ -143,8 +191,7 @@ def clean_name(in_df, common_word_threshold_count=10):
     # Consider retaning all rows, even null
     # out_df = in_df[in_df.OrigName.notnull()]
 
-    out_df = in_df.copy()
-    orig_names = out_df['OrigName']
+    out_df = pd.DataFrame(index=orig_names.index)
 
     # Work-up something that does all caps on identified acronyms in plant names
     acronyms = ["HKW", "MVM"]
@@ -170,26 +217,10 @@ def clean_name(in_df, common_word_threshold_count=10):
     # =====================
     clean_plant_names_pre_stop = clean_dross(plant_names) # Starting point for both PlantName and KeywordName
  
-    # stop_words = company designators, common sub-words, general names for plants, etc.
-    # words list that is either or both a) adds clutter, and/or b) NOT be overly relevant for matching
-    stop_word_spec = glob.ref_data('stop_words.csv')    
-    stop_words_df = pd.read_csv(stop_word_spec, encoding='UTF-8')
-
-    # white_word_spec = glob.ref_data('white_words.txt')
-    # white_words = fh.load_text_to_list(white_word_spec)
-    # white_words = set(white_words)
-
-    # Amongs stop words, GEO, SUB, PREP, and SITE type words are RETAINED in PlantName (but not keywords)
-    stop_word_types_spec = glob.package_data('stop_word_types.csv')
-    stop_word_types_df = pd.read_csv(stop_word_types_spec, index_col='word_type')
-    name_drop_types = frozenset( stop_word_types_df[stop_word_types_df.name_retain != 1].index )
-    gross_name_drop_words = set( stop_words_df[ stop_words_df.word_type.isin(name_drop_types) ].word_string )
+    # Stop words are dropped in a single pass of one compiled pattern (see stop_word_tables)
+    stop_words = stop_word_tables()
 
-    name_white_words = set( stop_words_df[stop_words_df.retain_in_name == 1].word_string )
-    name_drop_words = gross_name_drop_words - name_white_words
-
-    name_drop_pattern = [('(?i)(^|\s)'+ word +'(?=\s|$)') for word in name_drop_words]
-    clean_plant_names = clean_plant_names_pre_stop.replace(value=' ', to_replace=name_drop_pattern, regex=True)
+    clean_plant_names = clean_plant_names_pre_stop.str.replace(stop_words['name_drop'], ' ', regex=True)
     
     clean_plant_names = clean_plant_names.replace(value=r"'", to_replace=quote_code, regex=True)
 
@@ -207,24 +238,87 @@ def clean_name(in_df, common_word_threshold_count=10):
 
     # BUILD KEYWORD NAME
     # ==================
-    gross_keyword_drop_words = set( stop_words_df['word_string'] )
-    keyword_white_words = set( stop_words_df[stop_words_df.retain_in_keyword == 1].word_string )
-    keyword_drop_words = gross_keyword_drop_words - keyword_white_words
-
-    keyword_drop_pattern = [('(?i)(^|\s)' + word + '(?=\s|$)') for word in keyword_drop_words]
-    keyword_names = clean_plant_names_pre_stop.replace(value=' ', to_replace=keyword_drop_pattern, regex=True)
+    keyword_names = clean_plant_names_pre_stop.str.replace(stop_words['keyword_drop'], ' ', regex=True)
     
     keyword_names = keyword_names.replace(value=r"'", to_replace=quote_code, regex=True)
     keyword_names = keyword_names.replace(['\s+'], [' ',], regex=True) # multi-space
     keyword_names = keyword_names.str.strip()
     out_df['KeywordName'] = keyword_names.str.title()
 
-    
+    return out_df
+
+def name_cache_version():
+    """
+    Version hash of the name normalization, over the stop word tables and
+    NAME_NORMALIZATION_VERSION. Cached names of other versions are not used.
+    """
+    sha = hashlib.sha1(str(NAME_NORMALIZATION_VERSION).encode('utf-8'))
+    for table_spec in [glob.ref_data('stop_words.csv'), glob.package_data('stop_word_types.csv')]:
+        with open(table_spec, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+def _name_cache_spec():
+
+    cache_dir = glob.set_path('.', SUB_CLEAN)
+    os.makedirs(cache_dir, exist_ok=True)
+    return path.join(cache_dir, f"name_cache_{name_cache_version()}.csv")
+
+def normalize_names(orig_names, use_cache=True):
+    """
+    UnitTag, PlantName and KeywordName of every distinct name in
+    orig_names, as a dataframe indexed by the name.
+
+    Normalization depends on the name alone, so it runs once per distinct
+    name. With use_cache, names normalized by earlier runs with the same
+    stop word tables are read from the name cache (02_cleaned), and only
+    unseen names are normalized and added to it.
+    """
+    names = pd.Series(pd.unique(orig_names), dtype=object)
+    is_text = names.map(lambda name: isinstance(name, str))
+
+    cache_spec = _name_cache_spec()
+    cached = pd.DataFrame(columns=NAME_COLS)
+    if use_cache and path.exists(cache_spec):
+        cached = pd.read_csv(cache_spec, index_col='OrigName', dtype=str, encoding='utf-8',
+                             keep_default_na=False, na_values=[NAME_CACHE_NA])
+        cached = cached[~cached.index.duplicated()]
+
+    known = is_text & names.isin(cached.index)
+    new_names = names[~known]
+    normalized = _normalize_names(new_names).set_axis(pd.Index(new_names, dtype=object), axis=0)
+
+    if use_cache and (is_text & ~known).any():
+        normalized[is_text[~known].to_numpy()].to_csv(cache_spec, mode='a', header=not path.exists(cache_spec),
+                                                      index_label='OrigName', na_rep=NAME_CACHE_NA,
+                                                      encoding='utf-8')
+
+    logger.debug(f"Normalized {len(new_names)} of {len(names)} distinct names, "
+                 f"{int(known.sum())} from the name cache")
+
+    return pd.concat([cached.loc[names[known]], normalized])
+
+def clean_name(in_df, common_word_threshold_count=10, use_name_cache=True):
+    """
+    Add UnitTag, PlantName and KeywordName, normalized from OrigName (see
+    normalize_names), and report frequent KeywordName words that are not
+    stop words yet.
+    """
+    out_df = in_df.copy()
+    orig_names = out_df['OrigName']
+
+    normalized = normalize_names(orig_names, use_cache=use_name_cache)
+    for col in NAME_COLS:
+        out_df[col] = orig_names.map(normalized[col])
+
+    keyword_white_words = stop_word_tables()['keyword_white_words']
+    keyword_names = out_df['KeywordName'].str.lower()
+
     # COMMON WORD EVALUATION
     # =================================================================================
     # After defined stop word removal, evaluation of frequently occurring words
     # for potential stop_word dictionary development (so excludes words already white-listed)
-    cw_series = pd.Series( sum(keyword_names.str.split(), [])).value_counts()
+    cw_series = keyword_names.str.split().explode().value_counts()
     cw_set = set( cw_series[cw_series >= common_word_threshold_count].index )
     report_cw_set = cw_set - keyword_white_words
 
@@ -294,146 +388,210 @@ def list_from_string(text_str, separators):
 
     return out_list
 
-def parse_fuel_cols(df, esource_col, raw_primary_col, raw_secondary_col=None):
-
-    def modify_fuel_label(in_text):
-
-        multi_whitespace = re.compile(r"\s+")
-        out_text = multi_whitespace.sub(" ", in_text).strip()
-        out_text = out_text.lower()
-
-        for from_word, vals in word_mod_dict.items():
-            to_word = vals['to_word']
-            if out_text == from_word:
-                out_text = to_word
-
-        if in_text != out_text:
-            stop = True
-
-        return out_text
-
-    def process_fuel_string(fuel_str):
-
-        fuels_list = []
-        separators = ['\,', ' and ', '\/', '\(', '\)', ' or ', ' & ']
-        orig_fuels_list = list_from_string(fuel_str, separators)
-
-        for fuel in orig_fuels_list:
-            new_fuel = modify_fuel_label(fuel)
-            fuel_label = fuel_label_lookup_dict.get(new_fuel, new_fuel)
-            if fuel_label != "":
-                fuels_list.append(fuel_label)
-
-        return fuels_list
-
-    def build_lookup_dict(fuel_tree_df):
+FUEL_SEPARATORS = [r'\,', ' and ', r'\/', r'\(', r'\)', ' or ', ' & ']
 
-        lookup_dict = {}
-        for idx, row_data in fuel_tree_df.iterrows():
-            syns = row_data['syns']
-            if pd.notnull(syns):
-                syns = eval(syns)
-            else:
-                syns = set()
-
-            abbs = row_data['abbs']
-            if pd.notnull(abbs):
-                abbs = eval(abbs)
-            else:
-                abbs = set()
-
-            test_words = syns.union(abbs) # Add together synonyms and abbreviations
-            for fuel_word in test_words:
-                # lookup_dict[fuel_word] = row_data['fuel_label']
-                lookup_dict[fuel_word] = idx
-
-        return lookup_dict
-
-    def find_fuel_hierarchy(fuel, tree_df):
-
-        try:
-            row_data = tree_df.loc[fuel]
-            if row_data.fuel_level == 1: # Top-level esource designation only
-                fuel_species = ""
-                fuel_genus = ""
-
-            elif row_data.fuel_level == 2: # Genus-level indicator
-                fuel_species = ""
-                fuel_genus = fuel
-
-            elif row_data.fuel_level == 3: # Species-level designation, so must have fuel_genus value in table
-                fuel_species = fuel
-                fuel_genus = row_data.fuel_genus
+@lru_cache(maxsize=None)
+def fuel_tables():
+    """
+    Fuel lookup tables for parse_fuel_cols, read and parsed once per session:
 
-            esource_id = row_data['esource_id']
-            
-        except:
-            print(fuel)
-            fuel_species = ""
-            fuel_genus = ""
-            esource_id = ""
-            stop = True
-            
-        return fuel_species, fuel_genus, esource_id
+    {'word_mods': {from_word: to_word} from fuel_mods.csv (in file order),
+     'labels': {synonym or abbreviation: fuel_label} from fuel_tree.csv,
+     'hierarchy': pandas.Dataframe of FuelSpecies, FuelGenus and esource_id
+                  indexed by fuel_label}
+    """
+    word_mod_dict = fh.load_csv_to_dict(glob.package_data("fuel_mods.csv"))
+    word_mods = {from_word: vals['to_word'] for from_word, vals in word_mod_dict.items()}
+
+    fuel_tree_df = pd.read_csv(glob.package_data("fuel_tree.csv"), index_col='fuel_label')
+
+    labels = {}
+    for fuel_label, syns, abbs in zip(fuel_tree_df.index, fuel_tree_df['syns'], fuel_tree_df['abbs']):
+        test_words = set()  # Add together synonyms and abbreviations
+        for words in [syns, abbs]:
+            if pd.notnull(words):
+                test_words |= ast.literal_eval(words)
+        labels.update(dict.fromkeys(test_words, fuel_label))
+
+    # Level 1: top-level esource designation only, 2: genus-level indicator,
+    # 3: species-level designation, so must have fuel_genus value in table
+    level = fuel_tree_df['fuel_level']
+    hierarchy = pd.DataFrame({'FuelSpecies': np.where(level == 3, fuel_tree_df.index, ""),
+                              'FuelGenus': np.where(level == 2, fuel_tree_df.index,
+                                                    np.where(level == 3, fuel_tree_df['fuel_genus'], "")),
+                              'esource_id': fuel_tree_df['esource_id']},
+                             index=fuel_tree_df.index)
+    hierarchy.loc[~level.isin([1, 2, 3]), :] = ""
+    hierarchy = hierarchy[~hierarchy.index.duplicated(keep=False)]
+
+    return {'word_mods': word_mods, 'labels': labels, 'hierarchy': hierarchy}
+
+def _fuel_label(fuel):
+    """
+    Fuel label of one (stripped) part of a fuel string: whitespace collapsed,
+    lower case, modified by fuel_mods.csv and looked up in fuel_tree.csv.
+    """
+    tables = fuel_tables()
 
-    word_mod_fn = "fuel_mods.csv"
-    word_mod_spec = glob.package_data(word_mod_fn)
-    word_mod_dict = fh.load_csv_to_dict(word_mod_spec)
+    out_text = re.sub(r"\s+", " ", fuel).strip().lower()
+    for from_word, to_word in tables['word_mods'].items():
+        if out_text == from_word:
+            out_text = to_word
 
-    fuel_tree_fn = "fuel_tree.csv"
-    fuel_tree_spec = glob.package_data(fuel_tree_fn)
-    fuel_tree_df = pd.read_csv(fuel_tree_spec, index_col='fuel_label')
+    return tables['labels'].get(out_text, out_text)
 
-    fuel_label_lookup_dict = build_lookup_dict(fuel_tree_df)
+def parse_fuel_cols(df, esource_col, raw_primary_col, raw_secondary_col=None):
+    """
+    Parse the raw primary (and secondary) fuel columns into PrimaryFuel,
+    FuelSpecies, FuelGenus, esource_id and SecondaryFuels (string of the set
+    of further fuels). The fuel strings are split at FUEL_SEPARATORS, each
+    distinct part is labelled once (see _fuel_label) and the first label of
+    a row becomes its PrimaryFuel; rows without any fuel fall back to the
+    lower-cased esource_col. The columns are set on df, which is returned.
+    """
+    tables = fuel_tables()
+
+    raw_cols = [raw_primary_col] + ([raw_secondary_col] if raw_secondary_col is not None else [])
+    positions = np.arange(len(df))
+
+    # One row per fuel part, primary parts before secondary parts of a row
+    parts = pd.concat([df[col].set_axis(positions, axis=0).dropna()
+                          .str.split('|'.join(FUEL_SEPARATORS), regex=True)
+                          .explode().str.strip()
+                       for col in raw_cols])
+    parts = parts[parts.notna() & (parts != "")].sort_index(kind='mergesort')
+
+    distinct_parts = parts.unique()
+    labels = parts.map(dict(zip(distinct_parts, map(_fuel_label, distinct_parts))))
+    labels = labels[labels != ""]
+
+    label_pos = labels.index.to_numpy()
+    first = np.r_[True, label_pos[1:] != label_pos[:-1]] if len(labels) else np.array([], dtype=bool)
+
+    primary = pd.Series(np.nan, index=positions, dtype=object)
+    primary[label_pos[first]] = labels.to_numpy()[first]
+
+    # Only load 'type' column into fuels list if nothing else to go on
+    esource = df[esource_col].set_axis(positions, axis=0)
+    fallback = primary.isna() & esource.map(lambda x: isinstance(x, str) and x != "")
+    primary[fallback] = esource[fallback].str.lower()
+    if primary.isna().any():
+        logger.warning(f"Nothing to go on for the fuel of {int(primary.isna().sum())} rows")
+
+    secondary = pd.Series("", index=positions, dtype=object)
+    if (~first).any():
+        further = labels[~first]
+        secondary_sets = further.groupby(level=0, sort=False).agg(lambda fuels: str(set(fuels)))
+        secondary[secondary_sets.index] = secondary_sets.to_numpy()
+
+    # Fuels missing in fuel_tree.csv get no hierarchy
+    hierarchy = tables['hierarchy'].reindex(primary.to_numpy())
+    unknown = ~primary.isin(tables['hierarchy'].index).to_numpy()
+    hierarchy[unknown] = ""
+    unknown_fuels = primary[unknown].dropna().unique()
+    if len(unknown_fuels):
+        logger.warning(f"Fuels not in fuel_tree.csv, no hierarchy assigned: {sorted(unknown_fuels)}")
+
+    df['PrimaryFuel'] = primary.to_numpy()
+    for col in ['FuelSpecies', 'FuelGenus', 'esource_id']:
+        df[col] = hierarchy[col].to_numpy()
+    df['SecondaryFuels'] = secondary.to_numpy()
 
-    col_sep = "^"
-    primary_col_list = []
-    secondary_col_list = []
-    for idx, row_data in df.iterrows():
-        
-        fuels_list = []
-        if pd.notnull(row_data[raw_primary_col]):
-            primary_str = row_data[raw_primary_col]
-            fuels_list += process_fuel_string(primary_str)
-            
-        if raw_secondary_col is not None and pd.notnull(row_data[raw_secondary_col]):
-            secondary_str = row_data[raw_secondary_col]
-            fuels_list += process_fuel_string(secondary_str)
-
-        esource = row_data[esource_col]
-        if not fuels_list and esource != "": # Only load 'type' column into fuels list if nothing else to go on.
-            fuels_list.append(esource.lower()) 
-
-        if not fuels_list:
-            print("Nothing to go on")
-            stop = True
-
-        primary_label = fuels_list[0] # This will assign either 'Type' or first entry in primary_fuel col as primary_label
-        if len(fuels_list) > 1:
-            secondary_fuels = fuels_list[1:]
-        else:
-            secondary_fuels = []
-
-        fuel_species, fuel_genus, esource_id = find_fuel_hierarchy(primary_label, fuel_tree_df)
-        df.loc[idx, 'PrimaryFuel'] = primary_label
-        df.loc[idx, 'FuelSpecies'] = fuel_species
-        df.loc[idx, 'FuelGenus'] = fuel_genus
-        df.loc[idx, 'esource_id'] = esource_id
-    
-        if len(secondary_fuels) > 0:
-            secondary_fuels = set(secondary_fuels)
-        else:
-            secondary_fuels = ""
-        df.loc[idx, 'SecondaryFuels'] = str(secondary_fuels)
+    return df
 
-    useless_indicators = {'mixed fuel', 'other'}
-    for useless_word in useless_indicators:
-        # primary_col_list.remove(useless_word)
-        pass
+TYPE_HINT_PATTERNS = {'CHP': ['heizkraftwerk', 'hkw', 'chp', 'bhkw', 'cogeneration',
+                               'power and heat', 'heat and power'],
+                       'Store': ['battery', 'storage'],
+                       'Lignite': ['lignite', 'brown']}
 
-    return df
+@lru_cache(maxsize=None)
+def type_classifier(target_technologies):
+    """
+    One case-insensitive pattern for all type hints, with a named group per
+    hint of TYPE_HINT_PATTERNS and one ('Technology') for the
+    target_technologies. Every group sits in its own lookahead, so a match
+    is reported at each position where any of the hints starts and the hints
+    may overlap (e.g. 'storage' within 'Pumped Storage').
+    """
+    groups = {name: '|'.join(words) for name, words in TYPE_HINT_PATTERNS.items()}
+    groups['Technology'] = '|'.join(target_technologies)
+
+    pattern = ''.join(f"(?:(?=(?P<{name}>{alternation}))|)"
+                      for name, alternation in groups.items())
+    # fail unless at least one of the hints matched at this position
+    condition = '(?!)'
+    for name in reversed(list(groups)):
+        condition = f"(?({name})|{condition})"
+
+    return re.compile(pattern + condition, re.IGNORECASE)
+
+@lru_cache(maxsize=2**18)
+def _classify_text(text, target_technologies):
+
+    hints = dict.fromkeys(TYPE_HINT_PATTERNS, False)
+    technologies = []
+    end = 0
+    for m in type_classifier(target_technologies).finditer(text):
+        for name in TYPE_HINT_PATTERNS:
+            if m.group(name) is not None:
+                hints[name] = True
+        # keep the technologies non-overlapping, as re.findall would
+        technology = m.group('Technology')
+        if technology is not None and m.start() >= end:
+            technologies.append(technology)
+            end = m.start() + len(technology)
+
+    hints['Technology'] = ', '.join(technologies) if technologies else np.nan
+    return hints
+
+def type_hints(values):
+    """
+    Scan a text column once for all type hints: boolean columns 'CHP',
+    'Store' and 'Lignite' and the found target technologies joined by ', '
+    in 'Technology' (NaN if none). Non-string values carry no hints.
+    """
+    target_technologies = tuple(CONFIG['target_technologies'])
+
+    is_text = values.map(lambda x: isinstance(x, str)).to_numpy(dtype=bool)
+    codes, uniques = pd.factorize(values[is_text])
+    classified = pd.DataFrame([_classify_text(text, target_technologies)
+                               for text in uniques],
+                              columns=list(TYPE_HINT_PATTERNS) + ['Technology'])
+
+    hints = pd.DataFrame({name: False for name in TYPE_HINT_PATTERNS},
+                         index=values.index)
+    hints['Technology'] = np.nan
+    hints = hints.astype({'Technology': object})
+    hints.iloc[np.flatnonzero(is_text)] = classified.iloc[codes].to_numpy()
+    return hints.astype({name: bool for name in TYPE_HINT_PATTERNS})
+
+def column_hints(df, col, hints=None):
+    """
+    type_hints of df[col], shared through the dict hints between the gather
+    steps: a column is classified once, later calls only rescan the rows an
+    earlier step has changed (e.g. 'Technology' after
+    gather_technology_info). Without hints the column is classified anew.
+    """
+    values = df[col]
+    if hints is None:
+        return type_hints(values)
 
-def gather_fueltype_info(df, search_col=['Name', 'Technology']):
+    cached = hints.get(col)
+    if cached is None or not cached[0].index.equals(values.index):
+        found = type_hints(values)
+    else:
+        old_values, found = cached
+        old, new = old_values.to_numpy(dtype=object), values.to_numpy(dtype=object)
+        changed = ~((old == new) | (pd.isna(old) & pd.isna(new)))
+        if changed.any():
+            found = found.astype({name: object for name in TYPE_HINT_PATTERNS})
+            found.iloc[np.flatnonzero(changed)] = type_hints(values[changed]).to_numpy()
+            found = found.astype({name: bool for name in TYPE_HINT_PATTERNS})
+
+    hints[col] = (values.copy(), found)
+    return found
+
+def gather_fueltype_info(df, search_col=['Name', 'Technology'], hints=None):
     """
     Parses in search_col columns for distinct coal specifications, e.g.
     'lignite', and passes this information to the 'Fueltype' column.
@@ -442,18 +600,20 @@ def gather_fueltype_info(df, search_col=['Name', 'Technology']):
     ---------
     search_col : list, default is ['Name', 'Technology']
         Specify the columns to be parsed
+    hints : dict, default None
+        Column type hints shared with the other gather steps (see
+        column_hints)
     """
-    fueltype = pd.Series(df['Fueltype'])
-
+    is_lignite = np.zeros(len(df), dtype=bool)
     for i in search_col:
-        found_b = df[i].dropna().str.contains('(?i)lignite|brown')
-        fueltype.loc[found_b.reindex(fueltype.index,
-                                     fill_value=False)] = 'Lignite'
-    fueltype.replace({'Coal': 'Hard Coal'}, inplace=True)
+        is_lignite |= column_hints(df, i, hints)['Lignite'].to_numpy()
+
+    fueltype = (df['Fueltype'].mask(is_lignite, 'Lignite')
+                .replace({'Coal': 'Hard Coal'}))
 
     return df.assign(Fueltype=fueltype)
 
-def gather_set_info(df, search_col=['OrigName', 'Fueltype', 'Technology']):
+def gather_set_info(df, search_col=['OrigName', 'Fueltype', 'Technology'], hints=None):
     """
     Parses in search_col columns for distinct set specifications, e.g.
     'Store', and passes this information to the 'Set' column.
@@ -462,37 +622,32 @@ def gather_set_info(df, search_col=['OrigName', 'Fueltype', 'Technology']):
     ---------
     search_col : list, default is ['Name', 'Fueltype', 'Technology']
         Specify the columns to be parsed
+    hints : dict, default None
+        Column type hints shared with the other gather steps (see
+        column_hints)
     config : dict, default None
         Add custom specific configuration,
         e.g. powerplantmatching.config.get_config(target_countries='Italy'),
         defaults to powerplantmatching.config.get_config()
 
     """
-    Set = (df['Set'].copy()
+    Set = (df['Set'].astype(object)
            if 'Set' in df
-           else pd.Series(index=df.index))
-
-    pattern = '|'.join(['heizkraftwerk', 'hkw', 'chp', 'bhkw', 'cogeneration',
-                        'power and heat', 'heat and power'])
+           else pd.Series(np.nan, index=df.index, dtype=object))
 
+    is_chp = np.zeros(len(df), dtype=bool)
+    is_store = np.zeros(len(df), dtype=bool)
     for i in search_col:
-        val_ser = df[i].dropna()
-        if i == 'OrigName':
-            val_ser = val_ser.astype(str)
-        isCHP_b = val_ser.str.contains(pattern, case=False).reindex(df.index).fillna(False)
-        Set.loc[isCHP_b] = 'CHP'
+        found = column_hints(df, i, hints)
+        is_chp |= found['CHP'].to_numpy()
+        is_store |= found['Store'].to_numpy()
 
-    pattern = '|'.join(['battery', 'storage'])
-    for i in search_col:
-        isStore_b = df[i].dropna().astype(str).str.contains(pattern, case=False) \
-            .reindex(df.index).fillna(False)
-        Set.loc[isStore_b] = 'Store'
+    # storage wins over CHP
+    Set = Set.mask(is_chp, 'CHP').mask(is_store, 'Store').fillna('PP')
 
-    df = df.assign(Set=Set)
-    df.loc[:, 'Set'].fillna('PP', inplace=True)
-    return df
+    return df.assign(Set=Set)
 
-def gather_technology_info(df, search_col=['OrigName', 'Fueltype']):
+def gather_technology_info(df, search_col=['OrigName', 'Fueltype'], hints=None):
     """
     Parses in search_col columns for distinct technology specifications, e.g.
     'Run-of-River', and passes this information to the 'Technology' column.
@@ -501,30 +656,48 @@ def gather_technology_info(df, search_col=['OrigName', 'Fueltype']):
     ---------
     search_col : list, default is ['Name', 'Fueltype']
         Specify the columns to be parsed
+    hints : dict, default None
+        Column type hints shared with the other gather steps (see
+        column_hints)
     config : dict, default None
         Add custom specific configuration,
         e.g. powerplantmatching.config.get_config(target_countries='Italy'),
         defaults to powerplantmatching.config.get_config()
 
     """
-    
-    technology = (df['Technology'].dropna()
+    technology = (df['Technology'].astype(object)
                   if 'Technology' in df
-                  else pd.Series())
+                  else pd.Series(np.nan, index=df.index, dtype=object))
 
-    pattern = '|'.join(('(?i)'+x) for x in CONFIG['target_technologies'])
     for i in search_col:
-        found = (df[i].dropna()
-                 .str.findall(pattern)
-                 .loc[lambda s: s.str.len() > 0]
-                 .str.join(sep=', '))
+        found = column_hints(df, i, hints)['Technology'].astype(object)
+        joined = technology.str.cat(found, sep=', ')
+        # np.where keeps object dtype, fillna would downcast all-NaN columns
+        technology = pd.Series(np.where(technology.isna(), found,
+                                        np.where(found.isna(), technology, joined)),
+                               index=df.index, dtype=object)
+
+    return df.assign(Technology=technology)
 
-        exists_i = technology.index.intersection(found.index)
-        if len(exists_i) > 0:
-            technology.loc[exists_i] = (technology.loc[exists_i].str
-                                        .cat(found.loc[exists_i], sep=', '))
+def gather_type_info(df, fueltype_col=None, technology_col=['OrigName', 'Fueltype'],
+                     set_col=['OrigName', 'Fueltype', 'Technology']):
+    """
+    gather_fueltype_info (only if fueltype_col is given),
+    gather_technology_info and gather_set_info in one go, classifying every
+    search column once for all three.
 
-        new_i = found.index.difference(technology.index)
-        technology = technology.append(found[new_i])
+    Parameter
+    ---------
+    fueltype_col : list, default None
+        search_col of gather_fueltype_info, skipped if None
+    technology_col : list, default is ['OrigName', 'Fueltype']
+        search_col of gather_technology_info
+    set_col : list, default is ['OrigName', 'Fueltype', 'Technology']
+        search_col of gather_set_info
+    """
+    hints = {}
+    if fueltype_col is not None:
+        df = gather_fueltype_info(df, search_col=fueltype_col, hints=hints)
 
-    return df.assign(Technology=technology)
+    return (df.pipe(gather_technology_info, search_col=technology_col, hints=hints)
+              .pipe(gather_set_info, search_col=set_col, hints=hints))
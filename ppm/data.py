@@ -20,9 +20,8 @@ from utils import (fill_geoposition, correct_manually,
 
 from heuristics import scale_to_net_capacities
 
-from cleaning_functions import (gather_fueltype_info, gather_set_info,
-                       gather_technology_info, clean_name,
-                       clean_technology)
+from cleaning_functions import (gather_set_info, gather_technology_info,
+                       gather_type_info, clean_name, clean_technology)
 
 logger = logging.getLogger(__name__)
 cget = pycountry.countries.get
@@ -76,8 +75,7 @@ def CARMA(in_df, run__diag=False):
     out_df = (out_df
                 .pipe(clean_name)
                 .pipe(config_filter, name='CARMA')
-                .pipe(gather_technology_info)
-                .pipe(gather_set_info)
+                .pipe(gather_type_info)
                 .pipe(clean_technology)
                 .pipe(scale_to_net_capacities, not CONFIG['CARMA']['net_capacity'])
                 .pipe(correct_manually, 'CARMA')
@@ -162,8 +160,7 @@ def ENTSOE(in_df):
                 .pipe(convert_alpha2_to_country)
                 .pipe(clean_name) # retains 2186 rows through name cleaning
                 .pipe(fill_geoposition, use_saved_locations=True, saved_only=True)
-                .pipe(gather_technology_info)
-                .pipe(gather_set_info)
+                .pipe(gather_type_info)
                 .pipe(clean_technology)
                 .pipe(config_filter, name='ENTSOE')
                 .pipe(correct_manually, 'ENTSOE')
@@ -265,9 +262,8 @@ def GEO(in_df):
     fuel_cols = {'Fueltype', 'FuelClassification1', 'FuelClassification2'}
     out_df = out_df.replace({col: {'Gas': 'Natural Gas'} for col in fuel_cols})
 
-    out_df = (out_df.pipe(gather_fueltype_info, search_col=['FuelClassification1'])
-            .pipe(gather_technology_info, search_col=['FuelClassification1'])
-            .pipe(gather_set_info)
+    out_df = (out_df.pipe(gather_type_info, fueltype_col=['FuelClassification1'],
+                          technology_col=['FuelClassification1'])
             .pipe(config_filter, name='GEO')
             .pipe(clean_name)
             .pipe(clean_technology, generalize_hydros=True)
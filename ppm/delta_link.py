@@ -0,0 +1,182 @@
+"""
+Incremental re-linking of two datasets. The records of both datasets are
+snapshotted (record id and content hash) together with the raw links of the
+pair. On the next run only added or changed records, and records that lost
+their link, are linked again; links of removed or changed records are
+dropped and the rest of the previous links are kept.
+"""
+
+import os
+from os import path
+import logging
+
+import pandas as pd
+
+import globals as glob
+from globals import SUB_LINK
+import link_cache
+
+logger = logging.getLogger(__name__)
+
+DELTA_SUB = path.join(SUB_LINK, 'delta')
+
+def _delta_spec(ds_A, ds_B, kind):
+
+    delta_dir = glob.set_path('.', DELTA_SUB)
+    os.makedirs(delta_dir, exist_ok=True)
+    ds_1, ds_2 = sorted([ds_A, ds_B])
+    return path.join(delta_dir, f"{kind}_{ds_1}_{ds_2}.csv")
+
+def record_ids(df):
+    """
+    Stable record ids of df: the projectID column if present, the index
+    otherwise (as strings).
+    """
+    if 'projectID' in df.columns:
+        return pd.Index(df['projectID'].astype(str))
+    return df.index.astype(str)
+
+def snapshot(df, duke_config_fn="duke_find_links.xml"):
+    """
+    Content hash of every record of df over the columns relevant for
+    matching, as a series indexed by record id.
+    """
+    ids = record_ids(df)
+    if ids.has_duplicates:
+        logger.warning(f"Duplicated record ids in {df.columns.name}, only the first is tracked")
+
+    hashes = link_cache.row_hashes(df.set_axis(ids, axis=0), link_cache.matching_columns(duke_config_fn),
+                                   index=False)
+    hashes = pd.Series(hashes.astype(str), index=ids.sort_values())
+    return hashes[~hashes.index.duplicated()]
+
+def diff_snapshots(old, new):
+    """
+    Record ids added, changed and removed between two snapshots.
+    """
+    common = old.index.intersection(new.index)
+    changed = common[old[common].to_numpy() != new[common].to_numpy()]
+
+    return {'added': set(new.index.difference(old.index)),
+            'changed': set(changed),
+            'removed': set(old.index.difference(new.index))}
+
+def _load_state(ds_A, ds_B):
+
+    snapshot_spec = _delta_spec(ds_A, ds_B, 'snapshot')
+    links_spec = _delta_spec(ds_A, ds_B, 'links')
+    if not (path.exists(snapshot_spec) and path.exists(links_spec)):
+        return None, None
+
+    snapshots = pd.read_csv(snapshot_spec, dtype=str)
+    snapshots = {ds_name: group.set_index('record_id')['row_hash']
+                 for ds_name, group in snapshots.groupby('dataset')}
+    links = pd.read_csv(links_spec, dtype={ds_A: str, ds_B: str})
+
+    if ds_A not in snapshots or ds_B not in snapshots:
+        return None, None
+    return snapshots, links
+
+def _save_state(ds_A, ds_B, snapshots, links):
+
+    snapshot_df = pd.concat([pd.DataFrame({'dataset': ds_name,
+                                           'record_id': snap.index,
+                                           'row_hash': snap.values})
+                             for ds_name, snap in snapshots.items()], ignore_index=True)
+    snapshot_df.to_csv(_delta_spec(ds_A, ds_B, 'snapshot'), index=False, encoding='utf-8')
+    links.to_csv(_delta_spec(ds_A, ds_B, 'links'), index=False, encoding='utf-8')
+
+def _to_record_ids(links, df_A, df_B):
+    """
+    Translate index-based links (as returned by duke_link) into record ids.
+    """
+    ds_A, ds_B = df_A.columns.name, df_B.columns.name
+    ids_A = pd.Series(record_ids(df_A), index=df_A.index)
+    ids_B = pd.Series(record_ids(df_B), index=df_B.index)
+
+    return pd.DataFrame({ds_A: links[ds_A].map(ids_A).to_numpy(),
+                         ds_B: links[ds_B].map(ids_B).to_numpy(),
+                         'scores': links['scores'].to_numpy()},
+                        columns=[ds_A, ds_B, 'scores'])
+
+def _to_index(links, df_A, df_B):
+    """
+    Translate record id links back into the index values of df_A / df_B.
+    """
+    ds_A, ds_B = df_A.columns.name, df_B.columns.name
+    index_A = pd.Series(df_A.index, index=record_ids(df_A))
+    index_B = pd.Series(df_B.index, index=record_ids(df_B))
+    index_A = index_A[~index_A.index.duplicated()]
+    index_B = index_B[~index_B.index.duplicated()]
+
+    return pd.DataFrame({ds_A: links[ds_A].map(index_A).to_numpy(),
+                         ds_B: links[ds_B].map(index_B).to_numpy(),
+                         'scores': links['scores'].to_numpy()},
+                        columns=[ds_A, ds_B, 'scores'])
+
+def incremental_links(df_A, df_B, link_pair, duke_config_fn="duke_find_links.xml"):
+    """
+    Links of df_A with df_B, re-linking only what changed since the last
+    run of this pair.
+
+    Records of df_A / df_B that were added or changed are linked against the
+    full other dataset, as are records of df_A whose previous link pointed to
+    a changed or removed record of df_B. Links of removed and changed records
+    are dropped, all other previous links are kept. As with --singlematch,
+    only the best link of each record of df_A is kept in the merged result.
+
+    Parameters
+    ----------
+    df_A, df_B : pandas.DataFrame
+    link_pair : function
+        link_pair(df_A, df_B) returns the links of two (partial) datasets
+        with columns [name of df_A, name of df_B, 'scores'], indexed like
+        duke_link
+    duke_config_fn : str
+        duke config whose columns define a changed record
+
+    Returns
+    -------
+    Links for the full datasets in the format of link_pair
+    """
+    ds_A, ds_B = df_A.columns.name, df_B.columns.name
+    snapshots = {ds_A: snapshot(df_A, duke_config_fn), ds_B: snapshot(df_B, duke_config_fn)}
+    old_snapshots, old_links = _load_state(ds_A, ds_B)
+
+    if old_snapshots is None:
+        logger.info(f"No previous links for {ds_A} - {ds_B}, linking all records")
+        links = _to_record_ids(link_pair(df_A, df_B), df_A, df_B)
+        _save_state(ds_A, ds_B, snapshots, links)
+        return _to_index(links, df_A, df_B)
+
+    diff_A = diff_snapshots(old_snapshots[ds_A], snapshots[ds_A])
+    diff_B = diff_snapshots(old_snapshots[ds_B], snapshots[ds_B])
+
+    stale_A = diff_A['changed'] | diff_A['removed']
+    stale_B = diff_B['changed'] | diff_B['removed']
+    orphaned_A = set(old_links.loc[old_links[ds_B].isin(stale_B), ds_A])
+    kept_links = old_links[~old_links[ds_A].isin(stale_A) & ~old_links[ds_B].isin(stale_B)]
+
+    fresh_A = (diff_A['added'] | diff_A['changed'] | orphaned_A) - diff_A['removed']
+    fresh_B = diff_B['added'] | diff_B['changed']
+
+    print(f"Incremental linking {ds_A} - {ds_B}: "
+          f"{len(fresh_A)} of {len(df_A)} {ds_A} and {len(fresh_B)} of {len(df_B)} {ds_B} records to link, "
+          f"{len(old_links) - len(kept_links)} of {len(old_links)} previous links dropped")
+
+    new_links = [kept_links]
+    if fresh_A:
+        part_A = df_A[record_ids(df_A).isin(fresh_A)]
+        new_links.append(_to_record_ids(link_pair(part_A, df_B), part_A, df_B))
+    if fresh_B:
+        part_B = df_B[record_ids(df_B).isin(fresh_B)]
+        new_links.append(_to_record_ids(link_pair(df_A, part_B), df_A, part_B))
+
+    links = (pd.concat(new_links, ignore_index=True)
+             .sort_values('scores', ascending=False, kind='mergesort')
+             .drop_duplicates(subset=ds_A)
+             .reset_index(drop=True))
+
+    _save_state(ds_A, ds_B, snapshots, links)
+
+    return _to_index(links, df_A, df_B)
@@ -14,6 +14,7 @@ from globals import ALL_DATASETS, SUB_TAG, NOW_GONE_IDS, MATCH_COLS, SUB_DIAG, S
 import globals as glob
                      
 import duke
+import link_store
 
 project_ids_ref_spec = glob.set_path("project_IDs_ref.csv")
 PROJECT_IDS_REF_DF = pd.read_csv(project_ids_ref_spec, index_col='projectID')
@@ -187,16 +188,28 @@ def extract_intraset_groups_from_plants(plant_df, ids_col='projectID', display=F
     row of data for the plant in question -- indicating an intraset grouping.
 
     Organizes data into a dictionary, keyed for each dataset, with list of sets (of projectIDs)
+
+    The long form of the matched plants (see match.combined_long) is accepted
+    as well, there the projectIDs of each dataset are collected per cluster_id.
     """
 
-    ids_data = plant_df[ids_col]
+    if {'cluster_id', 'dataset'} <= set(plant_df.columns):
+        ids_rows = plant_df.dropna(subset=[ids_col])
+        ids_data = {}
+        for cluster_id, ds_name, id_list in zip(ids_rows['cluster_id'], ids_rows['dataset'], ids_rows[ids_col]):
+            ids_data.setdefault(cluster_id, {})[ds_name] = id_list
+        ids_data = list(ids_data.values())
+    else:
+        ids_data = plant_df[ids_col]
     intraset_groups_dict = {}
 
     clean_dfs = load_clean_dfs()
     
     for row_dict_str in ids_data:
-        row_dict = eval(row_dict_str)
+        row_dict = eval(row_dict_str) if isinstance(row_dict_str, str) else row_dict_str
         for ds_name, id_list in row_dict.items():
+            if isinstance(id_list, str):
+                id_list = ast.literal_eval(id_list) if id_list.startswith('[') else [id_list]
 
             if drop_gone:
                 revised_id_list = [id for id in id_list if id not in NOW_GONE_IDS]
@@ -543,13 +556,46 @@ def parse_DebugCompare_stdout(pair_text):
                 
     return prop_data_dict, overall_score
 
-def build_debug_data_dict(pairs_dict):
+def _format_debug_pair(pair_key, prop_data_dict, overall_score):
+    """
+    Text rendering of one batched pair breakdown in the layout of Duke's
+    DebugCompare output, for the stdout files of build_debug_data_dict.
+    """
+    lines = [f"\nFinding pair info for {pair_key[0]} to {pair_key[1]} . . ."]
+    for prop_name, prop_data in prop_data_dict.items():
+        if not prop_data:
+            continue
+        lines.append(f"---{prop_name}")
+        lines.append(f"'{prop_data['val1']}' ~ '{prop_data['val2']}': {prop_data['score']} (prob {prop_data['prob']})")
+        lines.append(f"Delta: {prop_data['delta']}")
+        lines.append("")
+    lines.append(f"Overall: {overall_score}")
+
+    return "\n".join(lines) + "\n"
+
+def _stored_pair_scores(ds_name):
+    """
+    Scores of the stored intraset links of ds_name, keyed by both orders of
+    the (projectID, projectID) pair.
+    """
+    links = link_store.intraset_links(ds_name)
+    scores = dict(zip(zip(links.one, links.two), links.scores))
+    scores.update(zip(zip(links.two, links.one), links.scores))
+    return scores
+
+def build_debug_data_dict(pairs_dict, batched=True):
 
     """
     Reads in list of all pair combinations associated with supersets indicated with matching issues
     Runs DebugCompare on each of those via duke.duke_pair_data(id1, id2)
     Calls parse_DebugCompare to parse output strings to construct a (heavily-nested) data dictionary of all diagnostic info
 
+    With batched=True, all pairs of all supersets are scored in a single pass
+    via duke.duke_pairs_data instead of one DebugCompare run per pair.
+
+    Each pair also gets its 'linked_score', the score of the intraset link
+    of the last clique tagging run from the link store (None if the pair
+    was not linked).
 
     """
 
@@ -557,6 +603,12 @@ def build_debug_data_dict(pairs_dict):
     load_file_spec = glob.set_path(f"Intraset issues - Superset Info.csv", os.path.join(SUB_DIAG, "intraset"))
     superset_df = pd.read_csv(load_file_spec, index_col='SuperSetKey', low_memory=True)
 
+    linked_scores = {}
+
+    if batched:
+        all_pairs = [pair_key for pairs_list in pairs_dict.values() for pair_key in pairs_list]
+        batch_data = duke.duke_pairs_data(all_pairs)
+
     for superset_key, pairs_list in pairs_dict.items():
         debug_data_dict[superset_key] = {}      
 
@@ -565,15 +617,23 @@ def build_debug_data_dict(pairs_dict):
         stdout_strings = ""
 
         superset_info = superset_df.loc[superset_key]
+        if superset_info.Dataset not in linked_scores:
+            linked_scores[superset_info.Dataset] = _stored_pair_scores(superset_info.Dataset)
         for pair_key in pairs_list: # Pairs list based on projectIDs
             id1, id2 = pair_key
-            stdout_str = duke.duke_pair_data(id1, id2)
+            if batched:
+                single_pair_debug_dict, overall_score = batch_data[tuple(pair_key)]
+                stdout_str = _format_debug_pair(pair_key, single_pair_debug_dict, overall_score)
+            else:
+                stdout_str = duke.duke_pair_data(id1, id2)
+                single_pair_debug_dict, overall_score = parse_DebugCompare_stdout(stdout_str)
             
             debug_data_dict[superset_key][pair_key] = {} # Set up empty sub-dict for each pair_key combo in superset
 
-            single_pair_debug_dict, overall_score = parse_DebugCompare_stdout(stdout_str)
             debug_data_dict[superset_key][pair_key].update(single_pair_debug_dict)
             debug_data_dict[superset_key][pair_key]['overall_score'] = overall_score
+            debug_data_dict[superset_key][pair_key]['linked_score'] = \
+                linked_scores[superset_info.Dataset].get(tuple(map(str, pair_key)))
 
             stat1 = _get_set_match_code(id1, superset_info)
             stat2 = _get_set_match_code(id2, superset_info)
@@ -621,6 +681,7 @@ def save_debug_dict_to_csv(debug_dict, filename=None):
                         
                     row_dict['mismatch_code'] = mismatch_code
                     row_dict['pair_score'] = pair_data_dict['overall_score']
+                    row_dict['linked_score'] = pair_data_dict.get('linked_score')
                     row_dict['prop_name'] = prop_name
                 
                     if pair_data_dict[prop_name]:
@@ -633,7 +694,7 @@ def save_debug_dict_to_csv(debug_dict, filename=None):
         filename = "Intraset issues - Detailed Debug.csv"
         file_spec = glob.set_path(filename, os.path.join(SUB_DIAG, 'intraset') )
         
-    header_labels = ['set_key', 'id_pair', 'mismatch_code', 'pair_score', 'prop_name', 'val1', 'val2', 'score', 'prob', 'delta']
+    header_labels = ['set_key', 'id_pair', 'mismatch_code', 'pair_score', 'linked_score', 'prop_name', 'val1', 'val2', 'score', 'prob', 'delta']
 
     with open(file_spec, encoding='utf-8-sig', mode='w') as save_file:
         csv_writer = csv.writer(save_file, delimiter=',', lineterminator='\n', quotechar='"', quoting=csv.QUOTE_ALL)
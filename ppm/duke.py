@@ -7,13 +7,607 @@ from os import path
 import subprocess as sub
 import shutil
 import tempfile
+import re
+import threading
+import time
+import queue
+import atexit
+import io
+from functools import lru_cache
 import pandas as pd
 import numpy as np
-from globals import SUB_TAG, PACKAGE_CONFIG, SUB_LINK, SUB_CLEAN, SUB_DIAG
+from globals import CONFIG, SUB_TAG, PACKAGE_CONFIG, SUB_LINK, SUB_CLEAN, SUB_DIAG
 import globals as glob
+import blocking
+from utils import max_parallel_jobs
+from linkage import load_duke_schema, debug_compare
 
 logger = logging.getLogger(__name__)
 
+DUKE_WORKER_CLASS = "DukeWorker"
+BATCH_DEBUG_COMPARE_CLASS = "BatchDebugCompare"
+
+
+# DUKE PROCESS HANDLING
+# =====================
+
+@lru_cache(maxsize=None)
+def _duke_classpath():
+    """
+    Build the java CLASSPATH string for all jars in duke_binaries (once per session).
+    """
+    duke_bin_dir = glob.package_data('duke_binaries')
+    jars = [path.join(duke_bin_dir, r) for r in sorted(os.listdir(duke_bin_dir))]
+    return os.pathsep.join(jars)
+
+DUKE_DATABASES = {'memory': 'no.priv.garshol.duke.databases.InMemoryDatabase',
+                  'lucene': 'no.priv.garshol.duke.databases.LuceneDatabase'}
+
+def _select_database(n_records, ds_names=()):
+    """
+    Duke database backend for a block of n_records records, following
+    config.yaml:duke_database. A backend set for one of the datasets in
+    ds_names takes precedence. With backend 'auto', blocks of at least
+    lucene_min_records records get an on-disk Lucene index instead of the
+    in-memory database.
+    """
+    db_config = CONFIG.get('duke_database') or {}
+    backend = db_config.get('backend', 'auto')
+    for ds_name in ds_names:
+        backend = (db_config.get('datasets') or {}).get(ds_name, backend)
+    if backend == 'auto':
+        min_records = db_config.get('lucene_min_records', 20000)
+        backend = 'lucene' if n_records is not None and n_records >= min_records else 'memory'
+
+    if backend not in DUKE_DATABASES:
+        raise ValueError(f"Unknown duke database backend '{backend}', "
+                         f"choose from {list(DUKE_DATABASES)} or 'auto'")
+    return backend
+
+def _database_xml(backend, work_dir):
+
+    if backend == 'lucene':
+        # Start from an empty index, Lucene would otherwise keep records of earlier runs
+        index_dir = path.join(work_dir, 'lucene_index')
+        shutil.rmtree(index_dir, ignore_errors=True)
+        return (f'<database class="{DUKE_DATABASES[backend]}">\n'
+                f'    <param name="path" value="{index_dir}"/>\n'
+                f'  </database>')
+
+    return f'<database class="{DUKE_DATABASES[backend]}">\n  </database>'
+
+def _java_heap_opts(n_processes=None):
+    """
+    JVM heap option for one Duke process, following config.yaml:duke_database
+    max_heap: a java size like '4g', or 'auto' to share 3/4 of the physical
+    memory among n_processes java processes. n_processes defaults to the
+    number of java processes that can run together, max_parallel_jobs (also
+    the size of the worker pool).
+    """
+    max_heap = (CONFIG.get('duke_database') or {}).get('max_heap', 'auto')
+    if max_heap is None:
+        return []
+    if max_heap != 'auto':
+        return [f'-Xmx{max_heap}']
+
+    try:
+        total_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        # No sysconf (e.g. Windows), leave the JVM default
+        return []
+
+    if n_processes is None:
+        n_processes = max_parallel_jobs()
+    heap_mb = int(total_memory * 0.75 / n_processes / 2**20)
+    return [f'-Xmx{max(heap_mb, 256)}m']
+
+def _copy_duke_config(duke_config_fn, work_dir, n_records=None, ds_names=(), threshold=None):
+    """
+    Copy the packaged duke config file into work_dir, with all 'input-file'
+    parameters turned into absolute paths within work_dir. This makes the
+    config independent of the current working directory of the java process,
+    as required by the persistent worker pool. The database backend is set
+    according to the number of records in the block (see _select_database),
+    and the match threshold is replaced if threshold is given.
+
+    Returns the absolute path of the copied config file.
+    """
+    with open(glob.package_data(duke_config_fn), encoding='utf-8') as f:
+        config_xml = f.read()
+
+    def absolute_input(match):
+        input_spec = path.join(work_dir, path.basename(match.group(2)))
+        return match.group(1) + input_spec + match.group(3)
+
+    input_pattern = r'(<param\s+name="input-file"\s+value=")([^"]*)(")'
+    config_xml = re.sub(input_pattern, absolute_input, config_xml)
+
+    backend = _select_database(n_records, ds_names)
+    logger.debug(f"Duke database for {n_records} records in {work_dir}: {backend}")
+    database_xml = _database_xml(backend, work_dir)
+    config_xml = re.sub(r'<database\s[^>]*>.*?</database>', lambda m: database_xml,
+                        config_xml, flags=re.DOTALL)
+
+    if threshold is not None:
+        config_xml = re.sub(r'<threshold>[^<]*</threshold>', f'<threshold>{threshold}</threshold>',
+                            config_xml, count=1)
+
+    config_spec = path.join(work_dir, duke_config_fn)
+    with open(config_spec, 'w', encoding='utf-8') as f:
+        f.write(config_xml)
+
+    return config_spec
+
+def _check_duke_stderr(stderr):
+
+    logger.debug(f"Stderr: {stderr}")
+    if any(word in stderr.lower() for word in ['error', 'fehler']):
+        raise RuntimeError("duke failed: {}".format(stderr))
+
+def _run_duke(duke_args, work_dir, capture_stdout=True, line_handler=None):
+    """
+    Run no.priv.garshol.duke.Duke with duke_args in work_dir, either on the
+    persistent worker pool (config 'duke_worker_pool') or as a fresh java
+    process. Returns stdout of the run (None if not captured).
+
+    If line_handler is given, stdout is not buffered but handed over line by
+    line as it is produced (None is returned then).
+    """
+    if CONFIG.get('duke_worker_pool', False):
+        stdout, stderr = get_duke_pool().run(duke_args, work_dir, line_handler=line_handler)
+        if line_handler is None and not capture_stdout:
+            print(stdout)
+            stdout = None
+
+    else:
+        os.environ['CLASSPATH'] = _duke_classpath()
+        args = (['java', '-Dfile.encoding=UTF-8'] + _java_heap_opts() +
+                ['no.priv.garshol.duke.Duke'] + duke_args)
+        stdout_pipe = sub.PIPE if capture_stdout or line_handler is not None else None
+        try:
+            run = sub.Popen(args, stderr=sub.PIPE, cwd=work_dir, stdout=stdout_pipe,
+                            universal_newlines=True, encoding='utf-8', errors='replace')
+
+        except FileNotFoundError:
+            err = "Java was not found on your system."
+            logger.error(err)
+            raise FileNotFoundError(err)
+
+        if line_handler is None:
+            stdout, stderr = run.communicate()
+
+        else:
+            # Drain stderr alongside, so that a chatty Duke cannot block on a full pipe
+            stderr_chunks = []
+            drain = threading.Thread(target=lambda: stderr_chunks.append(run.stderr.read()), daemon=True)
+            drain.start()
+            for line in run.stdout:
+                line_handler(line)
+            run.wait()
+            drain.join()
+            stdout, stderr = None, "".join(stderr_chunks)
+
+    _check_duke_stderr(stderr)
+
+    return stdout
+
+class ShowMatchesParser:
+    """
+    Incremental parser for the output of Duke's --showmatches option, to be
+    used as line_handler of _run_duke. Each match is reported as
+
+        MATCH 0.9983154777071377
+        ID: '18WCTJON1-123-06', NAME: 'castejo', FUELTYPE: 'natural gas', ...
+        ID: '18WCTJON2-123-0Z', NAME: 'castejo', FUELTYPE: 'natural gas', ...
+
+    and turned into one row with the score, both ids and the property values
+    of both records (columns <PROP>_1 / <PROP>_2). Other output lines are
+    ignored. A progress message is printed every progress_every matches.
+    """
+    match_pattern = re.compile(r"^MATCH (\S+)\s*$")
+    value_pattern = re.compile(r"([A-Z_][A-Z0-9_]*): '(.*?)'(?=, [A-Z_][A-Z0-9_]*: '|,?\s*$)")
+
+    def __init__(self, label="", progress_every=1000, echo=False):
+
+        self.label = label
+        self.progress_every = progress_every
+        self.echo = echo
+        self.rows = []
+        self._score = None
+        self._records = []
+
+    def __call__(self, line):
+
+        if self.echo:
+            print(line, end="")
+
+        match = self.match_pattern.match(line)
+        if match:
+            self._score = float(match.group(1))
+            self._records = []
+            return
+
+        if self._score is None or not line.startswith("ID: "):
+            return
+
+        self._records.append(dict(self.value_pattern.findall(line.rstrip("\n"))))
+        if len(self._records) == 2:
+            self._add_row()
+
+    def _add_row(self):
+
+        record_1, record_2 = self._records
+        row = {'score': self._score, 'id_1': record_1.pop('ID', None), 'id_2': record_2.pop('ID', None)}
+        for prop_name in record_1.keys() | record_2.keys():
+            row[prop_name + '_1'] = record_1.get(prop_name)
+            row[prop_name + '_2'] = record_2.get(prop_name)
+        self.rows.append(row)
+        self._score = None
+        self._records = []
+
+        if self.progress_every and len(self.rows) % self.progress_every == 0:
+            print(f"  {self.label}: {len(self.rows)} matches so far . . .")
+
+    @property
+    def n_matches(self):
+
+        return len(self.rows)
+
+    def evidence(self):
+        """
+        All parsed matches as a dataframe (score, id_1, id_2, <PROP>_1, <PROP>_2, ...).
+        """
+        evidence_df = pd.DataFrame(self.rows)
+        if evidence_df.empty:
+            return pd.DataFrame(columns=['score', 'id_1', 'id_2'])
+
+        prop_cols = sorted(col for col in evidence_df.columns if col not in ('score', 'id_1', 'id_2'))
+        return evidence_df[['score', 'id_1', 'id_2'] + prop_cols]
+
+def _use_fifo_transport():
+    """
+    True if Duke input / link files are to be streamed through named pipes
+    (config.yaml:duke_transport 'fifo'), which requires a POSIX system.
+    """
+    if CONFIG.get('duke_transport', 'file') != 'fifo':
+        return False
+    if not hasattr(os, 'mkfifo'):
+        logger.warning("Named pipes not supported on this system, using file transport for Duke")
+        return False
+    return True
+
+def _make_fifo(fifo_spec):
+
+    if path.exists(fifo_spec):
+        os.remove(fifo_spec)
+    os.mkfifo(fifo_spec)
+
+def _release_fifo(fifo_spec, for_writer):
+    """
+    Unblock a thread still waiting to open fifo_spec because Duke never
+    opened its end (e.g. after a config error), by briefly opening that end.
+    """
+    flags = (os.O_RDONLY if for_writer else os.O_WRONLY) | os.O_NONBLOCK
+    try:
+        os.close(os.open(fifo_spec, flags))
+    except OSError:
+        pass
+
+def _run_duke_streams(duke_args, work_dir, inputs, link_spec, capture_stdout=True, line_handler=None):
+    """
+    Run Duke with the input files written by the callables in inputs
+    ({file name: function writing to an open text file}) and return
+    (stdout, link file text).
+
+    With the file transport, inputs are written to work_dir and the link file
+    is read after the run. With the fifo transport, all of them are named
+    pipes: records are streamed to Duke while it reads them and links are
+    collected as Duke writes them, without touching the disk.
+    """
+    if not _use_fifo_transport():
+        for input_fn, write_input in inputs.items():
+            with open(path.join(work_dir, input_fn), 'w', encoding='utf-8', newline='') as f:
+                write_input(f)
+
+        stdout = _run_duke(duke_args, work_dir, capture_stdout=capture_stdout,
+                           line_handler=line_handler)
+        return stdout, _read_text(link_spec)
+
+    errors = []
+    link_lines = []
+
+    def write_fifo(fifo_spec, write_input):
+        try:
+            with open(fifo_spec, 'w', encoding='utf-8', newline='') as f:
+                write_input(f)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            errors.append(e)
+
+    def read_fifo(fifo_spec):
+        with open(fifo_spec, encoding='utf-8') as f:
+            for line in f:
+                link_lines.append(line)
+
+    writers = {}
+    for input_fn, write_input in inputs.items():
+        fifo_spec = path.join(work_dir, input_fn)
+        _make_fifo(fifo_spec)
+        writers[fifo_spec] = threading.Thread(target=write_fifo, args=(fifo_spec, write_input), daemon=True)
+
+    _make_fifo(link_spec)
+    reader = threading.Thread(target=read_fifo, args=(link_spec,), daemon=True)
+
+    for thread in list(writers.values()) + [reader]:
+        thread.start()
+
+    try:
+        stdout = _run_duke(duke_args, work_dir, capture_stdout=capture_stdout,
+                           line_handler=line_handler)
+
+    finally:
+        for fifo_spec, writer in writers.items():
+            if writer.is_alive():
+                _release_fifo(fifo_spec, for_writer=True)
+            writer.join()
+        if reader.is_alive():
+            _release_fifo(link_spec, for_writer=False)
+        reader.join()
+
+        for fifo_spec in list(writers) + [link_spec]:
+            os.remove(fifo_spec)
+
+    if errors:
+        raise errors[0]
+
+    return stdout, ''.join(link_lines)
+
+def _read_link_text(link_text, usecols, names):
+
+    if link_text.strip() == "":
+        return pd.DataFrame(columns=names)
+
+    return pd.read_csv(io.StringIO(link_text), usecols=usecols, names=names)
+
+class DukePool:
+    """
+    Pool of long-lived java processes, each running the DukeWorker job loop
+    (package_data/duke_worker/DukeWorker.java). Jobs are the usual Duke
+    command-line arguments; a job is handed to the next idle worker, so JVM
+    start-up is paid once per worker instead of once per Duke run.
+
+    Parameters
+    ----------
+    size : int, default None
+        Number of java workers, defaults to max_parallel_jobs (the jobs of
+        all parallel maps share it, see utils.bounded_map)
+    java_opts : list, default None
+        Additional options for the java command, e.g. ['-Xmx4g'], defaults to
+        the heap option from config.yaml:duke_database max_heap
+    """
+
+    def __init__(self, size=None, java_opts=None):
+
+        self.size = size if size is not None else max_parallel_jobs()
+        self.java_opts = list(java_opts) if java_opts is not None else _java_heap_opts(self.size)
+        self._class_dir = _compile_duke_worker()
+        self._idle = queue.Queue()
+        self._workers = []
+        self._job_counter = 0
+        self._lock = threading.Lock()
+
+        for _ in range(self.size):
+            self._idle.put(self._start_worker())
+
+        logger.info(f"Started Duke worker pool with {self.size} java processes")
+
+    def _start_worker(self):
+
+        classpath = os.pathsep.join([self._class_dir, _duke_classpath()])
+        args = (['java', '-Dfile.encoding=UTF-8'] + self.java_opts +
+                ['-cp', classpath, DUKE_WORKER_CLASS])
+        try:
+            worker = sub.Popen(args, stdin=sub.PIPE, stdout=sub.PIPE, stderr=sub.DEVNULL,
+                               universal_newlines=True, encoding='utf-8', bufsize=1)
+
+        except FileNotFoundError:
+            err = "Java was not found on your system."
+            logger.error(err)
+            raise FileNotFoundError(err)
+
+        ready = worker.stdout.readline().strip()
+        if ready != "READY":
+            worker.kill()
+            raise RuntimeError(f"Duke worker failed to start: {ready}")
+
+        with self._lock:
+            self._workers.append(worker)
+
+        return worker
+
+    def _retire_worker(self, worker):
+
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        if worker.poll() is None:
+            worker.kill()
+
+    def run(self, duke_args, work_dir, line_handler=None):
+        """
+        Run one Duke job on the next idle worker, blocking until it is done.
+        Returns (stdout, stderr) of the job. If line_handler is given, the
+        job's stdout (duke_stdout.txt of work_dir) is followed while the job
+        runs and handed over line by line, and None is returned for stdout.
+        """
+        if any('\t' in arg or '\n' in arg for arg in [work_dir] + list(duke_args)):
+            raise ValueError("Duke job arguments must not contain tabs or newlines")
+
+        stdout_spec = path.join(work_dir, "duke_stdout.txt")
+        if line_handler is not None:
+            # Don't follow the output of an earlier job in the same directory
+            if path.exists(stdout_spec):
+                os.remove(stdout_spec)
+            follower = _LineFollower(stdout_spec, line_handler)
+
+        with self._lock:
+            self._job_counter += 1
+            job_id = str(self._job_counter)
+
+        worker = self._idle.get()
+        try:
+            worker.stdin.write("\t".join([job_id, work_dir] + list(duke_args)) + "\n")
+            worker.stdin.flush()
+            reply = worker.stdout.readline().rstrip("\n")
+
+        except (BrokenPipeError, OSError):
+            reply = ""
+
+        if not reply.startswith("DONE\t"):
+            # Worker died (e.g. System.exit could not be trapped) - replace it
+            self._retire_worker(worker)
+            self._idle.put(self._start_worker())
+            status = "DIED"
+        else:
+            self._idle.put(worker)
+            status = reply.split("\t")[2]
+
+        if line_handler is not None:
+            follower.finish()
+        stdout = _read_text(stdout_spec) if line_handler is None else None
+        stderr = _read_text(path.join(work_dir, "duke_stderr.txt"))
+        if status != "OK":
+            stderr = f"Error: Duke worker job {job_id} ended with status {status}\n{stderr}"
+
+        return stdout, stderr
+
+    def close(self):
+
+        while self._workers:
+            worker = self._workers.pop()
+            try:
+                worker.stdin.close()
+                worker.wait(timeout=10)
+            except (OSError, sub.TimeoutExpired):
+                worker.kill()
+
+class _LineFollower:
+    """
+    Follow a text file that another process is writing (like tail -f) in a
+    background thread and hand every complete line to line_handler, until
+    finish is called after the writer is done; the rest of the file is then
+    handed over as well. Errors of line_handler are raised by finish.
+    """
+
+    def __init__(self, file_spec, line_handler, poll_interval=0.2):
+
+        self.file_spec = file_spec
+        self.line_handler = line_handler
+        self.poll_interval = poll_interval
+        self._done = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._follow, daemon=True)
+        self._thread.start()
+
+    def _follow(self):
+
+        try:
+            while not path.exists(self.file_spec):
+                if self._done.is_set():
+                    if not path.exists(self.file_spec):
+                        return
+                    break
+                time.sleep(self.poll_interval)
+
+            with open(self.file_spec, encoding='utf-8', errors='replace') as f:
+                pending = ""
+                while True:
+                    writer_done = self._done.is_set()
+                    chunk = f.readline()
+                    if chunk:
+                        pending += chunk
+                        if pending.endswith("\n"):
+                            self.line_handler(pending)
+                            pending = ""
+                    elif writer_done:
+                        if pending:
+                            self.line_handler(pending)
+                        return
+                    else:
+                        time.sleep(self.poll_interval)
+
+        except Exception as e:
+            self._error = e
+
+    def finish(self):
+
+        self._done.set()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+def _read_text(file_spec):
+
+    if not path.exists(file_spec):
+        return ""
+    with open(file_spec, encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+def _compile_duke_worker(class_name=DUKE_WORKER_CLASS):
+    """
+    Compile package_data/duke_worker/<class_name>.java (DukeWorker or
+    BatchDebugCompare) against the duke jars into the data directory, unless
+    an up-to-date class file exists already. Returns the class directory.
+    """
+    source_spec = glob.package_data(path.join('duke_worker', class_name + '.java'))
+    class_dir = path.join(PACKAGE_CONFIG['data_dir'], 'duke_worker')
+    class_spec = path.join(class_dir, class_name + '.class')
+
+    if path.exists(class_spec) and path.getmtime(class_spec) >= path.getmtime(source_spec):
+        return class_dir
+
+    os.makedirs(class_dir, exist_ok=True)
+    args = ['javac', '-encoding', 'UTF-8', '-cp', _duke_classpath(), '-d', class_dir, source_spec]
+    try:
+        run = sub.run(args, stdout=sub.PIPE, stderr=sub.PIPE, universal_newlines=True)
+
+    except FileNotFoundError:
+        err = f"javac was not found on your system, needed for {class_name}."
+        logger.error(err)
+        raise FileNotFoundError(err)
+
+    if run.returncode != 0:
+        raise RuntimeError(f"Compiling {class_name} failed: {run.stderr}")
+
+    return class_dir
+
+_DUKE_POOL = None
+_DUKE_POOL_LOCK = threading.Lock()
+
+def get_duke_pool():
+    """
+    Return the session-wide DukePool, starting it on first use.
+    """
+    global _DUKE_POOL
+    with _DUKE_POOL_LOCK:
+        if _DUKE_POOL is None:
+            _DUKE_POOL = DukePool()
+            atexit.register(_DUKE_POOL.close)
+    return _DUKE_POOL
+
+def close_duke_pool():
+
+    global _DUKE_POOL
+    with _DUKE_POOL_LOCK:
+        if _DUKE_POOL is not None:
+            _DUKE_POOL.close()
+            _DUKE_POOL = None
+
+
+# DUKE RUNS
+# =========
+
 def duke_cliques(in_df, country=None, show_output=True):
     """
     
@@ -22,10 +616,6 @@ def duke_cliques(in_df, country=None, show_output=True):
     link_fn = "linkfile.txt"
     input_fn = "input.csv"  # This MUST match the filename spcification in duke_config.xml
     
-    # Routine to add all duke_bin_dir folders to enironment path
-    duke_bin_dir = glob.package_data('duke_binaries')
-    os.environ['CLASSPATH'] = os.pathsep.join([os.path.join(duke_bin_dir, r) for r in os.listdir(duke_bin_dir)])
-    
     # Set-up clean / empty working directory
     ds_name = in_df.columns.name
     work_dir = path.join(PACKAGE_CONFIG['data_dir'], SUB_TAG, ds_name)
@@ -41,71 +631,63 @@ def duke_cliques(in_df, country=None, show_output=True):
     logger.debug(message)
     print(message)
 
-    # Save dataframe to be processed into working directory
-    in_df.to_csv(path.join(work_dir, input_fn), index_label='projectID', encoding='utf8')
+    # Records without any blocking candidate cannot be part of a clique
+    if blocking.blocking_config()['enabled']:
+        schema = load_duke_schema(duke_config_fn)
+        in_df, _ = blocking.prune_to_candidates(in_df, max_distance=blocking.geo_max_distance(schema),
+                                                capacity_bands=blocking.capacity_bands_apply(schema))
+        if len(in_df) < 2:
+            return pd.DataFrame(columns=['one', 'two', 'scores'])
+
+    # Dataframe to be processed is handed to Duke as input_fn in working directory
+    inputs = {input_fn: lambda f: in_df.to_csv(f, index_label='projectID')}
 
     # Copy relevant duke config file into working directory
-    shutil.copyfile(path.join(glob.package_data(duke_config_fn)),
-                    path.join(work_dir, duke_config_fn))
+    config_spec = _copy_duke_config(duke_config_fn, work_dir, n_records=len(in_df),
+                                    ds_names=[ds_name])
+    link_spec = path.join(work_dir, link_fn)
 
     # Build list of arguments to pass to Duke executable
-    args = ['java', '-Dfile.encoding=UTF-8', 'no.priv.garshol.duke.Duke',
-            '--linkfile='+link_fn]
+    duke_args = ['--linkfile='+link_spec]
     
-    # args.append('--progress') # Show progress report while running
-    args.append('--showmatches') # Show matches while running
+    # duke_args.append('--progress') # Show progress report while running
+    duke_args.append('--showmatches') # Show matches while running
 
-    # args.append('--verbose')
+    # duke_args.append('--verbose')
     # MATCH 0.9983154777071377
     # ID: '18WCTJON1-123-06', NAME: 'castejo', FUELTYPE: 'natural gas', COUNTRY: 'Spain', CAPACITY: '424.9', GEOPOSITION: '42.17080120000001,-1.6894331999999999', 
     # ID: '18WCTJON2-123-0Z', NAME: 'castejo', FUELTYPE: 'natural gas', COUNTRY: 'Spain', CAPACITY: '378.9', GEOPOSITION: '42.17080120000001,-1.6894331999999999', 
     # Matching record ID: '18WCTJON2-123-0Z', NAME: 'castejo', FUELTYPE: 'natural gas', COUNTRY: 'Spain', CAPACITY: '378.9', GEOPOSITION: '42.17080120000001,-1.6894331999999999',  found 79 candidates
 
-    # args.append('--testdebug')
-    # args.append('--profile')
-    # args.append('--showdata')
-    # args.append('--pretty')
-
-    args.append(duke_config_fn)
-
-    # stdout = None
-    stdout = sub.PIPE
-    
-    # Run Duke process
-    try:
-        run = sub.Popen(args, stderr=sub.PIPE, cwd=work_dir, stdout=stdout, universal_newlines=True)
-
-    except FileNotFoundError:
-        err = "Java was not found on your system."
-        logger.error(err)
-        raise FileNotFoundError(err)
+    # duke_args.append('--testdebug')
+    # duke_args.append('--profile')
+    # duke_args.append('--showdata')
+    # duke_args.append('--pretty')
 
-    stdout, stderr = run.communicate()
-    if show_output:
-        print(stdout)
+    duke_args.append(config_spec)
 
-    logger.debug(f"Stderr: {stderr}")
-    if any(word in stderr.lower() for word in ['error', 'fehler']):
-        raise RuntimeError("duke failed: {}".format(stderr))
+    # Run Duke process (fresh JVM or persistent worker pool), parsing matches as they come
+    parser = ShowMatchesParser(label=f"{ds_name} / {country}", echo=show_output)
+    _, link_text = _run_duke_streams(duke_args, work_dir, inputs, link_spec, line_handler=parser)
+    print(f"{parser.n_matches} matches found for {ds_name} / {country}")
+    parser.evidence().to_csv(path.join(work_dir, "showmatches.csv"), index=False, encoding='utf-8')
 
-    link_spec = path.join(work_dir, link_fn)
-    out_df = pd.read_csv(link_spec, encoding='utf-8', usecols=[1, 2], names=['one', 'two'])
+    out_df = _read_link_text(link_text, usecols=[1, 2, 3], names=['one', 'two', 'scores'])
         
     logger.debug(f'Files of the duke run have been saved to {work_dir}')
         
     return out_df
 
-def duke_link(df_A, df_B, country=None, showmatches=False, keepfiles=True, showoutput=False):
+def duke_link(df_A, df_B, country=None, showmatches=False, keepfiles=True, showoutput=False,
+              threshold=None, singlematch=True):
     """
+    Record linkage of df_A with df_B by Duke. With singlematch (the default)
+    each record of df_A gets its best link only. threshold overrides the
+    threshold of the duke config, e.g. to keep candidate links of lower
+    score.
     """
 
     duke_config_fn = "duke_find_links.xml"
-    duke_bin_dir = glob.package_data('duke_binaries')
-
-    # Routine to add all duke_bin_dir folders to enironment path
-    os.environ['CLASSPATH'] = \
-        os.pathsep.join([os.path.join(duke_bin_dir, r)
-                         for r in os.listdir(duke_bin_dir)])
     
     ds_A = df_A.columns.name
     ds_B = df_B.columns.name
@@ -120,82 +702,71 @@ def duke_link(df_A, df_B, country=None, showmatches=False, keepfiles=True, showo
         if not path.exists(work_dir):
             os.makedirs(work_dir)
 
-    shutil.copyfile(os.path.join(glob.package_data(duke_config_fn)),
-                    os.path.join(work_dir, duke_config_fn))
-
     logger.debug(f"Comparing files: {pair_label}")
 
-    # Get this additional data added earlier in process
-    df_A = add_geoposition_for_duke(df_A)
-    df_B = add_geoposition_for_duke(df_B)
+    # Records without any blocking candidate on the other side cannot be linked
+    if blocking.blocking_config()['enabled']:
+        schema = load_duke_schema(duke_config_fn)
+        df_A, df_B, _ = blocking.prune_to_candidates(df_A, df_B, max_distance=blocking.geo_max_distance(schema),
+                                                     capacity_bands=blocking.capacity_bands_apply(schema))
+        if df_A.empty or df_B.empty:
+            return pd.DataFrame(columns=[ds_A, ds_B, 'scores'])
 
-    # Note that hard-wired filenames here must align with what is set in Duke config file
-    df_A.to_csv( os.path.join(work_dir, "file_A.csv"), index_label='id')
+    # Geoposition is normally added at the cleaning stage already
+    if 'Geoposition' not in df_A or 'Geoposition' not in df_B:
+        from cleaning_functions import add_geoposition_for_duke
+        df_A = add_geoposition_for_duke(df_A)
+        df_B = add_geoposition_for_duke(df_B)
 
     # due to index unity (see https://github.com/larsga/Duke/issues/236)
     shift_B_by = df_A.index.max()+1
-    df_B.index += shift_B_by
-    df_B.to_csv( os.path.join(work_dir, "file_B.csv"), index_label='id')
-    df_B.index -= shift_B_by
+    df_B_shifted = df_B.copy(deep=False)
+    df_B_shifted.index = df_B.index + shift_B_by
 
-    args = ['java', '-Dfile.encoding=UTF-8', 'no.priv.garshol.duke.Duke',
-            '--linkfile=linkfile.txt']
+    # Note that hard-wired filenames here must align with what is set in Duke config file
+    inputs = {"file_A.csv": lambda f: df_A.to_csv(f, index_label='id'),
+              "file_B.csv": lambda f: df_B_shifted.to_csv(f, index_label='id')}
+
+    config_spec = _copy_duke_config(duke_config_fn, work_dir, n_records=len(df_A) + len(df_B),
+                                    ds_names=[ds_A, ds_B], threshold=threshold)
+
+    link_spec = os.path.join(work_dir, 'linkfile.txt')
+    duke_args = ['--linkfile='+link_spec]
     
-    args.append('--singlematch')
+    if singlematch:
+        duke_args.append('--singlematch')
     if showmatches:
-        args.append('--showmatches')
-        stdout = sub.PIPE
-    else:
-        stdout = None
-    args.append(duke_config_fn)
+        duke_args.append('--showmatches')
+    duke_args.append(config_spec)
         
     print(f"Executing Duke Java process for {pair_label} / {country} . . .")
-    try:
-        run = sub.Popen(args, stderr=sub.PIPE, cwd=work_dir, stdout=stdout,
-                        universal_newlines=True)
-     
-    except FileNotFoundError:
-        err = "Java was not found on your system."
-        logger.error(err)
-        raise FileNotFoundError(err)
-
-    matches, stderr = run.communicate()
+    parser = ShowMatchesParser(label=f"{pair_label} / {country}", echo=True) if showmatches else None
+    _, link_text = _run_duke_streams(duke_args, work_dir, inputs, link_spec,
+                                     capture_stdout=False, line_handler=parser)
 
     if showmatches:
-        print(matches)
-
-    logger.debug("Stderr: {}".format(stderr))
-    if any(word in stderr.lower() for word in ['error', 'fehler']):
-        raise RuntimeError("duke failed: {}".format(stderr))
+        # Ids as seen by Duke, i.e. those of df_B shifted by shift_B_by
+        parser.evidence().to_csv(path.join(work_dir, "showmatches.csv"), index=False, encoding='utf-8')
 
-    link_spec = os.path.join(work_dir, 'linkfile.txt')
     col_labels = [ds_A, ds_B, 'scores']
-    res = pd.read_csv(link_spec, encoding='utf-8', usecols=[1, 2, 3], names=col_labels)
+    res = _read_link_text(link_text, usecols=[1, 2, 3], names=col_labels)
 
     res.iloc[:, 1] -= shift_B_by
     logger.debug(f"Files of the duke run are kept in {work_dir}")
 
     return res
 
-def duke_pair_data(id1=None, id2=None, country=None, test_sub=None):
+def _pair_data_work_dir(duke_config_fn, test_sub=None):
     """
-    
+    Work directory for DebugCompare runs with duke_config_fn and the latest
+    ALL_IDS_clean.csv as its input.csv.
     """
-    # duke_config_fn = "duke_pairs_data.xml"
-    duke_config_fn = "duke_find_cliques.xml"
-    # link_fn = "linkfile.txt"
-    input_fn = "input.csv"  # This MUST match the filename spcification in the Duke config.xml
-    
-    # Set-up clean / empty working directory
+    # input_fn = "input.csv"  # This MUST match the filename spcification in the Duke config.xml
     work_dir = path.join(PACKAGE_CONFIG['data_dir'], SUB_DIAG)
-    if not path.exists(work_dir):
-        os.makedirs(work_dir)
-    
     if test_sub is not None:
         work_dir = path.join(work_dir, test_sub)
-        if not path.exists(work_dir):
-            os.makedirs(work_dir)
-            
+    os.makedirs(work_dir, exist_ok=True)
+
     # Copy relevant duke config file into working directory
     shutil.copyfile(path.join(glob.package_data(duke_config_fn)),
                     path.join(work_dir, duke_config_fn))
@@ -205,17 +776,17 @@ def duke_pair_data(id1=None, id2=None, country=None, test_sub=None):
     all_ids_spec = glob.set_path("ALL_IDS_clean.csv", SUB_CLEAN)
     shutil.copyfile(all_ids_spec, path.join(work_dir, 'input.csv'))
 
+    return work_dir
+
+def _run_debug_compare(work_dir, duke_config_fn, id1, id2):
+
     # Routine to add all duke_bin_dir folders to enironment path
-    duke_bin_dir = glob.package_data('duke_binaries')
-    os.environ['CLASSPATH'] = os.pathsep.join([os.path.join(duke_bin_dir, r) for r in os.listdir(duke_bin_dir)])
-    
-    message = f"\nFinding pair info for {id1} to {id2} . . ."
-    logger.debug(message)
-    print(message)
+    os.environ['CLASSPATH'] = _duke_classpath()
 
     # Build list of arguments to pass to Duke executable
-    args = ['java', '-Dfile.encoding=UTF-8', 'no.priv.garshol.duke.DebugCompare', duke_config_fn, id1, id2]
-    
+    args = ['java', '-Dfile.encoding=UTF-8', 'no.priv.garshol.duke.DebugCompare',
+            duke_config_fn, str(id1), str(id2)]
+
     # Run Duke process
     try:
         run = sub.Popen(args, stderr=sub.PIPE, cwd=work_dir, stdout=sub.PIPE, universal_newlines=True)
@@ -226,15 +797,166 @@ def duke_pair_data(id1=None, id2=None, country=None, test_sub=None):
         raise FileNotFoundError(err)
 
     stdout, stderr = run.communicate()
-    # print("Stdout: ", stdout)
 
     logger.debug(f"Stderr: {stderr}")
     if any(word in stderr.lower() for word in ['error', 'fehler']):
         raise RuntimeError("duke failed: {}".format(stderr))
-        print("Duke Failed")
 
     return stdout
 
+def duke_pair_data(id1=None, id2=None, country=None, test_sub=None):
+    """
+    
+    """
+    # duke_config_fn = "duke_pairs_data.xml"
+    duke_config_fn = "duke_find_cliques.xml"
+
+    work_dir = _pair_data_work_dir(duke_config_fn, test_sub=test_sub)
+
+    message = f"\nFinding pair info for {id1} to {id2} . . ."
+    logger.debug(message)
+    print(message)
+
+    return _run_debug_compare(work_dir, duke_config_fn, id1, id2)
+
+def _run_batch_debug_compare(work_dir, duke_config_fn, id_pairs):
+    """
+    Run DebugCompare for all id_pairs in a single JVM (BatchDebugCompare, the
+    records are loaded once). Returns the stdout, with the DebugCompare
+    output of every pair after a '=== <id1>\t<id2>' header line.
+    """
+    pairs_spec = path.join(work_dir, "debug_pairs.txt")
+    with open(pairs_spec, 'w', encoding='utf-8') as f:
+        f.writelines(f"{id1}\t{id2}\n" for id1, id2 in id_pairs)
+
+    classpath = os.pathsep.join([_compile_duke_worker(BATCH_DEBUG_COMPARE_CLASS), _duke_classpath()])
+    args = (['java', '-Dfile.encoding=UTF-8'] + _java_heap_opts(1) +
+            ['-cp', classpath, BATCH_DEBUG_COMPARE_CLASS, duke_config_fn, pairs_spec])
+    try:
+        run = sub.run(args, cwd=work_dir, stdout=sub.PIPE, stderr=sub.PIPE,
+                      universal_newlines=True, encoding='utf-8', errors='replace')
+
+    except FileNotFoundError:
+        err = "Java was not found on your system."
+        logger.error(err)
+        raise FileNotFoundError(err)
+
+    logger.debug(f"Stderr: {run.stderr}")
+    if run.returncode != 0 or 'exception' in run.stderr.lower():
+        raise RuntimeError("duke failed: {}".format(run.stderr))
+
+    return run.stdout
+
+def split_batch_debug_output(stdout):
+    """
+    Split the output of BatchDebugCompare into the DebugCompare text of each
+    pair, as a dict keyed by (id1, id2) strings. Pairs with an unknown id
+    get an empty text.
+    """
+    pair_texts = {}
+    pair = None
+    for line in stdout.splitlines(keepends=True):
+        if line.startswith("=== "):
+            pair = tuple(line[4:].rstrip("\n").split("\t"))
+            pair_texts[pair] = ""
+        elif pair is not None:
+            pair_texts[pair] += line
+
+    return pair_texts
+
+def _debug_compare_pairs(work_dir, duke_config_fn, id_pairs, batched=True):
+    """
+    DebugCompare breakdowns of all id_pairs in work_dir, parsed as in the
+    diagnostics; pairs with an unknown id get an empty dict and NaN. With
+    batched=True all pairs run in one JVM, else one DebugCompare per pair.
+    """
+    from diagnostics import parse_DebugCompare_stdout
+
+    if batched:
+        pair_texts = split_batch_debug_output(_run_batch_debug_compare(work_dir, duke_config_fn, id_pairs))
+        texts = [pair_texts.get((str(id1), str(id2)), "") for id1, id2 in id_pairs]
+    else:
+        texts = [_run_debug_compare(work_dir, duke_config_fn, id1, id2) for id1, id2 in id_pairs]
+
+    return {tuple(pair): parse_DebugCompare_stdout(text) if "Overall:" in text else ({}, np.nan)
+            for pair, text in zip(id_pairs, texts)}
+
+def _duke_pairs_data(id_pairs, duke_config_fn):
+    """
+    DebugCompare breakdowns of all id_pairs, all run in one JVM on the
+    latest ALL_IDS_clean.csv.
+    """
+    work_dir = _pair_data_work_dir(duke_config_fn)
+    return _debug_compare_pairs(work_dir, duke_config_fn, id_pairs)
+
+def _check_pairs_data(pairs_data, id_pairs, duke_config_fn, tolerance=1e-6):
+    """
+    Cross-check numpy breakdowns against DebugCompare for id_pairs, logging
+    every property score and overall score that differs by more than
+    tolerance. Returns the number of pairs that differ.
+    """
+    duke_data = _duke_pairs_data(id_pairs, duke_config_fn)
+
+    n_differ = 0
+    for pair, (duke_props, duke_score) in duke_data.items():
+        props, score = pairs_data[pair]
+        diffs = [f"{prop_name} {props.get(prop_name, {}).get('score')} vs "
+                 f"{duke_prop.get('score')}"
+                 for prop_name, duke_prop in duke_props.items()
+                 if duke_prop and not np.isclose(props.get(prop_name, {}).get('score', np.nan),
+                                                 duke_prop['score'], atol=tolerance)]
+        if not np.isclose(score, duke_score, atol=tolerance):
+            diffs.append(f"overall {score} vs {duke_score}")
+        if diffs:
+            n_differ += 1
+            logger.warning(f"numpy debug_compare differs from DebugCompare for {pair}: "
+                           + "; ".join(diffs))
+
+    if n_differ == 0:
+        logger.info(f"numpy debug_compare agrees with DebugCompare on {len(duke_data)} pairs")
+    return n_differ
+
+def duke_pairs_data(id_pairs, duke_config_fn="duke_find_cliques.xml", engine=None, check=None):
+    """
+    Batched duke_pair_data: per-property score / probability breakdowns for
+    all (id1, id2) pairs at once.
+
+    With engine 'duke' (default of config.yaml:debug_compare_engine) all
+    pairs are run through Duke's DebugCompare logic in a single JVM that
+    loads the records once (BatchDebugCompare). With engine 'numpy' the
+    latest ALL_IDS_clean.csv is loaded once and all pairs are scored in one
+    pass with the numpy counterpart of DebugCompare
+    (linkage.debug_compare); the first check pairs (default
+    config.yaml:debug_compare_check) are then cross-checked against
+    DebugCompare and differences are logged.
+
+    Returns a dict keyed by id pair with the (property data dict, overall
+    score) tuples that diagnostics.parse_DebugCompare_stdout builds from the
+    DebugCompare output.
+    """
+    engine = CONFIG.get('debug_compare_engine', 'duke') if engine is None else engine
+    check = CONFIG.get('debug_compare_check', 0) if check is None else check
+    id_pairs = [tuple(pair) for pair in id_pairs]
+
+    message = f"\nFinding pair info for {len(id_pairs)} pairs . . ."
+    logger.debug(message)
+    print(message)
+
+    if engine == 'duke':
+        return _duke_pairs_data(id_pairs, duke_config_fn)
+    if engine != 'numpy':
+        raise ValueError(f"Unknown debug_compare_engine '{engine}', choose 'duke' or 'numpy'")
+
+    all_ids_spec = glob.set_path("ALL_IDS_clean.csv", SUB_CLEAN)
+    all_ids_df = pd.read_csv(all_ids_spec, index_col='projectID', low_memory=False)
+
+    pairs_data = debug_compare(all_ids_df, id_pairs, duke_config_fn=duke_config_fn)
+    if check:
+        check_pairs = [pair for pair in id_pairs if pairs_data[pair][0]][:check]
+        _check_pairs_data(pairs_data, check_pairs, duke_config_fn)
+
+    return pairs_data
+
 def duke_report_options():
     
     # duke_config_fn = "duke_find_cliques.xml"
@@ -242,8 +964,7 @@ def duke_report_options():
     # input_fn = "input.csv"  # This MUST match the filename spcification in duke_config.xml
     
     # Routine to add all duke_bin_dir folders to enironment path
-    duke_bin_dir = glob.package_data('duke_binaries')
-    os.environ['CLASSPATH'] = os.pathsep.join([os.path.join(duke_bin_dir, r) for r in os.listdir(duke_bin_dir)])
+    os.environ['CLASSPATH'] = _duke_classpath()
     
     # Set-up clean / empty working directory
     
@@ -0,0 +1,243 @@
+"""
+Content-addressed cache for link and clique results of single country
+blocks. A block is keyed by a hash of its normalized input rows, the duke
+config contents, the blocking settings and the engine version, so that
+changed inputs or configs invalidate exactly the affected blocks.
+"""
+
+import os
+from os import path
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import globals as glob
+from globals import SUB_LINK
+import blocking
+import linkage
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUB = path.join(SUB_LINK, 'cache')
+CACHE_INDEX_FN = 'cache_index.csv'
+CACHE_INDEX_COLS = ['key', 'kind', 'label', 'country', 'rows', 'links', 'created', 'last_used']
+
+_INDEX_LOCK = threading.Lock()
+
+def _cache_dir():
+
+    cache_dir = glob.set_path('.', CACHE_SUB)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def engine_version():
+    """
+    Identifier of the engine producing the links: the numpy engine version,
+    or the set of duke jars.
+    """
+    if linkage.use_numpy_engine():
+        return f"numpy-{linkage.ENGINE_VERSION}"
+
+    duke_bin_dir = glob.package_data('duke_binaries')
+    return "duke-" + ",".join(sorted(os.listdir(duke_bin_dir)))
+
+def row_hashes(df, columns, index=True):
+    """
+    One hash per row of df (in index order), over the columns relevant for
+    matching, with numbers as float and everything else as string.
+    """
+    df = df.reindex(columns=sorted(columns)).sort_index()
+    normalized = {}
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            normalized[col] = df[col].astype(float)
+        else:
+            normalized[col] = df[col].where(df[col].isnull(), df[col].astype(str))
+    normalized = pd.DataFrame(normalized, index=df.index.astype(str))
+
+    return pd.util.hash_pandas_object(normalized, index=index).to_numpy()
+
+def matching_columns(duke_config_fn):
+    """
+    All input columns that influence the links of a duke config: the schema
+    columns, lat / lon and the blocking name column.
+    """
+    schema = linkage.load_duke_schema(duke_config_fn)
+    columns = {col for group in schema['groups'] for csv in group for col in csv['columns']}
+    columns.update(['lat', 'lon', blocking.blocking_config()['name_col']])
+    return columns
+
+def block_key(dfs, duke_config_fn, link_kwargs=None):
+    """
+    Cache key for one block: sha1 over the normalized rows of all frames in
+    dfs, the duke config file contents, the blocking settings, the engine
+    version and the extra arguments of the linking function.
+    """
+    columns = matching_columns(duke_config_fn)
+
+    sha = hashlib.sha1()
+    for df in dfs:
+        sha.update(str(df.columns.name).encode('utf-8'))
+        sha.update(row_hashes(df, columns).tobytes())
+
+    with open(glob.package_data(duke_config_fn), 'rb') as f:
+        sha.update(f.read())
+    sha.update(json.dumps(blocking.blocking_config(), sort_keys=True).encode('utf-8'))
+    sha.update(engine_version().encode('utf-8'))
+    if link_kwargs:
+        sha.update(json.dumps(link_kwargs, sort_keys=True).encode('utf-8'))
+
+    return sha.hexdigest()
+
+def _read_index():
+
+    index_spec = path.join(_cache_dir(), CACHE_INDEX_FN)
+    if not path.exists(index_spec):
+        return pd.DataFrame(columns=CACHE_INDEX_COLS).set_index('key')
+
+    return pd.read_csv(index_spec, index_col='key', dtype={'country': str})
+
+def _write_index(index_df):
+
+    index_df.to_csv(path.join(_cache_dir(), CACHE_INDEX_FN), index_label='key')
+
+def _restore_id_dtype(ids, like_index):
+
+    if not len(ids):
+        return ids
+    if like_index.dtype != object:
+        return ids.astype(like_index.dtype)
+    # String ids that look like numbers are parsed as such by read_csv
+    return ids.astype(str)
+
+def load(key, id_like=None):
+    """
+    Return the cached links for key, or None if not cached. id_like maps
+    column labels to the index whose dtype the id columns should get.
+    """
+    block_spec = path.join(_cache_dir(), f"{key}.csv")
+    if not path.exists(block_spec):
+        return None
+
+    links = pd.read_csv(block_spec, encoding='utf-8')
+    for col, like_index in (id_like or {}).items():
+        links[col] = _restore_id_dtype(links[col], like_index)
+
+    with _INDEX_LOCK:
+        index_df = _read_index()
+        if key in index_df.index:
+            index_df.loc[key, 'last_used'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            _write_index(index_df)
+
+    return links
+
+def store(key, links, kind, label, country, rows):
+    """
+    Save links for key and register the block in the cache index.
+    """
+    links.to_csv(path.join(_cache_dir(), f"{key}.csv"), index=False, encoding='utf-8')
+
+    now_string = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with _INDEX_LOCK:
+        index_df = _read_index()
+        index_df.loc[key, ['kind', 'label', 'country', 'rows', 'links', 'created', 'last_used']] = \
+            [kind, label, country, rows, len(links), now_string, now_string]
+        _write_index(index_df)
+
+def cached_link(link_func, df_A, df_B, country=None, use_saved=True,
+                duke_config_fn="duke_find_links.xml", link_kwargs=None):
+    """
+    Run link_func(df_A, df_B, country=country, **link_kwargs) unless the
+    links of this exact block are cached already (and use_saved is True).
+    Fresh results are always stored in the cache.
+    """
+    link_kwargs = link_kwargs or {}
+    key = block_key([df_A, df_B], duke_config_fn, link_kwargs)
+    ds_A, ds_B = df_A.columns.name, df_B.columns.name
+
+    if use_saved:
+        links = load(key, id_like={ds_A: df_A.index, ds_B: df_B.index})
+        if links is not None:
+            logger.debug(f"Using cached links for {ds_A} - {ds_B} / {country}")
+            return links
+
+    links = link_func(df_A, df_B, country=country, **link_kwargs)
+    store(key, links, 'link', f"{ds_A} - {ds_B}", country, len(df_A) + len(df_B))
+
+    return links
+
+def cached_cliques(cliques_func, df, country=None, use_saved=True,
+                   duke_config_fn="duke_find_cliques.xml"):
+    """
+    Run cliques_func(df, country) unless the clique links of this exact
+    country block are cached already (and use_saved is True). Fresh results
+    are always stored in the cache.
+    """
+    key = block_key([df], duke_config_fn)
+    ds_name = df.columns.name
+
+    if use_saved:
+        links = load(key, id_like={'one': df.index, 'two': df.index})
+        if links is not None:
+            logger.debug(f"Using cached cliques for {ds_name} / {country}")
+            return links
+
+    links = cliques_func(df, country)
+    store(key, links, 'cliques', ds_name, country, len(df))
+
+    return links
+
+def list_cache():
+    """
+    Overview of all cached blocks (kind, dataset label, country, number of
+    rows and links, creation and last use), most recently used first.
+    """
+    index_df = _read_index()
+    return index_df.sort_values('last_used', ascending=False)
+
+def evict(keys=None, label=None, country=None, unused_days=None):
+    """
+    Remove cached blocks. Without arguments the whole cache is cleared,
+    otherwise only blocks matching all given criteria.
+
+    Parameters
+    ----------
+    keys : list, default None
+        cache keys as shown by list_cache()
+    label : str, default None
+        dataset label, e.g. 'ENTSOE - GPD'
+    country : str, default None
+    unused_days : float, default None
+        only blocks not used within this number of days
+
+    Returns
+    -------
+    number of evicted blocks
+    """
+    with _INDEX_LOCK:
+        index_df = _read_index()
+        selected = pd.Series(True, index=index_df.index)
+        if keys is not None:
+            selected &= index_df.index.isin(keys)
+        if label is not None:
+            selected &= index_df['label'] == label
+        if country is not None:
+            selected &= index_df['country'] == country
+        if unused_days is not None:
+            last_used = pd.to_datetime(index_df['last_used'])
+            selected &= last_used < datetime.now() - pd.Timedelta(days=unused_days)
+
+        for key in index_df.index[selected]:
+            block_spec = path.join(_cache_dir(), f"{key}.csv")
+            if path.exists(block_spec):
+                os.remove(block_spec)
+
+        _write_index(index_df[~selected])
+
+    logger.info(f"Evicted {int(selected.sum())} cached link blocks")
+
+    return int(selected.sum())
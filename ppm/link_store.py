@@ -0,0 +1,204 @@
+"""
+Persistent store of all pairwise (cross-dataset) matches and intraset
+(clique) links, one sqlite database in 08_linked. Every link is kept with
+its datasets, record ids (projectID), score, country and the run it came
+from; indexes on the record ids and on (dataset pair, score) make lookups
+of a single projectID or of the links of a pair above a score cheap.
+
+Links of a (kind, dataset pair) are replaced as a whole by each new run.
+"""
+
+import os
+from os import path
+import sqlite3
+import logging
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import globals as glob
+from globals import SUB_LINK
+from delta_link import record_ids
+
+logger = logging.getLogger(__name__)
+
+STORE_FN = "link_store.sqlite"
+
+KINDS = ('pairwise', 'intraset')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    ds_1 TEXT NOT NULL,
+    ds_2 TEXT NOT NULL,
+    created TEXT NOT NULL,
+    engine TEXT,
+    duke_config TEXT,
+    n_links INTEGER
+);
+CREATE TABLE IF NOT EXISTS links (
+    run_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    ds_1 TEXT NOT NULL,
+    id_1 TEXT NOT NULL,
+    ds_2 TEXT NOT NULL,
+    id_2 TEXT NOT NULL,
+    score REAL,
+    country TEXT
+);
+CREATE INDEX IF NOT EXISTS links_id_1 ON links (id_1);
+CREATE INDEX IF NOT EXISTS links_id_2 ON links (id_2);
+CREATE INDEX IF NOT EXISTS links_pair_score ON links (kind, ds_1, ds_2, score);
+"""
+
+def _store_spec():
+
+    link_dir = glob.set_path('.', SUB_LINK)
+    os.makedirs(link_dir, exist_ok=True)
+    return path.join(link_dir, STORE_FN)
+
+def _connect():
+
+    # Dataset pairs / cliques may be written from parallel jobs, wait for the lock
+    con = sqlite3.connect(_store_spec(), timeout=60)
+    con.executescript(_SCHEMA)
+    return con
+
+def _record_id_map(df):
+
+    ids = pd.Series(record_ids(df), index=df.index)
+    return ids[~ids.index.duplicated()]
+
+def to_record_ids(links, df_A, df_B=None):
+    """
+    Translate index-based links (first two columns index values of df_A /
+    df_B, as returned by the linking functions) into record ids.
+    """
+    df_B = df_A if df_B is None else df_B
+    col_A, col_B = links.columns[0], links.columns[1]
+
+    return links.assign(**{col_A: links[col_A].map(_record_id_map(df_A)).to_numpy(),
+                           col_B: links[col_B].map(_record_id_map(df_B)).to_numpy()})
+
+def to_index(links, df_A, df_B=None):
+    """
+    Translate record id links (as read from the store) back into the index
+    values of df_A / df_B; links to records not in the frames are dropped.
+    """
+    df_B = df_A if df_B is None else df_B
+    col_A, col_B = links.columns[0], links.columns[1]
+
+    index_A = pd.Series(df_A.index, index=record_ids(df_A))
+    index_B = pd.Series(df_B.index, index=record_ids(df_B))
+    index_A = index_A[~index_A.index.duplicated()]
+    index_B = index_B[~index_B.index.duplicated()]
+
+    links = links.assign(**{col_A: links[col_A].map(index_A).to_numpy(),
+                            col_B: links[col_B].map(index_B).to_numpy()})
+    return links.dropna(subset=[col_A, col_B]).reset_index(drop=True)
+
+def save_links(kind, links, df_A, df_B=None, engine=None, duke_config=None):
+    """
+    Replace the stored links of one dataset pair (or one dataset for
+    intraset links, df_B=None) by links, whose first two columns are index
+    values of df_A / df_B, with an optional 'scores' column. The country is
+    taken from the record of df_A. Returns the run id.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown link kind '{kind}', choose one of {KINDS}")
+
+    df_B = df_A if df_B is None else df_B
+    ds_1, ds_2 = df_A.columns.name, df_B.columns.name
+
+    id_links = to_record_ids(links, df_A, df_B).dropna(subset=links.columns[:2])
+    id_1 = id_links.iloc[:, 0].astype(str).to_numpy()
+    id_2 = id_links.iloc[:, 1].astype(str).to_numpy()
+    scores = (id_links['scores'].to_numpy(dtype=float) if 'scores' in id_links
+              else np.full(len(id_links), np.nan))
+    if 'Country' in df_A:
+        countries = links.iloc[:, 0].map(df_A['Country'][~df_A.index.duplicated()])
+        countries = countries.reindex(id_links.index).astype(object).to_numpy()
+    else:
+        countries = np.full(len(id_links), None)
+
+    with closing(_connect()) as con, con:
+        con.execute("DELETE FROM links WHERE kind = ? AND ((ds_1 = ? AND ds_2 = ?) OR (ds_1 = ? AND ds_2 = ?))",
+                    (kind, ds_1, ds_2, ds_2, ds_1))
+        run_id = con.execute("INSERT INTO runs (kind, ds_1, ds_2, created, engine, duke_config, n_links) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (kind, ds_1, ds_2, datetime.now().isoformat(timespec='seconds'),
+                              engine, duke_config, len(id_links))).lastrowid
+        rows = pd.DataFrame({'run_id': run_id, 'kind': kind, 'ds_1': ds_1, 'id_1': id_1,
+                             'ds_2': ds_2, 'id_2': id_2, 'score': scores, 'country': countries})
+        rows = rows.astype(object).where(rows.notna(), None)
+        con.executemany("INSERT INTO links VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows.itertuples(index=False, name=None))
+
+    logger.debug(f"Stored {len(id_links)} {kind} links of {ds_1} - {ds_2} (run {run_id})")
+    return run_id
+
+def _query(sql, params):
+
+    with closing(_connect()) as con:
+        return pd.read_sql_query(sql, con, params=params)
+
+def pair_links(ds_A, ds_B, min_score=None, kind='pairwise'):
+    """
+    Stored links of a dataset pair (in either order) with a score of at
+    least min_score, as a dataframe with columns [ds_A, ds_B, 'scores',
+    'country'] of record ids. For intraset links pass ds_A == ds_B and
+    kind='intraset'.
+    """
+    score_sql = "" if min_score is None else " AND score >= ?"
+    score_params = () if min_score is None else (min_score,)
+
+    parts = []
+    for ds_1, ds_2, swap in [(ds_A, ds_B, False), (ds_B, ds_A, True)]:
+        if swap and ds_A == ds_B:
+            break
+        part = _query("SELECT id_1, id_2, score, country FROM links "
+                      "WHERE kind = ? AND ds_1 = ? AND ds_2 = ?" + score_sql,
+                      (kind, ds_1, ds_2) + score_params)
+        if swap:
+            part = part.rename(columns={'id_1': 'id_2', 'id_2': 'id_1'})
+        parts.append(part)
+
+    links = pd.concat(parts, ignore_index=True)
+    if ds_A == ds_B:
+        links.columns = ['one', 'two', 'scores', 'country']
+    else:
+        links = links.reindex(columns=['id_1', 'id_2', 'score', 'country'])
+        links.columns = [ds_A, ds_B, 'scores', 'country']
+    return links
+
+def intraset_links(ds_name, country=None, min_score=None):
+    """
+    Stored clique links within one dataset, as a dataframe with columns
+    ['one', 'two', 'scores', 'country'] of record ids, optionally only
+    those of one country.
+    """
+    links = pair_links(ds_name, ds_name, min_score=min_score, kind='intraset')
+    if country is not None:
+        links = links[links.country == country].reset_index(drop=True)
+    return links
+
+def links_for(project_id):
+    """
+    All stored links (pairwise and intraset) of one record id.
+    """
+    return _query("SELECT kind, ds_1, id_1, ds_2, id_2, score, country, run_id FROM links "
+                  "WHERE id_1 = ? UNION ALL "
+                  "SELECT kind, ds_1, id_1, ds_2, id_2, score, country, run_id FROM links "
+                  "WHERE id_2 = ? AND id_1 != ?",
+                  (str(project_id), str(project_id), str(project_id)))
+
+def runs(kind=None):
+    """
+    Metadata of all runs that wrote to the store.
+    """
+    if kind is None:
+        return _query("SELECT * FROM runs ORDER BY run_id", ())
+    return _query("SELECT * FROM runs WHERE kind = ? ORDER BY run_id", (kind,))
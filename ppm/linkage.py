@@ -0,0 +1,577 @@
+"""
+In-process record linkage engine, an alternative backend to the Duke java
+process. Reads the same duke_*.xml config files and reproduces their schema
+(comparators, cleaners, low/high probabilities and threshold), but scores
+whole arrays of candidate pairs at once with numpy.
+"""
+
+import logging
+import unicodedata
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import globals as glob
+from globals import CONFIG
+import blocking
+
+logger = logging.getLogger(__name__)
+
+DUKE_COMPARATORS = 'no.priv.garshol.duke.comparators.'
+DUKE_CLEANERS = 'no.priv.garshol.duke.cleaners.'
+
+# Bump whenever scoring changes, to invalidate cached link results
+ENGINE_VERSION = '2'
+
+# Upper limit of pairs scored at once, to bound memory on large blocks
+PAIR_CHUNK_SIZE = 2000000
+
+EARTH_RADIUS_M = 6371000.0
+
+
+# DUKE SCHEMA
+# ===========
+
+@lru_cache(maxsize=None)
+def load_duke_schema(duke_config_fn):
+    """
+    Parse a packaged duke config file into a plain dictionary:
+
+    {'threshold': float,
+     'id_property': str,
+     'properties': {prop_name: {'comparator': str, 'params': dict,
+                                'low': float, 'high': float}},
+     'groups': [[{'input_file': str,
+                  'columns': {col_name: (prop_name, cleaner)}}, ...], ...]}
+
+    Named comparator objects (e.g. the GeoComparator) are resolved to their
+    class and parameters.
+    """
+    root = ET.parse(glob.package_data(duke_config_fn)).getroot()
+
+    objects = {}
+    for obj in root.findall('object'):
+        params = {p.get('name'): p.get('value') for p in obj.findall('param')}
+        objects[obj.get('name')] = (obj.get('class'), params)
+
+    schema_el = root.find('schema')
+    schema = {'threshold': float(schema_el.findtext('threshold')),
+              'id_property': None,
+              'properties': {},
+              'groups': []}
+
+    for prop in schema_el.findall('property'):
+        prop_name = prop.findtext('name').strip()
+        if prop.get('type') == 'id':
+            schema['id_property'] = prop_name
+            continue
+
+        comparator = prop.findtext('comparator').strip()
+        comparator, params = objects.get(comparator, (comparator, {}))
+        schema['properties'][prop_name] = {'comparator': comparator.replace(DUKE_COMPARATORS, ''),
+                                           'params': params,
+                                           'low': float(prop.findtext('low')),
+                                           'high': float(prop.findtext('high'))}
+
+    def parse_csv(csv_el):
+        input_file = [p.get('value') for p in csv_el.findall('param')
+                      if p.get('name') == 'input-file'][0]
+        columns = {}
+        for col in csv_el.findall('column'):
+            cleaner = col.get('cleaner')
+            if cleaner is not None:
+                cleaner = cleaner.replace(DUKE_CLEANERS, '')
+            columns[col.get('name')] = (col.get('property'), cleaner)
+        return {'input_file': input_file, 'columns': columns}
+
+    groups = root.findall('group')
+    if groups:
+        schema['groups'] = [[parse_csv(c) for c in group.findall('csv')] for group in groups]
+    else:
+        schema['groups'] = [[parse_csv(c) for c in root.findall('csv')]]
+
+    return schema
+
+
+# CLEANERS
+# ========
+
+def _lower_case_normalize(values):
+    """
+    Vectorized LowerCaseNormalizeCleaner: lower-case, strip accents and
+    normalize whitespace. Empty results become missing values.
+    """
+    def strip_accents(text):
+        decomposed = unicodedata.normalize('NFKD', text)
+        return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+    uniques = pd.Series(values.dropna().astype(str).unique())
+    cleaned = (uniques.map(strip_accents)
+                      .str.lower()
+                      .str.replace(r'\s+', ' ', regex=True)
+                      .str.strip())
+    out = values.map(dict(zip(uniques, cleaned)))
+
+    return out.where(out != "")
+
+CLEANER_FUNCS = {'LowerCaseNormalizeCleaner': _lower_case_normalize}
+
+
+# COMPARATORS
+# ===========
+
+@lru_cache(maxsize=None)
+def jaro_winkler(s1, s2):
+    """
+    Jaro-Winkler similarity as implemented by Duke's JaroWinkler comparator.
+    """
+    if s1 == s2:
+        return 1.0
+
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+
+    maxdist = (len(s2) // 2) - 1
+    common = 0
+    transpositions = 0
+    prevpos = -1
+    for ix, ch in enumerate(s1):
+        for ix2 in range(max(0, ix - maxdist), min(len(s2), ix + maxdist)):
+            if ch == s2[ix2]:
+                common += 1
+                if prevpos != -1 and ix2 < prevpos:
+                    transpositions += 1
+                prevpos = ix2
+                break
+
+    if common == 0:
+        return 0.0
+
+    score = (common / len(s1) + common / len(s2) + (common - transpositions) / common) / 3.0
+
+    prefix = 0
+    for ix in range(min(4, len(s1))):
+        if s1[ix] != s2[ix]:
+            break
+        prefix += 1
+
+    return score + (prefix * (1 - score)) / 10
+
+@lru_cache(maxsize=None)
+def _tokens(text):
+    return tuple(text.split())
+
+def jaro_winkler_tokenized(s1, s2):
+    """
+    Duke's JaroWinklerTokenized: best Jaro-Winkler match in the longer token
+    list for each token of the shorter one, averaged over both token lists.
+    """
+    t1, t2 = _tokens(s1), _tokens(s2)
+    if len(t1) > len(t2):
+        t1, t2 = t2, t1
+    if len(t1) == 0:
+        return 0.0
+
+    total = sum(max(jaro_winkler(a, b) for b in t2) for a in t1)
+    return (total * 2) / (len(t1) + len(t2))
+
+@lru_cache(maxsize=None)
+def _qgrams(text, q=2):
+    return frozenset(text[ix:ix + q] for ix in range(len(text) - q + 1))
+
+def qgram_overlap(s1, s2):
+    """
+    Duke's QGramComparator with default settings (q=2, overlap formula).
+    """
+    if s1 == s2:
+        return 1.0
+
+    q1, q2 = _qgrams(s1), _qgrams(s2)
+    if not q1 or not q2:
+        return 0.0
+
+    return len(q1 & q2) / min(len(q1), len(q2))
+
+STRING_COMPARATORS = {'JaroWinklerTokenized': jaro_winkler_tokenized,
+                      'JaroWinkler': jaro_winkler,
+                      'QGramComparator': qgram_overlap}
+
+def _compare_strings(func, values_a, values_b):
+    """
+    Apply a scalar string comparator over aligned arrays of values. Every
+    distinct value pair is scored only once and broadcast back.
+    """
+    codes_a, uniques_a = pd.factorize(values_a)
+    codes_b, uniques_b = pd.factorize(values_b)
+
+    pair_keys = codes_a.astype(np.int64) * max(len(uniques_b), 1) + codes_b
+    unique_keys, inverse = np.unique(pair_keys, return_inverse=True)
+
+    unique_sims = np.fromiter((func(uniques_a[key // max(len(uniques_b), 1)],
+                                    uniques_b[key % max(len(uniques_b), 1)])
+                               for key in unique_keys),
+                              dtype=float, count=len(unique_keys))
+
+    return unique_sims[inverse]
+
+def _compare_numeric(values_a, values_b, params, unparsed=None):
+    """
+    Duke's NumericComparator: ratio of the smaller to the larger value, 0.5
+    for pairs where either value is not a number (flagged by unparsed).
+    """
+    min_ratio = float(params.get('min-ratio', 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.minimum(values_a, values_b) / np.maximum(values_a, values_b)
+    ratio = np.where(values_a == values_b, 1.0, np.nan_to_num(ratio))
+    ratio = np.where(ratio < min_ratio, 0.0, ratio)
+
+    if unparsed is None:
+        return ratio
+    return np.where(unparsed, 0.5, ratio)
+
+def _compare_geoposition(lat_a, lon_a, lat_b, lon_b, params):
+    """
+    Duke's GeopositionComparator: haversine distance scaled linearly from 1
+    down to 0.5 at max-distance (in meters), 0 beyond it.
+    """
+    max_distance = float(params.get('max-distance', 5000))
+    lat_a, lon_a, lat_b, lon_b = map(np.radians, (lat_a, lon_a, lat_b, lon_b))
+
+    hav = (np.sin((lat_b - lat_a) / 2) ** 2 +
+           np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2)
+    distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0)))
+
+    return np.where(distance > max_distance, 0.0,
+                    0.5 + 0.5 * (1.0 - distance / max_distance))
+
+
+# RECORDS AND SCORING
+# ===================
+
+def schema_records(df, schema, group=0):
+    """
+    Turn a dataframe into the cleaned property values Duke would see for it,
+    using the column mapping of the given schema group. Returns a dataframe
+    with the same index and one column per schema property. Geoposition
+    properties are returned as two float columns <PROP>_lat and <PROP>_lon,
+    numeric properties as a float column plus a boolean column <PROP>_unparsed
+    flagging values that are present but not a number.
+    """
+    records = pd.DataFrame(index=df.index)
+    columns = schema['groups'][group][0]['columns']
+
+    for col_name, (prop_name, cleaner) in columns.items():
+        if prop_name == schema['id_property']:
+            continue
+
+        comparator = schema['properties'][prop_name]['comparator']
+
+        if comparator == 'GeopositionComparator':
+            if col_name in df:
+                latlon = df[col_name].astype(str).str.split(',', n=1, expand=True)
+                latlon = latlon.reindex(columns=[0, 1])
+                lat = pd.to_numeric(latlon[0], errors='coerce')
+                lon = pd.to_numeric(latlon[1], errors='coerce')
+            else:
+                lat = pd.to_numeric(df.get('lat'), errors='coerce')
+                lon = pd.to_numeric(df.get('lon'), errors='coerce')
+            records[prop_name + '_lat'] = lat
+            records[prop_name + '_lon'] = lon
+            continue
+
+        if col_name not in df:
+            logger.warning(f"Column {col_name} for property {prop_name} not found, "
+                           "property is ignored in matching")
+            records[prop_name] = np.nan
+            continue
+
+        if comparator == 'NumericComparator':
+            numbers = pd.to_numeric(df[col_name], errors='coerce')
+            present = df[col_name].notnull() & (df[col_name].astype(str).str.strip() != "")
+            records[prop_name] = numbers
+            records[prop_name + '_unparsed'] = present & numbers.isnull()
+            continue
+
+        values = df[col_name].where(df[col_name].notnull())
+        values = values.where(values.isnull(), values.astype(str))
+        if cleaner is not None:
+            values = CLEANER_FUNCS[cleaner](values)
+        else:
+            values = values.where(values.str.strip() != "")
+        records[prop_name] = values
+
+    return records
+
+def _unparsed(records, prop_name):
+
+    col = prop_name + '_unparsed'
+    if col not in records:
+        return np.zeros(len(records), dtype=bool)
+    return records[col].to_numpy(dtype=bool)
+
+def property_similarity(prop_name, prop, records_a, records_b, pos_a, pos_b):
+    """
+    Similarity of one property for the candidate pairs (pos_a, pos_b), given
+    as positions into records_a / records_b. Returns (similarity, valid),
+    where valid flags pairs where both records carry a value.
+    """
+    comparator = prop['comparator']
+
+    if comparator == 'GeopositionComparator':
+        lat_a = records_a[prop_name + '_lat'].to_numpy(dtype=float)[pos_a]
+        lon_a = records_a[prop_name + '_lon'].to_numpy(dtype=float)[pos_a]
+        lat_b = records_b[prop_name + '_lat'].to_numpy(dtype=float)[pos_b]
+        lon_b = records_b[prop_name + '_lon'].to_numpy(dtype=float)[pos_b]
+        valid = ~(np.isnan(lat_a) | np.isnan(lon_a) | np.isnan(lat_b) | np.isnan(lon_b))
+        sim = np.zeros(len(pos_a))
+        sim[valid] = _compare_geoposition(lat_a[valid], lon_a[valid],
+                                          lat_b[valid], lon_b[valid], prop['params'])
+        return sim, valid
+
+    if comparator == 'NumericComparator':
+        values_a = records_a[prop_name].to_numpy(dtype=float)[pos_a]
+        values_b = records_b[prop_name].to_numpy(dtype=float)[pos_b]
+        unparsed_a = _unparsed(records_a, prop_name)[pos_a]
+        unparsed_b = _unparsed(records_b, prop_name)[pos_b]
+        # Values that are not numbers still count as present, Duke scores them 0.5
+        valid = ((~np.isnan(values_a) | unparsed_a) &
+                 (~np.isnan(values_b) | unparsed_b))
+        sim = np.zeros(len(pos_a))
+        sim[valid] = _compare_numeric(values_a[valid], values_b[valid], prop['params'],
+                                      unparsed=(unparsed_a | unparsed_b)[valid])
+        return sim, valid
+
+    if comparator not in STRING_COMPARATORS:
+        raise NotImplementedError(f"Duke comparator {comparator} is not supported "
+                                  "by the numpy linkage engine")
+
+    values_a = records_a[prop_name].to_numpy(dtype=object)[pos_a]
+    values_b = records_b[prop_name].to_numpy(dtype=object)[pos_b]
+    valid = pd.notnull(values_a) & pd.notnull(values_b)
+    sim = np.zeros(len(pos_a))
+    if valid.any():
+        sim[valid] = _compare_strings(STRING_COMPARATORS[comparator],
+                                      values_a[valid], values_b[valid])
+    return sim, valid
+
+def property_probability(sim, prop):
+    """
+    Duke's mapping of a similarity onto the low/high probability range.
+    """
+    return np.where(sim < 0.5, prop['low'], (prop['high'] - 0.5) * sim ** 2 + 0.5)
+
+def bayes(prob_a, prob_b):
+    """
+    Duke's combination of two independent match probabilities.
+    """
+    joint = prob_a * prob_b
+    return joint / (joint + (1 - prob_a) * (1 - prob_b))
+
+def score_pairs(records_a, records_b, pos_a, pos_b, schema, details=False):
+    """
+    Overall Duke match probability for all candidate pairs (pos_a, pos_b) in
+    one go. Properties missing on either side are skipped, as in Duke.
+
+    If details is True, additionally returns a dict keyed by property name
+    with the per-pair 'sim', 'prob', 'valid' and the running overall
+    probability 'before' / 'after' that property.
+    """
+    score = np.full(len(pos_a), 0.5)
+    prop_details = {}
+
+    for prop_name, prop in schema['properties'].items():
+        sim, valid = property_similarity(prop_name, prop, records_a, records_b, pos_a, pos_b)
+        prob = property_probability(sim, prop)
+        before = score
+        score = np.where(valid, bayes(score, prob), score)
+        if details:
+            prop_details[prop_name] = {'sim': sim, 'prob': prob, 'valid': valid,
+                                       'before': before, 'after': score}
+
+    if details:
+        return score, prop_details
+    return score
+
+def _all_pairs(n_a, n_b, upper=False):
+    """
+    Generate all candidate pairs of two blocks as chunks of position arrays.
+    With upper=True (a block against itself) only pairs pos_a < pos_b are
+    generated, as Duke's scores are symmetric.
+    """
+    rows_per_chunk = max(1, PAIR_CHUNK_SIZE // max(n_b, 1))
+    for start in range(0, n_a, rows_per_chunk):
+        stop = min(n_a, start + rows_per_chunk)
+        pos_a = np.repeat(np.arange(start, stop), n_b)
+        pos_b = np.tile(np.arange(n_b), stop - start)
+        if upper:
+            keep = pos_a < pos_b
+            pos_a, pos_b = pos_a[keep], pos_b[keep]
+        yield pos_a, pos_b
+
+def _chunked(pos_a, pos_b):
+
+    for start in range(0, len(pos_a), PAIR_CHUNK_SIZE):
+        yield pos_a[start:start + PAIR_CHUNK_SIZE], pos_b[start:start + PAIR_CHUNK_SIZE]
+
+def candidate_pairs(df_A, df_B, schema, upper=False):
+    """
+    Candidate pair chunks for scoring: blocked pairs if blocking is enabled
+    in config.yaml, all pairs otherwise.
+    """
+    if blocking.blocking_config()['enabled']:
+        pos_a, pos_b, _ = blocking.candidate_pairs(df_A, None if upper else df_B,
+                                                   max_distance=blocking.geo_max_distance(schema),
+                                                   capacity_bands=blocking.capacity_bands_apply(schema))
+        return _chunked(pos_a, pos_b)
+
+    return _all_pairs(len(df_A), len(df_B), upper=upper)
+
+def _score_candidates(records_a, records_b, candidates, schema, threshold=None):
+    """
+    Score all candidate chunks and keep the pairs above the threshold
+    (default: the schema threshold).
+    """
+    if threshold is None:
+        threshold = schema['threshold']
+    kept_a, kept_b, kept_scores = [], [], []
+    for pos_a, pos_b in candidates:
+        if len(pos_a) == 0:
+            continue
+        score = score_pairs(records_a, records_b, pos_a, pos_b, schema)
+        above = score > threshold
+        kept_a.append(pos_a[above])
+        kept_b.append(pos_b[above])
+        kept_scores.append(score[above])
+
+    if not kept_a:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+    return np.concatenate(kept_a), np.concatenate(kept_b), np.concatenate(kept_scores)
+
+
+# DUKE-COMPATIBLE ENTRY POINTS
+# ============================
+
+def link_datasets(df_A, df_B, country=None, duke_config_fn="duke_find_links.xml",
+                  threshold=None, singlematch=True):
+    """
+    Numpy counterpart of duke.duke_link (record linkage, --singlematch mode).
+    Each record of df_A is linked to its best scoring record of df_B, if that
+    score is above the schema threshold (or the given threshold). With
+    singlematch=False all links above the threshold are returned. Returns
+    the same dataframe as duke_link, with columns [name of df_A, name of
+    df_B, 'scores'].
+    """
+    ds_A = df_A.columns.name
+    ds_B = df_B.columns.name
+    col_labels = [ds_A, ds_B, 'scores']
+    print(f"Executing numpy linkage for {ds_A} - {ds_B} / {country} . . .")
+
+    schema = load_duke_schema(duke_config_fn)
+    records_a = schema_records(df_A, schema)
+    records_b = schema_records(df_B, schema)
+
+    candidates = candidate_pairs(df_A, df_B, schema)
+    pos_a, pos_b, scores = _score_candidates(records_a, records_b, candidates, schema,
+                                             threshold=threshold)
+
+    if not singlematch:
+        return pd.DataFrame({ds_A: df_A.index.values[pos_a],
+                             ds_B: df_B.index.values[pos_b],
+                             'scores': scores},
+                            columns=col_labels)
+
+    # Singlematch: keep only the best link for each record of df_A
+    order = np.lexsort((-scores, pos_a))
+    pos_a, pos_b, scores = pos_a[order], pos_b[order], scores[order]
+    first = np.ones(len(pos_a), dtype=bool)
+    first[1:] = pos_a[1:] != pos_a[:-1]
+
+    return pd.DataFrame({ds_A: df_A.index.values[pos_a[first]],
+                         ds_B: df_B.index.values[pos_b[first]],
+                         'scores': scores[first]},
+                        columns=col_labels)
+
+def find_cliques(in_df, country=None, duke_config_fn="duke_find_cliques.xml"):
+    """
+    Numpy counterpart of duke.duke_cliques (deduplication mode). Returns all
+    links above the schema threshold in both directions, as a dataframe with
+    columns ['one', 'two', 'scores'] like duke_cliques.
+    """
+    ds_name = in_df.columns.name
+    print(f"Finding unit cliques (numpy) for {ds_name} / {country} . . .")
+
+    schema = load_duke_schema(duke_config_fn)
+    records = schema_records(in_df, schema)
+
+    candidates = candidate_pairs(in_df, in_df, schema, upper=True)
+    pos_a, pos_b, scores = _score_candidates(records, records, candidates, schema)
+
+    ids = in_df.index.values
+    one = np.concatenate([ids[pos_a], ids[pos_b]])
+    two = np.concatenate([ids[pos_b], ids[pos_a]])
+    return pd.DataFrame({'one': one, 'two': two, 'scores': np.concatenate([scores, scores])},
+                        columns=['one', 'two', 'scores'])
+
+def debug_compare(df, id_pairs, duke_config_fn="duke_find_cliques.xml"):
+    """
+    Batched counterpart of Duke's DebugCompare: per-property breakdown of the
+    match probability for each (id1, id2) pair in id_pairs, all scored in one
+    pass over the records of df (indexed by the schema's ID column).
+
+    Returns a dict keyed by id pair with the same two-part result as
+    diagnostics.parse_DebugCompare_stdout: a dict per property with 'val1',
+    'val2', 'score', 'prob' and 'delta' (empty if either record lacks the
+    property), and the overall score. Pairs with unknown ids get an empty
+    dict and NaN.
+    """
+    schema = load_duke_schema(duke_config_fn)
+    id_pairs = [tuple(pair) for pair in id_pairs]
+
+    df = df[~df.index.duplicated()]
+    records = schema_records(df, schema)
+    positions = pd.Series(np.arange(len(df)), index=df.index)
+
+    pos_a = positions.reindex([pair[0] for pair in id_pairs]).to_numpy()
+    pos_b = positions.reindex([pair[1] for pair in id_pairs]).to_numpy()
+    known = ~(np.isnan(pos_a) | np.isnan(pos_b))
+    if not known.all():
+        unknown = [pair for pair, k in zip(id_pairs, known) if not k]
+        logger.warning(f"Ids not found in records, pairs skipped: {unknown}")
+
+    pos_a, pos_b = pos_a[known].astype(int), pos_b[known].astype(int)
+    scores, prop_details = score_pairs(records, records, pos_a, pos_b, schema, details=True)
+
+    def prop_values(prop_name, prop, pos):
+        if prop['comparator'] == 'GeopositionComparator':
+            lat = records[prop_name + '_lat'].to_numpy()[pos]
+            lon = records[prop_name + '_lon'].to_numpy()[pos]
+            return [f"{la},{lo}" for la, lo in zip(lat, lon)]
+        return records[prop_name].to_numpy()[pos]
+
+    values = {prop_name: (prop_values(prop_name, prop, pos_a), prop_values(prop_name, prop, pos_b))
+              for prop_name, prop in schema['properties'].items()}
+
+    debug_data = {pair: ({}, np.nan) for pair in id_pairs}
+    known_pairs = [pair for pair, k in zip(id_pairs, known) if k]
+    for i, pair in enumerate(known_pairs):
+        prop_data_dict = {}
+        for prop_name, details in prop_details.items():
+            prop_data_dict[prop_name] = {}
+            if details['valid'][i]:
+                prop_data_dict[prop_name] = {'val1': values[prop_name][0][i],
+                                             'val2': values[prop_name][1][i],
+                                             'score': float(details['sim'][i]),
+                                             'prob': float(details['prob'][i]),
+                                             'delta': float(details['after'][i] - details['before'][i])}
+        debug_data[pair] = (prop_data_dict, float(scores[i]))
+
+    return debug_data
+
+def use_numpy_engine():
+    """
+    True if config.yaml selects the in-process numpy engine over Duke.
+    """
+    return CONFIG.get('linking_engine', 'duke') == 'numpy'
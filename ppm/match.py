@@ -2,38 +2,136 @@
 Functions for linking and combining different datasets
 """
 
-import os.path
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.optimize import linear_sum_assignment
 from itertools import combinations
 import logging
 
+import globals as glob
 from globals import CONFIG, DATASET_LABELS, SUB_LINK
 
-from utils import parmap
+from utils import parmap, bounded_map
 from duke import duke_link
+import linkage
+import link_cache
+import delta_link
+import score_store
+import link_store
 from cleaning_functions import clean_technology
 
 logger = logging.getLogger(__name__)
 
-def best_matches(links):
+# Largest block (linked ids of dataset A x dataset B) solved by the optimal assignment
+ASSIGNMENT_MAX_CELLS = 4000000
+
+def _greedy_matches(links):
+    """
+    Greedy one-to-one matching: links are taken in order of decreasing
+    score (ties in their original order), skipping those whose id of either
+    dataset is already matched.
+    """
+    ranked = links.sort_values('scores', ascending=False, kind='mergesort')
+    codes_a, uniques_a = pd.factorize(ranked.iloc[:, 0])
+    codes_b, uniques_b = pd.factorize(ranked.iloc[:, 1])
+
+    used_a = np.zeros(len(uniques_a), dtype=bool)
+    used_b = np.zeros(len(uniques_b), dtype=bool)
+    keep = np.zeros(len(ranked), dtype=bool)
+    for i, (a, b) in enumerate(zip(codes_a, codes_b)):
+        if not (used_a[a] or used_b[b]):
+            used_a[a] = used_b[b] = keep[i] = True
+
+    return ranked[keep]
+
+def _assignment_matches(links):
+    """
+    Maximum-weight one-to-one assignment of the links, solved separately for
+    each connected block of linked ids.
+    """
+    links = (links.sort_values('scores', ascending=False, kind='mergesort')
+                  .drop_duplicates(subset=[links.columns[0], links.columns[1]]))
+    codes_a, uniques_a = pd.factorize(links.iloc[:, 0])
+    codes_b, uniques_b = pd.factorize(links.iloc[:, 1])
+    scores = links.scores.to_numpy(dtype=float)
+
+    n_a = len(uniques_a)
+    graph = sparse.coo_matrix((np.ones(len(links)), (codes_a, n_a + codes_b)),
+                              shape=(n_a + len(uniques_b),) * 2)
+    _, block = csgraph.connected_components(graph, directed=False)
+    link_block = block[codes_a]
+
+    keep = []
+    order = np.argsort(link_block, kind='mergesort')
+    starts = np.flatnonzero(np.r_[True, np.diff(link_block[order]) != 0])
+    for rows in np.split(order, starts[1:]):
+        if len(rows) == 1:
+            keep.append(rows)
+            continue
+        block_a, rows_a = np.unique(codes_a[rows], return_inverse=True)
+        block_b, rows_b = np.unique(codes_b[rows], return_inverse=True)
+        if len(block_a) * len(block_b) > ASSIGNMENT_MAX_CELLS:
+            logger.warning(f"Block of {len(block_a)} x {len(block_b)} linked ids too large "
+                           "for the assignment, using greedy best matches for it")
+            greedy = _greedy_matches(links.iloc[rows])
+            keep.append(rows[np.isin(rows, links.index.get_indexer(greedy.index))])
+            continue
+        weights = np.zeros((len(block_a), len(block_b)))
+        link_pos = np.full((len(block_a), len(block_b)), -1)
+        weights[rows_a, rows_b] = scores[rows]
+        link_pos[rows_a, rows_b] = rows
+        assigned_a, assigned_b = linear_sum_assignment(weights, maximize=True)
+        assigned = link_pos[assigned_a, assigned_b]
+        keep.append(assigned[assigned >= 0])
+
+    return links.iloc[np.sort(np.concatenate(keep))] if keep else links
+
+def best_matches(links, mode=None):
     """
     Subsequent to duke() with singlematch=True. Returns reduced list of
-    matches on the base of the highest score for each duplicated entry.
+    matches (with their scores) on the base of the highest score for each
+    duplicated entry, such that every id of both datasets appears in one
+    link at most.
 
     Parameters
     ----------
     links : pd.DataFrame
         Links as returned by duke
+    mode : str, default None
+        'greedy' takes the links by decreasing score as long as neither of
+        their ids is matched yet, 'mutual' only links that are the best for both
+        of their ids, and 'assignment' the one-to-one links with the highest
+        total score per block of linked ids. Defaults to
+        config.yaml:best_match_mode.
     """
-    labels = links.columns.difference({'scores'})
+    if mode is None:
+        mode = CONFIG.get('best_match_mode', 'greedy')
+
+    label_a, label_b = links.columns[0], links.columns[1]
+    links = links.dropna(subset=[label_a, label_b])
+    ranked = links.sort_values('scores', ascending=False, kind='mergesort')
+
+    if mode == 'greedy':
+        matches = _greedy_matches(links)
+
+    elif mode == 'mutual':
+        best_for_a = ranked.drop_duplicates(subset=label_a).index
+        best_for_b = ranked.drop_duplicates(subset=label_b).index
+        matches = ranked.loc[best_for_a.intersection(best_for_b)]
 
-    links = links.groupby(links.iloc[:, 1], as_index=False, sort=False)
-    links = links.apply(lambda x: x.loc[x.scores.idxmax(), labels])
+    elif mode == 'assignment':
+        matches = _assignment_matches(links)
 
-    return links
+    else:
+        raise ValueError(f"Unknown best_matches mode '{mode}', "
+                         "choose from 'greedy', 'mutual' or 'assignment'")
+
+    return matches.sort_index().reset_index(drop=True)
 
-def compare_two_datasets(df_pair, label_pair, use_saved_matches=False, country_wise=True):
+def compare_two_datasets(df_pair, label_pair, use_saved_matches=False, country_wise=True,
+                         incremental=None):
     """
     Duke-based horizontal match of two databases. Returns the matched
     dataframe including only the matched entries in a multi-indexed
@@ -50,54 +148,104 @@ def compare_two_datasets(df_pair, label_pair, use_saved_matches=False, country_w
     Parameters
     ----------
     dfs : list of pandas.Dataframe to use for the matching
+    use_saved_matches : bool, default False
+        Reuse cached links of country blocks whose input rows, duke config
+        and engine are unchanged (see link_cache); only the other blocks are
+        linked again
+    incremental : bool, default None
+        Only link records added or changed since the last run of this pair
+        and merge them into the previous links (see delta_link), defaults
+        to config.yaml:incremental_linking. With the score store enabled
+        (config.yaml:score_store) all candidate links down to its
+        recall_threshold are kept in 08_linked/scores for re-thresholding
+        (see score_store); this is skipped in incremental mode
     
     """
     
     pair = np.sort(label_pair)
 
     pair_match_spec = f"matches_{pair[0]}_{pair[1]}.csv"
-    saving_path = _set_path(pair_match_spec, SUB_LINK)
-    if use_saved_matches:
-        if os.path.exists(saving_path):
-            logger.info(f"Reading saved matches for df_pair {pair[0]} and {pair[1]}")
-            return pd.read_csv(saving_path, index_col=0)
+    saving_path = glob.set_path(pair_match_spec, SUB_LINK)
 
-        else:
-            logger.warning(f"Non-existing saved matches for dataset {pair[0]}, {pair[1]}."
-                           "continuing by matching again . . .")
+    link_func = linkage.link_datasets if linkage.use_numpy_engine() else duke_link
 
-    def country_link(df_pair, country):
+    if incremental is None:
+        incremental = CONFIG.get('incremental_linking', False)
 
-        # country_selector for both dataframes
-        sel_country_b = [df['Country'] == country for df in df_pair]
+    store = score_store.store_config()
+    store_scores = store['enabled'] and not incremental
+    link_kwargs = {}
+    if store_scores:
+        # Link down to the recall threshold and keep all candidates of each record
+        link_kwargs = {'threshold': store['recall_threshold'], 'singlematch': False}
 
-        # only append if country appears in both dataframse
-        if all(sel.any() for sel in sel_country_b):
-            datasets = [ df[sel] for df, sel in zip(df_pair, sel_country_b)]
-            out_df = duke_link(datasets[0], datasets[1], country=country)
+    def country_link(job):
 
-        else:
-            out_df = pd.DataFrame()
+        df_A, df_B, country = job
+        # Country blocks whose inputs and config are unchanged come from the link cache
+        return link_cache.cached_link(link_func, df_A, df_B, country=country,
+                                      use_saved=use_saved_matches, link_kwargs=link_kwargs)
+
+    def link_pair(df_A, df_B):
 
-        return out_df
+        if not country_wise:
+            return link_func(df_A, df_B, **link_kwargs)
 
-    if country_wise:
-        countries = CONFIG['target_countries']
-        links = pd.DataFrame()
+        # Split both frames by country once; only countries in both need linking
+        country_groups = [dict(tuple(df.groupby('Country', sort=False))) for df in (df_A, df_B)]
+        jobs = [(country_groups[0][country], country_groups[1][country], country)
+                for country in CONFIG['target_countries']
+                if country in country_groups[0] and country in country_groups[1]]
 
-        # links = pd.concat([country_link(dfs, c) for c in countries])
-        for country in countries:
-            df = country_link(df_pair, country)
-            links = links.append(df)
+        weights = [len(df_A) * len(df_B) for df_A, df_B, _ in jobs]
+        country_links = bounded_map(country_link, jobs, weights=weights)
+        if not country_links:
+            return pd.DataFrame(columns=[df_A.columns.name, df_B.columns.name, 'scores'])
+        return pd.concat(country_links, ignore_index=True)
 
+    if incremental:
+        links = delta_link.incremental_links(df_pair[0], df_pair[1], link_pair)
     else:
-        links = duke_link(df_pair, labels=label_pair)
+        links = link_pair(*df_pair)
+
+    if store_scores:
+        score_store.save(links, store['recall_threshold'])
+        threshold = linkage.load_duke_schema("duke_find_links.xml")['threshold']
+        links = score_store.singlematch(links[links.scores > threshold])
 
     matches = best_matches(links)
     matches.to_csv(saving_path)
 
     return matches
 
+def _constrained_components(n_nodes, node_ds, edge_a, edge_b, edge_scores):
+    """
+    Union-find over the edges in order of decreasing score, where an edge is
+    only followed if the two components it joins do not contain the same
+    dataset (Kruskal-like). Returns the component root of every node.
+    """
+    parent = np.arange(n_nodes)
+    datasets = [{ds} for ds in node_ds]
+
+    def find(node):
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    for i in np.argsort(-edge_scores, kind='mergesort'):
+        root_a, root_b = find(edge_a[i]), find(edge_b[i])
+        if root_a == root_b or datasets[root_a] & datasets[root_b]:
+            continue
+        if len(datasets[root_a]) < len(datasets[root_b]):
+            root_a, root_b = root_b, root_a
+        parent[root_b] = root_a
+        datasets[root_a] |= datasets[root_b]
+
+    return np.array([find(node) for node in range(n_nodes)])
+
 def cross_matches(sets_of_pairs, df_labels):
     """
     Combines multiple sets of pairs and returns one consistent
@@ -105,40 +253,131 @@ def cross_matches(sets_of_pairs, df_labels):
     though they did not match directly but indirectly through a
     connecting identifier of another database.
 
+    Every (dataset, id) is a node of a graph whose edges are the pairwise
+    links; each row of the result is one connected component. Components
+    holding two ids of the same dataset are split again by following their
+    links in order of decreasing score, skipping links that would join ids
+    of the same dataset.
+
     Parameters
     ----------
     sets_of_pairs : list
-        list of pd.Dataframe's containing only the matches (without
-        scores), obtained from the linkfile (duke() and
+        list of pd.Dataframe's containing only the matches (optionally
+        with their 'scores'), obtained from the linkfile (duke() and
         best_matches())
     df_labels : list of strings
         list of names of the databases, used for specifying the order
         of the output
 
     """
-    m_all = sets_of_pairs
-    matches = pd.DataFrame(columns=df_labels)
-    for i in df_labels:
-        base = [m.set_index(i) for m in m_all if i in m]
-        match_base = pd.concat(base, axis=1).reset_index()
-        matches = pd.concat([matches, match_base], sort=True)
-
-    matches = matches.drop_duplicates().reset_index(drop=True)
-    for i in df_labels:
-        matches = pd.concat([
-            matches.groupby(i, as_index=False, sort=False)
-                   .apply(lambda x: x.loc[x.isnull().sum(axis=1).idxmin()]),
-            matches[matches[i].isnull()]
-        ]).reset_index(drop=True)
+    edges = []
+    for m in sets_of_pairs:
+        ds_1, ds_2 = [col for col in m.columns if col != 'scores']
+        edges.append(pd.DataFrame({'ds_1': ds_1, 'id_1': m[ds_1].to_numpy(),
+                                   'ds_2': ds_2, 'id_2': m[ds_2].to_numpy(),
+                                   'score': m['scores'].to_numpy() if 'scores' in m else 1.0}))
+    if not edges:
+        return pd.DataFrame(columns=df_labels)
+    edges = pd.concat(edges, ignore_index=True).dropna(subset=['id_1', 'id_2'])
+
+    # Intern every (dataset, id) as an integer node
+    node_keys = pd.MultiIndex.from_arrays([np.concatenate([edges.ds_1, edges.ds_2]),
+                                           np.concatenate([edges.id_1, edges.id_2])])
+    codes, nodes = pd.factorize(node_keys)
+    n_nodes, n_edges = len(nodes), len(edges)
+    edge_a, edge_b = codes[:n_edges], codes[n_edges:]
+    node_ds = nodes.get_level_values(0).to_numpy()
+    node_id = nodes.get_level_values(1).to_numpy()
+
+    graph = sparse.coo_matrix((np.ones(n_edges), (edge_a, edge_b)), shape=(n_nodes, n_nodes))
+    _, component = csgraph.connected_components(graph, directed=False)
+
+    # Only components with a dataset conflict need the score-ordered union-find
+    ds_counts = pd.Series(1, index=pd.MultiIndex.from_arrays([component, node_ds])).groupby(level=[0, 1]).size()
+    conflicted = np.isin(component, ds_counts[ds_counts > 1].index.get_level_values(0).unique())
+    if conflicted.any():
+        sub_nodes = np.flatnonzero(conflicted)
+        sub_pos = np.full(n_nodes, -1)
+        sub_pos[sub_nodes] = np.arange(len(sub_nodes))
+        sub_edges = conflicted[edge_a]
+        roots = _constrained_components(len(sub_nodes), node_ds[sub_nodes],
+                                        sub_pos[edge_a[sub_edges]], sub_pos[edge_b[sub_edges]],
+                                        edges.score.to_numpy(dtype=float)[sub_edges])
+        component[sub_nodes] = component.max() + 1 + roots
+
+    matches = (pd.DataFrame({'component': component, 'ds': node_ds, 'id': node_id})
+               .pivot(index='component', columns='ds', values='id')
+               .reindex(columns=df_labels)
+               .rename_axis(columns=None))
 
     return (matches
             .assign(length=matches.notna().sum(axis=1))
-            .sort_values(by='length', ascending=False)
+            .sort_values(by='length', ascending=False, kind='mergesort')
             .reset_index(drop=True)
             .drop('length', axis=1)
             .reindex(columns=df_labels))
 
-def link_multiple_datasets(datasets, use_saved_matches=True):
+def _overlaps(df_A, df_B):
+    """
+    True if df_A and df_B share at least one (Country, Fueltype)
+    combination, i.e. if linking them can produce any link at all.
+    """
+    if not {'Country', 'Fueltype'} <= set(df_A.columns) & set(df_B.columns):
+        return True
+
+    combos_A = pd.MultiIndex.from_frame(df_A[['Country', 'Fueltype']].drop_duplicates())
+    combos_B = pd.MultiIndex.from_frame(df_B[['Country', 'Fueltype']].drop_duplicates())
+    return len(combos_A.intersection(combos_B)) > 0
+
+def _hub_matches(datasets, labels, use_saved_matches=True):
+    """
+    Link the datasets in order of decreasing reliability_score against a
+    growing reference set: one record per plant found so far, namely the
+    one of the most reliable dataset. Each further dataset is linked once
+    against the reference set, its unmatched records are added to it.
+    Returns the links as pairwise link tables for cross_matches and the
+    number of comparisons run.
+    """
+    order = sorted(range(len(labels)), key=lambda i: -CONFIG[labels[i]].get('reliability_score', 0))
+
+    first = order[0]
+    ref_parts = [datasets[first]]
+    ref_ds = [np.full(len(datasets[first]), labels[first], dtype=object)]
+    ref_ids = [datasets[first].index.to_numpy()]
+
+    all_matches = []
+    n_comparisons = 0
+    for i in order[1:]:
+        df_S, label_S = datasets[i], labels[i]
+        reference = pd.concat(ref_parts, ignore_index=True, sort=False)
+        reference.columns.name = "REF_" + "_".join(labels[j] for j in order[:order.index(i)])
+        ds_of_ref, id_of_ref = np.concatenate(ref_ds), np.concatenate(ref_ids)
+
+        matched = np.zeros(len(df_S), dtype=bool)
+        if _overlaps(reference, df_S):
+            print()
+            logger.info(f"Comparing {label_S} with reference set of {len(reference)} records")
+            n_comparisons += 1
+            matches = compare_two_datasets([reference, df_S], [reference.columns.name, label_S],
+                                           use_saved_matches=use_saved_matches)
+            ref_pos = matches.iloc[:, 0].to_numpy(dtype=int)
+            ref_links = pd.DataFrame({'ds': ds_of_ref[ref_pos], 'id': id_of_ref[ref_pos],
+                                      label_S: matches.iloc[:, 1].to_numpy(),
+                                      'scores': matches.scores.to_numpy()})
+            for ds_rep, links in ref_links.groupby('ds', sort=False):
+                all_matches.append(links.drop(columns='ds').rename(columns={'id': ds_rep})
+                                        .reindex(columns=[ds_rep, label_S, 'scores']))
+            matched = df_S.index.isin(matches.iloc[:, 1])
+        else:
+            logger.info(f"No (Country, Fueltype) overlap of {label_S} with the reference set, skipped")
+
+        ref_parts.append(df_S[~matched])
+        ref_ds.append(np.full((~matched).sum(), label_S, dtype=object))
+        ref_ids.append(df_S.index.to_numpy()[~matched])
+
+    return all_matches, n_comparisons
+
+def link_multiple_datasets(datasets, use_saved_matches=True, topology=None):
     """
     Duke-based horizontal match of multiple databases. Returns the
     matching indices of the datasets. Compares all properties of the
@@ -149,6 +388,9 @@ def link_multiple_datasets(datasets, use_saved_matches=True):
     link to the other database.  This leads to unique entries in the
     resulting dataframe.
 
+    The pairwise matches are saved to the link store (kind 'pairwise', see
+    link_store) and cross-matched from there.
+
     Parameters
     ----------
     datasets : list of pandas.Dataframe or strings
@@ -156,23 +398,108 @@ def link_multiple_datasets(datasets, use_saved_matches=True):
     labels : list of strings
         Names of the databases in alphabetical order and corresponding
         order to the datasets
+    topology : str, default None
+        'all_pairs' links every pair of datasets, 'hub' links each dataset
+        only against a growing reference set (see _hub_matches). Pairs
+        without any (Country, Fueltype) overlap are skipped in both.
+        Defaults to config.yaml:linking_topology.
     """
-    
+    if topology is None:
+        topology = CONFIG.get('linking_topology', 'all_pairs')
+
+    n_labels = len(DATASET_LABELS)
+    n_all_pairs = n_labels * (n_labels - 1) // 2
+
     def comp_dfs(dfs_lbs):
         print()
         logger.info('Comparing {0} with {1}'.format(*dfs_lbs[2:]))
 
         return compare_two_datasets(dfs_lbs[:2], dfs_lbs[2:], use_saved_matches=use_saved_matches)
     
-    # Returns list of tuples (0, 1), (0, 2), etc.
-    combs = list(combinations(range(len(DATASET_LABELS)), 2)) 
+    if topology == 'hub':
+        all_matches, n_comparisons = _hub_matches(datasets, DATASET_LABELS, use_saved_matches)
+
+    elif topology == 'all_pairs':
+        # Returns list of tuples (0, 1), (0, 2), etc.
+        combs = list(combinations(range(n_labels), 2))
+        combs = [(c, d) for c, d in combs if _overlaps(datasets[c], datasets[d])]
+
+        mapargs = [[datasets[c], datasets[d], DATASET_LABELS[c], DATASET_LABELS[d]] for c, d in combs]
+        weights = [len(df_A) * len(df_B) for df_A, df_B, _, _ in mapargs]
+        labels = [f"Linking {label_A} - {label_B}" for _, _, label_A, label_B in mapargs]
+        all_matches = parmap(comp_dfs, mapargs, weights=weights, labels=labels)
+        n_comparisons = len(mapargs)
 
-    mapargs = [[datasets[c], datasets[d], DATASET_LABELS[c], DATASET_LABELS[d]] for c, d in combs]
-    all_matches = parmap(comp_dfs, mapargs)
+    else:
+        raise ValueError(f"Unknown linking topology '{topology}', choose 'all_pairs' or 'hub'")
+
+    logger.info(f"Linking topology {topology}: {n_comparisons} of {n_all_pairs} dataset "
+                f"comparisons run, {n_all_pairs - n_comparisons} saved")
+
+    # Pairwise matches are kept in the link store for later lookups
+    label_dfs = dict(zip(DATASET_LABELS, datasets))
+    engine = 'numpy' if linkage.use_numpy_engine() else 'duke'
+    for matches in all_matches:
+        df_A, df_B = label_dfs[matches.columns[0]], label_dfs[matches.columns[1]]
+        link_store.save_links('pairwise', matches, df_A, df_B, engine=engine,
+                              duke_config="duke_find_links.xml")
 
     return cross_matches(all_matches, DATASET_LABELS)
 
-def combine_multiple_datasets(dfs, use_saved_matches=True):
+def combined_long(cross_matches, dfs):
+    """
+    Long form of the matched datasets: one row per plant (cluster_id, the
+    row of cross_matches) and contributing dataset, with a categorical
+    'dataset' column in the order of the cross_matches columns, followed by
+    the target columns. Unlike the wide form, no rows are stored for
+    datasets that do not contain a plant.
+
+    Parameters
+    ----------
+    cross_matches : pandas.Dataframe of the matching indexes of
+        the databases, created with cross_matches()
+    dfs : list of pandas.Dataframes in the same order as in cross_matches
+    """
+    labels = cross_matches.columns.tolist()
+
+    parts = []
+    for label, df in zip(labels, dfs):
+        ids = cross_matches[label].dropna()
+        part = df.reindex(ids).reindex(columns=CONFIG['target_columns'])
+        part.insert(0, 'dataset', label)
+        part.insert(0, 'cluster_id', ids.index.to_numpy())
+        parts.append(part.reset_index(drop=True))
+
+    long_df = (pd.concat(parts, ignore_index=True, sort=False)
+               .astype({'dataset': pd.CategoricalDtype(labels)})
+               .sort_values(['cluster_id', 'dataset'], kind='mergesort')
+               .reset_index(drop=True))
+    long_df.attrs['n_clusters'] = len(cross_matches)
+
+    return long_df
+
+def wide_view(long_df):
+    """
+    Wide (column x dataset) MultiIndex view of a long form matched frame as
+    built by combined_long(), one row per cluster_id, as returned by
+    combine_multiple_datasets(..., long=False).
+    """
+    labels = long_df['dataset'].cat.categories.tolist()
+    cols = [col for col in CONFIG['target_columns'] if col in long_df.columns]
+    n_clusters = long_df.attrs.get('n_clusters', long_df['cluster_id'].max() + 1)
+
+    wide = (long_df.set_index(['cluster_id', 'dataset'])[cols]
+            .unstack('dataset'))
+
+    return (wide.reindex(index=range(n_clusters),
+                         columns=pd.MultiIndex.from_product([cols, labels]))
+                .reset_index(drop=True))
+
+def is_long_form(df):
+
+    return not isinstance(df.columns, pd.MultiIndex) and {'cluster_id', 'dataset'} <= set(df.columns)
+
+def combine_multiple_datasets(dfs, use_saved_matches=True, long=False):
     """
     Duke-based horizontal match of multiple databases. Returns the
     matched dataframe including only the matched entries in a
@@ -190,73 +517,131 @@ def combine_multiple_datasets(dfs, use_saved_matches=True):
     labels : list of strings
         Names of the databases in alphabetical order and corresponding
         order to the datasets
+    long : bool, default False
+        Return the long form (see combined_long) instead of the wide
+        MultiIndex frame, which can be produced from it by wide_view()
     """
-    
-    def combined_dataframe(cross_matches, dfs):
-        """
-        Use this function to create a matched dataframe on base of the
-        cross matches and a list of the databases. Always order the
-        database alphabetically.
-
-        Parameters
-        ----------
-        cross_matches : pandas.Dataframe of the matching indexes of
-            the databases, created with powerplant_collection.cross_matches()
-        dfs : list of pandas.Dataframes in the same order as in cross_matches
-        """
-        
-        # datasets = list(map(read_csv_if_string, datasets))
-
-        for i, df in enumerate(dfs):
-            dfs[i] = (df
-                           .reindex(cross_matches.iloc[:, i])
-                           .reset_index(drop=True))
-        return (pd.concat(dfs, axis=1,
-                          keys=cross_matches.columns.tolist())
-                .reorder_levels([1, 0], axis=1)
-                .reindex(columns=CONFIG['target_columns'], level=0)
-                .reset_index(drop=True))
-
     crossmatches = link_multiple_datasets(dfs, use_saved_matches=use_saved_matches)
+    long_df = combined_long(crossmatches, dfs)
 
-    return (combined_dataframe(crossmatches, dfs)
-            .reindex(columns=CONFIG['target_columns'], level=0))
+    if long:
+        return long_df
+    return wide_view(long_df)
+
+def _first_valid(block):
+    """
+    Row-wise first non-null value of block, whose columns are in priority
+    order (NaN if the row has no value at all).
+    """
+    values = block.to_numpy()
+    valid = block.notna().to_numpy()
+    first = valid.argmax(axis=1)
+    result = values[np.arange(len(values)), first]
+    if not valid.all():
+        result = result.astype(np.result_type(result.dtype, np.float64)) \
+            if result.dtype.kind in 'biu' else result
+        result[~valid.any(axis=1)] = np.nan
+
+    return result
+
+def _project_id_dicts(block):
+    """
+    Row-wise dict {dataset: projectID} of the non-null projectIDs in block,
+    with datasets in the (priority) order of its columns.
+    """
+    ids = block.stack()
+    rows = ids.index.get_level_values(0)
+    datasets = ids.index.get_level_values(1)
+
+    dicts = {row: {} for row in block.index}
+    for row, ds_name, project_id in zip(rows, datasets, ids.to_numpy()):
+        dicts[row][ds_name] = project_id
+
+    return [dicts[row] for row in block.index]
 
 def reduce_matched_dataframe(df, show_orig_names=False):
     """
     Reduce a matched dataframe to a unique set of columns. For each entry
     take the value of the most reliable data source included in that match.
 
+    Works column by column on the wide frame: the first non-null value in
+    order of reliability is picked with a mask per column, DateRetrofit is
+    the latest of all sources and projectID a dict {dataset: projectID}.
+
     Parameters
     ----------
     df : pandas.Dataframe
         MultiIndex dataframe with the matched powerplants, as obtained from
-        combined_dataframe() or match_multiple_datasets()
+        combined_dataframe() or match_multiple_datasets(), or its long form
+        (see combined_long)
     """
     # df = get_obj_if_Acc(df)
+    if is_long_form(df):
+        return _reduce_long(df, show_orig_names=show_orig_names)
 
     # define which databases are present and get their reliability_score
     sources = df.columns.levels[1]
     rel_scores = pd.Series({s: CONFIG[s]['reliability_score'] for s in sources})\
                    .sort_values(ascending=False)
     cols = CONFIG['target_columns']
-    props_for_groups = {col: 'first'
-                        for col in cols}
-    props_for_groups.update({'YearCommisisoned': 'min',
-                             'DateRetrofit': 'max',
-                             'projectID': lambda x: dict(x.droplevel(0).dropna()),
-                             'eic_code': 'unique'})
-    props_for_groups = pd.Series(props_for_groups)[cols].to_dict()
-
-    # set low priority on Fueltype 'Other'
-    # turn it since aggregating only possible for axis=0
-    sdf = df.replace({'Fueltype': {'Other': np.nan}})\
-            .stack(1).reindex(rel_scores.index, level=1)\
-            .groupby(level=0)\
-            .agg(props_for_groups)\
-            .replace({'Fueltype': {np.nan: 'Other'}})
+
+    # Entries without any value in any source do not make it into the result
+    df = df[df.notna().any(axis=1)]
+
+    reduced = {}
+    for col in cols:
+        block = df[col].reindex(columns=rel_scores.index)
+        if col == 'projectID':
+            reduced[col] = _project_id_dicts(block)
+        elif col == 'DateRetrofit':
+            reduced[col] = block.max(axis=1).to_numpy()
+        else:
+            reduced[col] = _first_valid(block)
+
+    sdf = pd.DataFrame(reduced, index=df.index, columns=cols)
+    # missing Fueltypes are set to 'Other'
+    sdf['Fueltype'] = sdf['Fueltype'].where(sdf['Fueltype'].notnull(), 'Other')
 
     if show_orig_names:
         sdf = sdf.assign(**dict(df.Name))
 
-    return sdf.pipe(clean_technology).reset_index(drop=True)
\ No newline at end of file
+    return sdf.pipe(clean_technology).reset_index(drop=True)
+
+def _reduce_long(long_df, show_orig_names=False):
+    """
+    reduce_matched_dataframe for the long form: rows are ordered by
+    reliability within each cluster, so that the first non-null value of
+    a cluster is the one of the most reliable dataset.
+    """
+    sources = long_df['dataset'].cat.categories
+    rel_scores = pd.Series({s: CONFIG[s]['reliability_score'] for s in sources})\
+                   .sort_values(ascending=False)
+    cols = CONFIG['target_columns']
+
+    rank = pd.Series(np.arange(len(rel_scores)), index=rel_scores.index)
+    long_df = (long_df.dropna(how='all', subset=[col for col in cols if col in long_df])
+               .assign(rank=lambda df: df['dataset'].map(rank).astype(int))
+               .sort_values(['cluster_id', 'rank'], kind='mergesort'))
+
+    grouped = long_df.reindex(columns=['cluster_id'] + cols).groupby('cluster_id', sort=True)
+    sdf = grouped.first().reindex(columns=cols)
+    # integers become float as in the wide form, where absent datasets are NaN
+    sdf = sdf.astype({col: float for col in sdf.columns if sdf[col].dtype.kind in 'iu'})
+    if 'DateRetrofit' in cols:
+        sdf['DateRetrofit'] = grouped['DateRetrofit'].max()
+
+    if 'projectID' in cols:
+        ids = long_df.dropna(subset=['projectID'])
+        dicts = {cluster_id: {} for cluster_id in sdf.index}
+        for cluster_id, ds_name, project_id in zip(ids['cluster_id'], ids['dataset'], ids['projectID']):
+            dicts[cluster_id][ds_name] = project_id
+        sdf['projectID'] = [dicts[cluster_id] for cluster_id in sdf.index]
+
+    # missing Fueltypes are set to 'Other'
+    sdf['Fueltype'] = sdf['Fueltype'].where(sdf['Fueltype'].notnull(), 'Other')
+
+    if show_orig_names:
+        names = long_df.pivot(index='cluster_id', columns='dataset', values='Name')
+        sdf = sdf.assign(**{str(ds_name): names[ds_name] for ds_name in names.columns})
+
+    return sdf.pipe(clean_technology).reset_index(drop=True)
@@ -0,0 +1,121 @@
+/*
+  Batched counterpart of no.priv.garshol.duke.DebugCompare, used by
+  duke.duke_pairs_data.
+
+      java BatchDebugCompare [--reindex] <cfgfile> <pairsfile>
+
+  The config and its records are loaded (and indexed) once; then every line
+  <id1> TAB <id2> of <pairsfile> is compared exactly as DebugCompare does,
+  the output of each pair being preceded by a line
+
+      === <id1> TAB <id2>
+
+  Pairs with an id that is not found get no output after their header (the
+  reason goes to stderr).
+*/
+
+import java.io.BufferedReader;
+import java.io.FileInputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.util.Collection;
+
+import org.xml.sax.SAXException;
+
+import no.priv.garshol.duke.AbstractCmdlineTool;
+import no.priv.garshol.duke.Comparator;
+import no.priv.garshol.duke.DukeException;
+import no.priv.garshol.duke.Property;
+import no.priv.garshol.duke.Record;
+import no.priv.garshol.duke.utils.Utils;
+
+public class BatchDebugCompare extends AbstractCmdlineTool {
+
+  public static void main(String[] argv) throws IOException, SAXException {
+    new BatchDebugCompare().run(argv);
+  }
+
+  public void run(String[] argv) throws IOException, SAXException {
+    argv = init(argv, 2, 2, null);
+
+    BufferedReader pairs = new BufferedReader(
+      new InputStreamReader(new FileInputStream(argv[1]), "UTF-8"));
+    String line;
+    while ((line = pairs.readLine()) != null) {
+      if (line.trim().isEmpty())
+        continue;
+
+      String[] ids = line.split("\t");
+      System.out.println("=== " + ids[0] + "\t" + ids[1]);
+      compare(ids[0], ids[1]);
+    }
+    pairs.close();
+    System.out.flush();
+  }
+
+  // Same comparison and output as DebugCompare.run
+  private void compare(String id1, String id2) {
+    Record r1 = database.findRecordById(id1);
+    if (r1 == null) {
+      System.err.println("Couldn't find record for '" + id1 + "'");
+      return;
+    }
+    Record r2 = database.findRecordById(id2);
+    if (r2 == null) {
+      System.err.println("Couldn't find record for '" + id2 + "'");
+      return;
+    }
+
+    double prob = 0.5;
+    for (Property prop : config.getProperties()) {
+      if (prop.isIdProperty())
+        continue;
+
+      String propname = prop.getName();
+      System.out.println("---" + propname);
+
+      Collection<String> vs1 = r1.getValues(propname);
+      Collection<String> vs2 = r2.getValues(propname);
+      if (vs1.isEmpty() || vs2.isEmpty())
+        continue;
+      if (prop.isIgnoreProperty())
+        continue;
+
+      double high = 0.0;
+      for (String v1 : vs1) {
+        if (v1.equals(""))
+          continue;
+        for (String v2 : vs2) {
+          if (v2.equals(""))
+            continue;
+          try {
+            Comparator comp = prop.getComparator();
+            if (comp == null) {
+              high = 0.5;
+              break;
+            }
+            double d = comp.compare(v1, v2);
+            double p = prop.compare(v1, v2);
+            System.out.println("'" + v1 + "' ~ '" + v2 + "': " + d + " (prob " + p + ")");
+            high = Math.max(high, p);
+          } catch (Exception e) {
+            throw new DukeException("Comparison of values '" + v1 + "' and '" + v2 + "' failed", e);
+          }
+        }
+      }
+
+      double newprob = Utils.computeBayes(prob, high);
+      System.out.println("Result: " + prob + " -> " + newprob + "\n");
+      prob = newprob;
+    }
+
+    System.out.println("Overall: " + prob);
+  }
+
+  protected void usage() {
+    System.out.println("");
+    System.out.println("java BatchDebugCompare <cfgfile> <pairsfile>");
+    System.out.println("");
+    System.out.println("  --reindex: Reindex all records before comparing");
+  }
+}
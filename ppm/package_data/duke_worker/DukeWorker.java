@@ -0,0 +1,101 @@
+/*
+  Long-lived Duke worker used by duke.DukePool.
+
+  Reads one job per line from stdin, runs the regular Duke command-line
+  entry point inside this JVM and reports back on stdout. Job line format
+  (tab-separated):
+
+      <job_id> <work_dir> <duke arg 1> <duke arg 2> ...
+
+  The stdout / stderr of each job are written to duke_stdout.txt and
+  duke_stderr.txt in <work_dir>. On completion the worker prints
+
+      DONE <job_id> <status>
+
+  where status is one of OK, EXIT (Duke called System.exit) or ERROR.
+  All file paths handed to Duke (config, linkfile, input files inside the
+  config) must be absolute, as the JVM working directory never changes.
+*/
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.security.Permission;
+import java.util.Arrays;
+
+public class DukeWorker {
+
+  private static class ExitTrappedException extends SecurityException {
+    ExitTrappedException(int status) {
+      super("System.exit(" + status + ") trapped");
+    }
+  }
+
+  private static class NoExitSecurityManager extends SecurityManager {
+    public void checkPermission(Permission perm) {
+    }
+
+    public void checkPermission(Permission perm, Object context) {
+    }
+
+    public void checkExit(int status) {
+      throw new ExitTrappedException(status);
+    }
+  }
+
+  public static void main(String[] argv) throws IOException {
+    PrintStream protocol = System.out;
+    PrintStream origErr = System.err;
+
+    // Duke only exits on usage errors, but those must not take down the pool.
+    // Newer JVMs refuse to install a security manager; the pool then simply
+    // restarts a worker that died.
+    try {
+      System.setSecurityManager(new NoExitSecurityManager());
+    } catch (UnsupportedOperationException e) {
+      origErr.println("DukeWorker: cannot trap System.exit on this JVM");
+    }
+
+    BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+    protocol.println("READY");
+    protocol.flush();
+
+    String line;
+    while ((line = in.readLine()) != null) {
+      if (line.trim().isEmpty())
+        continue;
+
+      String[] fields = line.split("\t");
+      String jobId = fields[0];
+      File workDir = new File(fields[1]);
+      String[] args = Arrays.copyOfRange(fields, 2, fields.length);
+
+      String status = "OK";
+      PrintStream out = new PrintStream(new FileOutputStream(new File(workDir, "duke_stdout.txt")), true, "UTF-8");
+      PrintStream err = new PrintStream(new FileOutputStream(new File(workDir, "duke_stderr.txt")), true, "UTF-8");
+      System.setOut(out);
+      System.setErr(err);
+      try {
+        no.priv.garshol.duke.Duke.main(args);
+      } catch (ExitTrappedException e) {
+        err.println("Error: " + e.getMessage());
+        status = "EXIT";
+      } catch (Throwable t) {
+        err.println("Error: " + t);
+        t.printStackTrace(err);
+        status = "ERROR";
+      } finally {
+        System.setOut(protocol);
+        System.setErr(origErr);
+        out.close();
+        err.close();
+      }
+
+      protocol.println("DONE\t" + jobId + "\t" + status);
+      protocol.flush();
+    }
+  }
+}
@@ -0,0 +1,127 @@
+"""
+Store of all candidate link scores per dataset pair. With
+config.yaml:score_store enabled, linking runs at the lower recall_threshold
+without --singlematch and every candidate link is kept in a compressed
+columnar file (08_linked/scores/scores_<A>_<B>.npz). Matches and cross
+matches for any threshold above the recall threshold can then be derived
+from the store without running the matcher again.
+"""
+
+import os
+from os import path
+import logging
+
+import numpy as np
+import pandas as pd
+
+import globals as glob
+from globals import CONFIG, DATASET_LABELS, SUB_LINK
+
+logger = logging.getLogger(__name__)
+
+SCORES_SUB = path.join(SUB_LINK, 'scores')
+
+STORE_DEFAULTS = {'enabled': False,
+                  'recall_threshold': 0.8}
+
+def store_config():
+    """
+    Score store settings from config.yaml:score_store, completed by the defaults.
+    """
+    config = dict(STORE_DEFAULTS)
+    config.update(CONFIG.get('score_store') or {})
+    return config
+
+def _store_spec(ds_A, ds_B):
+
+    scores_dir = glob.set_path('.', SCORES_SUB)
+    os.makedirs(scores_dir, exist_ok=True)
+    ds_1, ds_2 = sorted([ds_A, ds_B])
+    return path.join(scores_dir, f"scores_{ds_1}_{ds_2}.npz")
+
+def _id_array(ids):
+
+    ids = np.asarray(ids)
+    if ids.dtype == object:
+        return ids.astype(str)
+    return ids
+
+def save(links, recall_threshold):
+    """
+    Save all candidate links of one dataset pair, as returned by the linking
+    function (columns [name of A, name of B, 'scores']).
+    """
+    ds_A, ds_B = links.columns[0], links.columns[1]
+    np.savez_compressed(_store_spec(ds_A, ds_B),
+                        labels=np.array([ds_A, ds_B]),
+                        id_A=_id_array(links[ds_A]),
+                        id_B=_id_array(links[ds_B]),
+                        scores=links['scores'].to_numpy(dtype=np.float64),
+                        recall_threshold=np.float64(recall_threshold))
+    logger.debug(f"Stored {len(links)} candidate links of {ds_A} - {ds_B}")
+
+def load(ds_A, ds_B):
+    """
+    All stored candidate links of a dataset pair as a dataframe with columns
+    [ds_A, ds_B, 'scores'], or None if the pair is not in the store.
+    """
+    store_spec = _store_spec(ds_A, ds_B)
+    if not path.exists(store_spec):
+        return None
+
+    with np.load(store_spec) as store:
+        label_A, label_B = store['labels']
+        links = pd.DataFrame({label_A: store['id_A'], label_B: store['id_B'],
+                              'scores': store['scores'].astype(float)})
+        recall_threshold = float(store['recall_threshold'])
+
+    links.attrs['recall_threshold'] = recall_threshold
+    return links.reindex(columns=[ds_A, ds_B, 'scores'])
+
+def singlematch(links):
+    """
+    Best link of each record of the first dataset, as Duke's --singlematch.
+    """
+    return (links.sort_values('scores', ascending=False, kind='mergesort')
+                 .drop_duplicates(subset=links.columns[0])
+                 .sort_index())
+
+def links_at(ds_A, ds_B, threshold):
+    """
+    Links of a dataset pair as the matcher would have returned them at the
+    given threshold (--singlematch applied).
+    """
+    links = load(ds_A, ds_B)
+    if links is None:
+        raise FileNotFoundError(f"No stored scores for {ds_A} - {ds_B}, "
+                                "link with config.yaml:score_store enabled first")
+    if threshold < links.attrs['recall_threshold']:
+        logger.warning(f"Threshold {threshold} is below the recall threshold "
+                       f"{links.attrs['recall_threshold']} of the stored scores of {ds_A} - {ds_B}")
+
+    return singlematch(links[links.scores > threshold])
+
+def matches_at(ds_A, ds_B, threshold, mode=None):
+    """
+    One-to-one matches of a dataset pair at the given threshold (see
+    match.best_matches for mode).
+    """
+    from match import best_matches
+
+    return best_matches(links_at(ds_A, ds_B, threshold), mode=mode)
+
+def cross_matches_at(threshold, labels=None, mode=None):
+    """
+    Cross matches of all stored dataset pairs among labels (default:
+    DATASET_LABELS) at the given threshold.
+    """
+    from match import cross_matches
+
+    labels = DATASET_LABELS if labels is None else labels
+    all_matches = []
+    for i, ds_A in enumerate(labels):
+        for ds_B in labels[i + 1:]:
+            if path.exists(_store_spec(ds_A, ds_B)):
+                all_matches.append(matches_at(ds_A, ds_B, threshold, mode=mode))
+
+    return cross_matches(all_matches, labels)
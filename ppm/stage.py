@@ -181,7 +181,7 @@ def google_search(in_dfs, force_refresh=False, run_diag=False):
 
     return out_dfs
 
-def tag_cliques(in_dfs=None, run_diag=False):
+def tag_cliques(in_dfs=None, run_diag=False, use_saved_dukemap=True):
 
     if in_dfs is None:
         in_dfs = _load_previous_stage(SUB_CLEAN, TAG_CLEAN, index_col='projectID')        
@@ -191,7 +191,7 @@ def tag_cliques(in_dfs=None, run_diag=False):
     for df in in_dfs:
         ds_name = df.columns.name
         ds_config = CONFIG[ds_name]
-        df = augment.tag_cliques_for_single_ds(df)
+        df = augment.tag_cliques_for_single_ds(df, use_saved_dukemap=use_saved_dukemap)
 
         if run_diag:
             issues_dict.update(diag.build_intraset_issues_dict(df))
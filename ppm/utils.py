@@ -3,6 +3,9 @@ Utility functions for checking data completness and supporting other functions
 """
 
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
 import globals as glob
@@ -213,11 +216,25 @@ def lookup(df, keys=None, by='Country, Fueltype', exclude=None, unit='MW'):
     else:
         return (lookup_single(df)/scaling).fillna(0.).round(3)
 
-def parmap(f, arg_list):
+# Set in the threads of bounded_map, nested maps run serially there
+_map_worker = threading.local()
+
+def max_parallel_jobs():
+    """
+    The one concurrency budget for all (java) linking jobs: process_limit,
+    but no more than the number of cpus, if config.yaml:parallel_duke_processes
+    is set, 1 otherwise.
+    """
+    if not CONFIG.get('parallel_duke_processes', False):
+        return 1
+    return max(1, min(os.cpu_count() or 1, CONFIG.get('process_limit', 1)))
+
+def parmap(f, arg_list, weights=None, labels=None):
     """
     Parallel mapping function. Use this function to parallely map function
-    f onto arguments in arg_list. The maximum number of parallel threads is
-    taken from config.yaml:parallel_duke_processes.
+    f onto arguments in arg_list. Runs in parallel if
+    config.yaml:parallel_duke_processes is set, with at most process_limit
+    (and no more than the number of cpus) parallel threads, see bounded_map.
 
     Paramters
     ---------
@@ -226,30 +243,86 @@ def parmap(f, arg_list):
         python funtion with one argument
     arg_list : list
         list of arguments mapped to f
+    weights : list, default None
+        estimated cost of each job, largest jobs are started first
+    labels : list, default None
+        names of the jobs for timing logs and error messages
     """
 
-    if CONFIG['parallel_duke_processes']:
-        nprocs = min(multiprocessing.cpu_count(), CONFIG['process_limit'])
+    nprocs = max_parallel_jobs()
+    if nprocs > 1:
         logger.info('Run process with {} parallel threads.'.format(nprocs))
-        q_in = multiprocessing.Queue(1)
-        q_out = multiprocessing.Queue()
 
-        proc = [multiprocessing.Process(target=fun, args=(f, q_in, q_out))
-                for _ in range(nprocs)]
-        for p in proc:
-            p.daemon = True
-            p.start()
+    return bounded_map(f, arg_list, weights=weights, labels=labels, max_workers=nprocs)
+
+def bounded_map(f, arg_list, weights=None, max_workers=None, labels=None):
+    """
+    Map function f onto arguments in arg_list with a bounded pool of worker
+    threads (the work itself runs in java subprocesses or numpy, so threads
+    suffice). Jobs with the largest weights are started first, to avoid a
+    big job starting last and dominating the run time. Results are returned
+    in the order of arg_list.
 
-        sent = [q_in.put((i, x)) for i, x in enumerate(arg_list)]
-        [q_in.put((None, None)) for _ in range(nprocs)]
-        res = [q_out.get() for _ in range(len(sent))]
+    All maps share the budget of max_parallel_jobs: a bounded_map called
+    from within a job of another (e.g. the per-country runs of a dataset
+    pair of parmap) runs serially, so nested maps never start more than
+    max_parallel_jobs java processes together.
 
-        [p.join() for p in proc]
+    The run time of every job is logged. If a job fails, the remaining jobs
+    are cancelled and a RuntimeError naming the failed job is raised.
 
-        return [x for i, x in sorted(res)]
+    Parameters
+    ----------
+    f : function
+        python function with one argument
+    arg_list : list
+        list of arguments mapped to f
+    weights : list, default None
+        estimated cost of each job, e.g. number of records
+    max_workers : int, default None
+        number of parallel jobs, defaults to max_parallel_jobs()
+    labels : list, default None
+        names of the jobs for timing logs and error messages
+    """
+    if max_workers is None:
+        max_workers = max_parallel_jobs()
+    if getattr(_map_worker, 'active', False):
+        max_workers = 1
+    if weights is None:
+        weights = [0] * len(arg_list)
+    if labels is None:
+        labels = [f"job {i}" for i in range(len(arg_list))]
+
+    order = sorted(range(len(arg_list)), key=lambda i: weights[i], reverse=True)
+
+    def timed(i):
+        start = time.perf_counter()
+        nested = getattr(_map_worker, 'active', False)
+        _map_worker.active = nested or in_pool
+        try:
+            result = f(arg_list[i])
+        except Exception as e:
+            raise RuntimeError(f"{labels[i]} failed: {e}") from e
+        finally:
+            _map_worker.active = nested
+        logger.info(f"{labels[i]} done in {time.perf_counter() - start:.1f} s")
+        return result
+
+    in_pool = max_workers > 1 and len(arg_list) > 1
+    if not in_pool:
+        results = {i: timed(i) for i in order}
 
     else:
-        return list(map(f, arg_list))
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(arg_list))) as executor:
+            futures = {i: executor.submit(timed, i) for i in order}
+            try:
+                results = {i: future.result() for i, future in futures.items()}
+            except Exception:
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+    return [results[i] for i in range(len(arg_list))]
 
 def parse_Geoposition(location, zipcode='', country='', use_saved_locations=False, saved_only=False):
     """
@@ -0,0 +1,7 @@
+import sys
+from os import path
+
+# The ppm modules import each other by their flat module names, and globals
+# imports the package itself
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path[:0] = [path.join(ROOT_DIR, 'ppm'), ROOT_DIR]
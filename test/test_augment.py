@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import augment
+
+
+def both_ways(pairs):
+    one = [a for a, b in pairs] + [b for a, b in pairs]
+    two = [b for a, b in pairs] + [a for a, b in pairs]
+    return one, two
+
+
+def groups(labels):
+    return sorted(sorted(np.flatnonzero(labels == label).tolist()) for label in np.unique(labels))
+
+
+@pytest.mark.parametrize('overlap', ['largest', 'strongest'])
+def test_groups_are_cliques_of_reciprocal_links(overlap):
+    rng = np.random.default_rng(2)
+    n_nodes = 60
+    one, two = both_ways(rng.integers(n_nodes, size=(150, 2)).tolist())
+    # Some links only one way, they must not group their units
+    one_way = rng.integers(n_nodes, size=(40, 2))
+    one, two = one + one_way[:, 0].tolist(), two + one_way[:, 1].tolist()
+    scores = rng.random(len(one))
+
+    labels = augment.group_labels(n_nodes, one, two, scores, mode='cliques', overlap=overlap,
+                                  max_component_size=n_nodes)
+    assert len(labels) == n_nodes
+    assert sorted(np.unique(labels)) == list(range(labels.max() + 1))
+
+    graph = augment.reciprocal_links(n_nodes, np.array(one), np.array(two), scores).toarray() > 0
+    assert any(len(group) > 2 for group in groups(labels))
+    for group in groups(labels):
+        for i, a in enumerate(group):
+            assert all(graph[a, b] for b in group[i + 1:])
+
+
+def test_single_link_groups_two_units():
+    one, two = both_ways([(3, 1)])
+    labels = augment.group_labels(5, one, two, mode='cliques', max_component_size=10)
+    assert groups(labels) == [[0], [1, 3], [2], [4]]
+
+    # Also next to a component that has to be split into cliques
+    one, two = both_ways([(0, 1), (1, 2), (3, 4)])
+    labels = augment.group_labels(5, one, two, mode='cliques', max_component_size=10)
+    assert [3, 4] in groups(labels)
+    assert labels[0] != labels[2]
+
+    # A link in one direction only groups nothing
+    labels = augment.group_labels(3, [0], [1], mode='cliques', max_component_size=10)
+    assert groups(labels) == [[0], [1], [2]]
+
+
+def test_components_mode_and_large_components():
+    one, two = both_ways([(0, 1), (1, 2), (3, 4)])
+    assert groups(augment.group_labels(6, one, two, mode='components')) == [[0, 1, 2], [3, 4], [5]]
+    assert groups(augment.group_labels(6, one, two, mode='cliques', max_component_size=2)) == \
+        [[0, 1, 2], [3, 4], [5]]
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import blocking
+import linkage
+from globals import CONFIG
+
+
+def _plants(name, seed, n=40):
+    rng = np.random.RandomState(seed)
+    words = ['nord', 'sud', 'wind', 'solar', 'kraftwerk', 'lake', 'river', 'hill', 'park', 'gas']
+    names = [' '.join(rng.choice(words, 2)) + f' {i % 7}' for i in range(n)]
+    lat = 50 + rng.rand(n) * 0.2
+    lon = 8 + rng.rand(n) * 0.2
+    df = pd.DataFrame({'Name': names, 'PlantName': names, 'KeywordName': names,
+                       'Fueltype': rng.choice(['Wind', 'Solar', 'Natural Gas'], n),
+                       'Technology': rng.choice(['Onshore', 'PV', 'CCGT'], n),
+                       'Country': 'Germany',
+                       'Capacity': rng.choice([1, 5, 50, 500], n) * (1 + rng.rand(n) / 10),
+                       'lat': lat, 'lon': lon,
+                       'Geoposition': [f"{a},{o}" for a, o in zip(lat, lon)]},
+                      index=pd.Index([f"{name}{i}" for i in range(n)], name='projectID'))
+    df.columns.name = name
+    return df
+
+
+@pytest.fixture
+def plants():
+    df_A = _plants('A', 0)
+    # B: the same plants, moved by up to ~1 km and with changed capacities
+    df_B = _plants('B', 0)
+    df_B[['lat', 'lon']] += 0.005
+    df_B['Geoposition'] = [f"{a},{o}" for a, o in zip(df_B.lat, df_B.lon)]
+    df_B['Capacity'] = df_B.Capacity.to_numpy()[::-1]
+    return df_A, df_B
+
+
+def _with_blocking(monkeypatch, **settings):
+    monkeypatch.setitem(CONFIG, 'blocking', dict(blocking.BLOCKING_DEFAULTS, **settings))
+
+
+def test_blocking_disabled_by_default():
+    assert not blocking.BLOCKING_DEFAULTS['enabled']
+    assert not blocking.BLOCKING_DEFAULTS['capacity_bands_per_decade']
+
+
+def test_blocking_keeps_linked_pairs(monkeypatch, plants):
+    df_A, df_B = plants
+
+    _with_blocking(monkeypatch, enabled=False)
+    links = linkage.link_datasets(df_A, df_B, singlematch=False, threshold=0.5)
+    cliques = linkage.find_cliques(pd.concat([df_A, df_B]).rename_axis(columns='AB'))
+
+    _with_blocking(monkeypatch, enabled=True)
+    blocked_links = linkage.link_datasets(df_A, df_B, singlematch=False, threshold=0.5)
+    blocked_cliques = linkage.find_cliques(pd.concat([df_A, df_B]).rename_axis(columns='AB'))
+
+    assert len(links) > 0 and len(cliques) > 0
+    pd.testing.assert_frame_equal(links.sort_values(['A', 'B']).reset_index(drop=True),
+                                  blocked_links.sort_values(['A', 'B']).reset_index(drop=True))
+    pd.testing.assert_frame_equal(cliques.sort_values(['one', 'two']).reset_index(drop=True),
+                                  blocked_cliques.sort_values(['one', 'two']).reset_index(drop=True))
+
+
+def test_capacity_bands_only_for_decisive_capacity(monkeypatch):
+    _with_blocking(monkeypatch, enabled=True, capacity_bands_per_decade=2)
+    assert blocking.capacity_bands_apply(linkage.load_duke_schema("duke_find_links.xml"))
+    assert not blocking.capacity_bands_apply(linkage.load_duke_schema("duke_find_cliques.xml"))
+
+    _with_blocking(monkeypatch, enabled=True)
+    assert not blocking.capacity_bands_apply(linkage.load_duke_schema("duke_find_links.xml"))
@@ -0,0 +1,106 @@
+import ast
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cleaning_functions as cf
+from cleaning_functions import gather_set_info, gather_technology_info
+
+
+def test_gather_technology_info_without_technology_column():
+    df = pd.DataFrame({'OrigName': ['foo', 'bar CCGT'], 'Fueltype': ['Hydro', 'Gas']})
+    out = gather_technology_info(df)
+    assert out.Technology.isna().iloc[0]
+    assert out.Technology.iloc[1] == 'CCGT'
+
+    none_found = gather_technology_info(df.iloc[:1])
+    assert none_found.Technology.isna().all()
+
+
+def test_gather_technology_info_all_nan_technology():
+    df = pd.DataFrame({'OrigName': ['foo', 'Pumped Storage'], 'Fueltype': ['Hydro', 'PV'],
+                       'Technology': [np.nan, np.nan]})
+    out = gather_technology_info(df)
+    assert out.Technology.isna().iloc[0]
+    assert out.Technology.iloc[1] == 'Pumped Storage, PV'
+    assert gather_set_info(out).Set.tolist() == ['PP', 'Store']
+
+
+def test_gather_type_info_classifies_each_column_once(monkeypatch):
+    df = pd.DataFrame({'OrigName': ['Lignite HKW', 'Pumped Storage', 'foo', np.nan],
+                       'Fueltype': ['Coal', 'Hydro', 'Natural Gas', 'Coal'],
+                       'FuelClassification1': ['brown coal', 'Reservoir', 'CCGT chp', 'Coal'],
+                       'Technology': [np.nan, np.nan, 'Steam Turbine', 'CCGT']})
+    expected = (df.pipe(cf.gather_fueltype_info, search_col=['FuelClassification1'])
+                  .pipe(cf.gather_technology_info, search_col=['FuelClassification1', 'Technology'])
+                  .pipe(cf.gather_set_info))
+
+    classified = []
+    type_hints = cf.type_hints
+    monkeypatch.setattr(cf, 'type_hints', lambda values: classified.append(len(values)) or type_hints(values))
+    out = cf.gather_type_info(df, fueltype_col=['FuelClassification1'],
+                              technology_col=['FuelClassification1', 'Technology'])
+
+    pd.testing.assert_frame_equal(out, expected)
+    # FuelClassification1, Technology, OrigName and Fueltype are scanned once, the
+    # set step only rescans the Technology rows changed by the technology step
+    assert classified == [4, 4, 4, 4, 3]
+
+
+FUEL_TREE = """fuel_label,fuel_level,fuel_genus,esource_id,black_coal_flag,syns,abbs,description
+coal,1,,COA,,,,
+bituminous coal,2,,COA,1,"{'bituminous', 'coal bituminous'}",,
+lignite,2,,COA,,{'brown coal'},,
+coal lignite black,3,lignite,COA,,,,
+natural gas,2,,GAS,,{'gas'},{'ng'},
+blast furnace gas,3,industrial gas,GAS,,,{'bfg'},
+fuel oil,2,,LIQ,,"{'heavy oil', 'oil'}",,
+diesel,2,,LIQ,,{'gas oil'},,
+biomass,2,,BIO,,,,
+biomass,3,wood,BIO,,,,
+"""
+
+FUEL_MODS = """from_word,to_word,note
+nat gas,natural gas,
+wood,biomass,
+"""
+
+
+@pytest.fixture
+def fuel_data(monkeypatch, tmp_path):
+    (tmp_path / 'fuel_tree.csv').write_text(FUEL_TREE, encoding='utf-8')
+    (tmp_path / 'fuel_mods.csv').write_text(FUEL_MODS, encoding='utf-8')
+    monkeypatch.setattr(cf.glob, 'package_data', lambda filename: str(tmp_path / filename))
+    cf.fuel_tables.cache_clear()
+    yield
+    cf.fuel_tables.cache_clear()
+
+
+def test_parse_fuel_cols_matches_row_wise_parsing(fuel_data, caplog):
+    df = pd.DataFrame({'Type': ['Coal', 'Gas', 'Oil', 'Bio', 'Hydro', 'Gas', 'Coal', 'Coal', 'Oil', 'Coal'],
+                       'Fuel1': ['Bituminous / Lignite', 'NG and BFG', np.nan, 'Wood (chips)', np.nan,
+                                 ' nat   gas ', 'Peat', 'brown coal, coal lignite black',
+                                 'Coal Lignite Black', 'Coal'],
+                       'Fuel2': [np.nan, 'Oil', 'Gas Oil', np.nan, np.nan, 'gas & coal', np.nan, np.nan,
+                                 np.nan, np.nan]},
+                      index=list('abcdefghij'))
+
+    with caplog.at_level(logging.WARNING):
+        out = cf.parse_fuel_cols(df, 'Type', 'Fuel1', 'Fuel2')
+
+    # Output of the former row-by-row parse_fuel_cols on the same data
+    assert out.PrimaryFuel.tolist() == ['bituminous coal', 'natural gas', 'diesel', 'biomass', 'hydro',
+                                        'natural gas', 'peat', 'lignite', 'coal lignite black', 'coal']
+    assert out.FuelSpecies.tolist() == [''] * 8 + ['coal lignite black', '']
+    assert out.FuelGenus.tolist() == ['bituminous coal', 'natural gas', 'diesel', '', '',
+                                      'natural gas', '', 'lignite', 'lignite', '']
+    assert out.esource_id.tolist() == ['COA', 'GAS', 'LIQ', '', '', 'GAS', '', 'COA', 'COA', 'COA']
+    secondary = [ast.literal_eval(fuels) if fuels else fuels for fuels in out.SecondaryFuels]
+    assert secondary == [{'lignite'}, {'fuel oil', 'blast furnace gas'}, '', {'chips'}, '',
+                         {'natural gas', 'coal'}, '', {'coal lignite black'}, '', '']
+
+    # Fuels without hierarchy (unknown or duplicated in the tree) in one warning
+    warnings = [r.getMessage() for r in caplog.records if 'fuel_tree.csv' in r.getMessage()]
+    assert warnings == ["Fuels not in fuel_tree.csv, no hierarchy assigned: ['biomass', 'hydro', 'peat']"]
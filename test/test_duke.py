@@ -0,0 +1,44 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import duke
+import globals as glob
+from globals import PACKAGE_CONFIG
+
+
+def test_split_batch_debug_output():
+    stdout = ("Reindexing all records...\n"
+              "=== a\tb\n---NAME\n'x' ~ 'x': 1.0 (prob 0.9)\nResult: 0.5 -> 0.9\n\nOverall: 0.9\n"
+              "=== a\tz\n")
+    texts = duke.split_batch_debug_output(stdout)
+    assert list(texts) == [('a', 'b'), ('a', 'z')]
+    assert texts[('a', 'b')].startswith("---NAME\n") and texts[('a', 'b')].endswith("Overall: 0.9\n")
+    assert texts[('a', 'z')] == ""
+
+
+@pytest.mark.skipif(shutil.which('java') is None or shutil.which('javac') is None,
+                    reason="needs java and javac")
+def test_batched_debug_compare_equals_per_pair(monkeypatch, tmp_path):
+    monkeypatch.setitem(PACKAGE_CONFIG, 'data_dir', str(tmp_path))
+    duke_config_fn = "duke_find_cliques.xml"
+    shutil.copyfile(glob.package_data(duke_config_fn), tmp_path / duke_config_fn)
+    pd.DataFrame({'projectID': ['p1', 'p2', 'p3', 'p4'],
+                  'PlantName': ['alpha', 'alpha nord', 'beta', 'alpha'],
+                  'Fueltype': ['wind', 'wind', 'hydro', 'wind'],
+                  'Technology': ['onshore', 'onshore', '', 'offshore'],
+                  'Country': ['Germany'] * 4,
+                  'Capacity': [10, 12, 'n/a', 10],
+                  'Geoposition': ['50.0,8.0', '50.01,8.0', '', '50.0,8.0']}
+                 ).to_csv(tmp_path / 'input.csv', index=False)
+
+    id_pairs = [('p1', 'p2'), ('p1', 'p3'), ('p2', 'p4'), ('p3', 'p4'), ('p1', 'unknown')]
+    batched = duke._debug_compare_pairs(str(tmp_path), duke_config_fn, id_pairs[:-1])
+    per_pair = duke._debug_compare_pairs(str(tmp_path), duke_config_fn, id_pairs[:-1], batched=False)
+    assert batched == per_pair
+
+    with_unknown = duke._debug_compare_pairs(str(tmp_path), duke_config_fn, id_pairs)
+    assert with_unknown[('p1', 'unknown')][0] == {}
+    assert np.isnan(with_unknown[('p1', 'unknown')][1])
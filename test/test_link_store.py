@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+import link_store
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(link_store, '_store_spec', lambda: str(tmp_path / link_store.STORE_FN))
+    return link_store
+
+
+def frame(name, ids, countries):
+    df = pd.DataFrame({'projectID': ids, 'Country': countries},
+                      index=[f"{name.lower()}{i}" for i in range(len(ids))])
+    df.columns.name = name
+    return df
+
+
+def test_pairwise_links_round_trip(store):
+    # B1 and B2 share the record id 'B-x'
+    df_A = frame('A', ['A-0', 'A-1', 'A-2'], ['DE', 'DE', 'FR'])
+    df_B = frame('B', ['B-0', 'B-x', 'B-x'], ['DE', 'DE', 'FR'])
+    links = pd.DataFrame({'A': ['a0', 'a1', 'a2'], 'B': ['b0', 'b1', 'b2'],
+                          'scores': [0.9, 0.7, 0.95]})
+    store.save_links('pairwise', links, df_A, df_B, engine='numpy')
+
+    stored = store.pair_links('A', 'B')
+    assert stored.columns.tolist() == ['A', 'B', 'scores', 'country']
+    assert sorted(zip(stored.A, stored.B, stored.scores, stored.country)) == [
+        ('A-0', 'B-0', 0.9, 'DE'), ('A-1', 'B-x', 0.7, 'DE'), ('A-2', 'B-x', 0.95, 'FR')]
+
+    swapped = store.pair_links('B', 'A', min_score=0.8)
+    assert sorted(zip(swapped.B, swapped.A)) == [('B-0', 'A-0'), ('B-x', 'A-2')]
+
+    # Back to index values the duplicated record id resolves to its first record only
+    back = store.to_index(stored.drop(columns='country'), df_A, df_B)
+    assert sorted(zip(back.A, back.B)) == [('a0', 'b0'), ('a1', 'b1'), ('a2', 'b1')]
+
+
+def test_new_run_replaces_links_of_the_pair(store):
+    df_A = frame('A', ['A-0', 'A-1'], ['DE', 'DE'])
+    df_B = frame('B', ['B-0', 'B-1'], ['DE', 'DE'])
+    store.save_links('pairwise', pd.DataFrame({'A': ['a0'], 'B': ['b0'], 'scores': [0.9]}), df_A, df_B)
+    store.save_links('pairwise', pd.DataFrame({'B': ['b1'], 'A': ['a1'], 'scores': [0.8]}), df_B, df_A)
+
+    stored = store.pair_links('A', 'B')
+    assert list(zip(stored.A, stored.B)) == [('A-1', 'B-1')]
+    assert store.runs('pairwise').n_links.tolist() == [1, 1]
+
+
+def test_intraset_links_round_trip(store):
+    df = frame('C', ['C-0', 'C-1', 'C-1', 'C-3'], ['DE', 'DE', 'DE', 'FR'])
+    cliques = pd.DataFrame({'one': ['c0', 'c0', 'c3'], 'two': ['c1', 'c2', 'c3'],
+                            'scores': [0.9, 0.85, 0.99]})
+    store.save_links('intraset', cliques, df)
+    store.save_links('pairwise', pd.DataFrame({'C': ['c0'], 'D': ['d0']}), df,
+                     frame('D', ['D-0'], ['DE']))
+
+    stored = store.intraset_links('C')
+    assert stored.columns.tolist() == ['one', 'two', 'scores', 'country']
+    assert sorted(zip(stored.one, stored.two, stored.scores)) == [
+        ('C-0', 'C-1', 0.85), ('C-0', 'C-1', 0.9), ('C-3', 'C-3', 0.99)]
+
+    assert store.intraset_links('C', country='FR').one.tolist() == ['C-3']
+    assert len(store.intraset_links('C', min_score=0.88)) == 2
+    assert len(store.links_for('C-0')) == 3
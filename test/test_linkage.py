@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+import linkage
+
+
+def test_geoposition_matches_duke():
+    # 3 km apart (along a meridian) with max-distance 5000: 0.5 + 0.5 * (1 - 3/5)
+    lat_b = np.degrees(3000 / linkage.EARTH_RADIUS_M)
+    sim = linkage._compare_geoposition(np.array([0.0, 0.0, 0.0]), np.zeros(3),
+                                       np.array([0.0, lat_b, 1.0]), np.zeros(3),
+                                       {'max-distance': 5000})
+    np.testing.assert_allclose(sim, [1.0, 0.7, 0.0])
+
+
+def test_numeric_unparseable_scores_half():
+    schema = {'id_property': 'ID',
+              'groups': [[{'columns': {'Capacity': ('CAPACITY', None)}}]],
+              'properties': {'CAPACITY': {'comparator': 'NumericComparator', 'params': {},
+                                          'low': 0.4, 'high': 0.6}}}
+    df = pd.DataFrame({'Capacity': ['100', '80', 'n/a', '', None]})
+    records = linkage.schema_records(df, schema)
+
+    pos_a, pos_b = np.array([0, 0, 0, 0]), np.array([1, 2, 3, 4])
+    sim, valid = linkage.property_similarity('CAPACITY', schema['properties']['CAPACITY'],
+                                             records, records, pos_a, pos_b)
+    np.testing.assert_array_equal(valid, [True, True, False, False])
+    np.testing.assert_allclose(sim[valid], [0.8, 0.5])
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import match
+
+
+def make_links(rows):
+    return pd.DataFrame(rows, columns=['A', 'B', 'scores'])
+
+
+def pairs(matches):
+    return sorted(zip(matches.A, matches.B))
+
+
+# a1 is the best link of b1 and b2, a2 - b2 is the next link
+CHAIN = make_links([('a1', 'b1', 0.9), ('a1', 'b2', 0.8), ('a2', 'b2', 0.7)])
+
+
+def test_greedy_matches_chain():
+    assert pairs(match.best_matches(CHAIN, mode='greedy')) == [('a1', 'b1'), ('a2', 'b2')]
+
+
+def test_greedy_matches_ties_keep_first_link():
+    links = make_links([('a1', 'b1', 0.9), ('a2', 'b1', 0.9), ('a2', 'b2', 0.9), ('a1', 'b2', 0.9)])
+    assert pairs(match.best_matches(links, mode='greedy')) == [('a1', 'b1'), ('a2', 'b2')]
+
+
+def test_mutual_matches():
+    assert pairs(match.best_matches(CHAIN, mode='mutual')) == [('a1', 'b1')]
+
+    # On ties the first link is the best one, a2 - b2 is not the best link of a2
+    ties = make_links([('a1', 'b1', 0.9), ('a2', 'b1', 0.9), ('a2', 'b2', 0.5)])
+    assert pairs(match.best_matches(ties, mode='mutual')) == [('a1', 'b1')]
+
+
+def test_assignment_matches_maximise_total_score():
+    links = make_links([('a1', 'b1', 0.9), ('a1', 'b2', 0.85), ('a2', 'b1', 0.8)])
+    assert pairs(match.best_matches(links, mode='greedy')) == [('a1', 'b1')]
+    assert pairs(match.best_matches(links, mode='assignment')) == [('a1', 'b2'), ('a2', 'b1')]
+
+    assert pairs(match.best_matches(CHAIN, mode='assignment')) == [('a1', 'b1'), ('a2', 'b2')]
+
+    ties = make_links([('a1', 'b1', 0.9), ('a2', 'b1', 0.9), ('a1', 'b2', 0.9)])
+    assert len(match.best_matches(ties, mode='assignment')) == 2
+
+
+@pytest.mark.parametrize('mode', ['greedy', 'mutual', 'assignment'])
+def test_best_matches_are_one_to_one(mode):
+    rng = np.random.default_rng(0)
+    links = make_links({'A': rng.integers(20, size=200), 'B': rng.integers(20, size=200),
+                        'scores': rng.choice([0.6, 0.7, 0.8, 0.9], size=200)})
+    links = links.drop_duplicates(subset=['A', 'B'])
+
+    matches = match.best_matches(links, mode=mode)
+    assert not matches.A.duplicated().any() and not matches.B.duplicated().any()
+    assert matches.merge(links).shape[0] == len(matches)
+
+    # No link could be added to the greedy matches without reusing an id
+    if mode == 'greedy':
+        free = links[~links.A.isin(matches.A) & ~links.B.isin(matches.B)]
+        assert free.empty
+
+
+def test_best_matches_unknown_mode():
+    with pytest.raises(ValueError, match='Unknown best_matches mode'):
+        match.best_matches(CHAIN, mode='best')
+
+
+def pairwise_merge(sets_of_pairs, df_labels):
+    # cross_matches before the graph-based rewrite, as reference
+    matches = pd.DataFrame(columns=df_labels)
+    for i in df_labels:
+        base = [m.set_index(i) for m in sets_of_pairs if i in m]
+        matches = pd.concat([matches, pd.concat(base, axis=1).reset_index()], sort=True)
+
+    matches = matches.drop_duplicates().reset_index(drop=True)
+    for i in df_labels:
+        matches = pd.concat([
+            matches.groupby(i, as_index=False, sort=False)
+                   .apply(lambda x: x.loc[x.isnull().sum(axis=1).idxmin()]),
+            matches[matches[i].isnull()]
+        ]).reset_index(drop=True)
+    return matches.reindex(columns=df_labels)
+
+
+def rows(matches):
+    return sorted(tuple(sorted(row.dropna().items())) for _, row in matches.iterrows())
+
+
+def test_cross_matches_equal_pairwise_merge():
+    sets_of_pairs = [pd.DataFrame({'A': ['a1', 'a2', 'a3'], 'B': ['b1', 'b2', 'b3']}),
+                     pd.DataFrame({'B': ['b1', 'b2', 'b4'], 'C': ['c1', 'c2', 'c4']}),
+                     pd.DataFrame({'A': ['a1', 'a5'], 'C': ['c1', 'c5']})]
+
+    matches = match.cross_matches(sets_of_pairs, ['A', 'B', 'C'])
+    assert matches.columns.tolist() == ['A', 'B', 'C']
+    assert rows(matches) == rows(pairwise_merge(sets_of_pairs, ['A', 'B', 'C']))
+    assert matches.notna().sum(axis=1).tolist() == [3, 3, 2, 2, 2]
+
+
+def test_cross_matches_split_conflicts_by_score():
+    # a1 and a2 end up in one component through c1, the weakest link b1 - c1 is cut
+    sets_of_pairs = [pd.DataFrame({'A': ['a1'], 'B': ['b1'], 'scores': [0.9]}),
+                     pd.DataFrame({'B': ['b1'], 'C': ['c1'], 'scores': [0.8]}),
+                     pd.DataFrame({'A': ['a2'], 'C': ['c1'], 'scores': [0.95]})]
+
+    matches = match.cross_matches(sets_of_pairs, ['A', 'B', 'C'])
+    assert rows(matches) == [(('A', 'a1'), ('B', 'b1')), (('A', 'a2'), ('C', 'c1'))]
+
+
+def test_cross_matches_one_record_per_dataset():
+    rng = np.random.default_rng(1)
+    labels = ['A', 'B', 'C', 'D']
+    sets_of_pairs = []
+    for ds_1, ds_2 in [('A', 'B'), ('A', 'C'), ('B', 'C'), ('C', 'D'), ('B', 'D')]:
+        links = pd.DataFrame({ds_1: [f"{ds_1.lower()}{i}" for i in rng.integers(15, size=30)],
+                              ds_2: [f"{ds_2.lower()}{i}" for i in rng.integers(15, size=30)],
+                              'scores': rng.random(30)})
+        sets_of_pairs.append(links.drop_duplicates(subset=[ds_1, ds_2]))
+
+    matches = match.cross_matches(sets_of_pairs, labels)
+
+    # Every linked id is in exactly one row, a row holds one id per dataset
+    for ds in labels:
+        ids = pd.concat([m[ds] for m in sets_of_pairs if ds in m]).unique()
+        assert sorted(matches[ds].dropna()) == sorted(ids)
+
+    # Each row is connected by the links between its ids
+    edges = {frozenset([(m.columns[0], a), (m.columns[1], b)])
+             for m in sets_of_pairs for a, b in zip(m.iloc[:, 0], m.iloc[:, 1])}
+    for _, row in matches.iterrows():
+        nodes = list(row.dropna().items())
+        reached, todo = {nodes[0]}, [nodes[0]]
+        while todo:
+            node = todo.pop()
+            for other in nodes:
+                if other not in reached and frozenset([node, other]) in edges:
+                    reached.add(other)
+                    todo.append(other)
+        assert reached == set(nodes)
@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+import score_store
+
+
+def test_stored_scores_replay_at_threshold(monkeypatch, tmp_path):
+    monkeypatch.setattr(score_store, '_store_spec',
+                        lambda ds_A, ds_B: str(tmp_path / f"scores_{'_'.join(sorted([ds_A, ds_B]))}.npz"))
+    links = pd.DataFrame({'A': ['a1', 'a2'], 'B': ['b1', 'b2'], 'scores': [0.96, 0.97]})
+    score_store.save(links, recall_threshold=0.8)
+
+    stored = score_store.load('A', 'B')
+    np.testing.assert_array_equal(stored.scores.to_numpy(), links.scores.to_numpy())
+
+    # A fresh run keeps a link scoring just above the threshold, so must the replay
+    threshold = 0.96 - 1e-12
+    fresh = links[links.scores > threshold]
+    replay = score_store.links_at('A', 'B', threshold)
+    assert replay.A.tolist() == fresh.A.tolist()
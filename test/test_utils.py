@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+import utils
+
+
+def test_bounded_map_largest_first_results_in_order():
+    started = []
+    lock = threading.Lock()
+
+    def job(x):
+        with lock:
+            started.append(x)
+        time.sleep(0.01 * (x % 3))
+        return x * 10
+
+    weights = [1, 5, 3, 4, 2]
+    results = utils.bounded_map(job, [0, 1, 2, 3, 4], weights=weights, max_workers=1)
+    assert results == [0, 10, 20, 30, 40]
+    assert started == [1, 3, 2, 4, 0]
+
+    results = utils.bounded_map(job, [0, 1, 2, 3, 4], weights=weights, max_workers=3)
+    assert results == [0, 10, 20, 30, 40]
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_bounded_map_failure_names_the_job(max_workers):
+    def job(x):
+        if x == 'DE':
+            raise ValueError('no records')
+        return x
+
+    with pytest.raises(RuntimeError, match="DE_FR failed: no records") as error:
+        utils.bounded_map(job, ['FR', 'DE', 'PL'], labels=['FR_PL', 'DE_FR', 'PL_CZ'],
+                          max_workers=max_workers)
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+def test_nested_bounded_map_runs_serially():
+    running = {'inner': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def inner(x):
+        with lock:
+            running['inner'] += 1
+            running['peak'] = max(running['peak'], running['inner'])
+        time.sleep(0.01)
+        with lock:
+            running['inner'] -= 1
+        return threading.get_ident()
+
+    def outer(x):
+        threads = utils.bounded_map(inner, range(3), max_workers=4)
+        return set(threads) == {threading.get_ident()}
+
+    results = []
+    runner = threading.Thread(target=lambda: results.extend(
+        utils.bounded_map(outer, range(2), max_workers=2)))
+    runner.start()
+    runner.join(timeout=10)
+
+    assert not runner.is_alive(), "nested bounded_map did not finish"
+    # Inner maps run in the thread of their outer job, at most one per outer job
+    assert results == [True, True]
+    assert running['peak'] <= 2